@@ -25,7 +25,8 @@ def create_app():
     Call this from the WSGI / run entry points. Importing this package alone
     does not trigger any of this side-effecting setup.
     """
-    from . import main, utils, pdf  # noqa: F401 -- registers @app.route handlers
+    from . import main, utils, pdf, serialization  # noqa: F401 -- registers @app.route handlers
+    app.json = serialization.JSONProvider(app)
     utils.get_volcs()
 
     # Load data retrieval "plugins"
@@ -0,0 +1,134 @@
+"""
+In-process cache of serialized /getPlot results.
+
+Entries are keyed on the request parameters that determine a plot's content
+(plot tag, volcano, date range and any additional arguments) and hold the
+already-serialized response body, so a hit costs nothing more than a dict
+lookup. Memory is bounded by the total size of the cached bodies, with the
+least recently used entries evicted first, and each entry expires after the
+TTL of the generator that produced it.
+
+Behind the in-process cache sits a second tier shared by all worker
+processes (see shared_cache), so a plot generated by one worker can be served
+by any other. Set SHARED_RESULT_CACHE = False in the config to disable it.
+"""
+
+import threading
+import time
+
+from collections import namedtuple
+
+from . import config, downsample, lru, shared_cache
+
+# Defaults, overridable from config
+DEFAULT_TTL = getattr(config, 'RESULT_CACHE_TTL', 300)  # seconds
+MAX_BYTES = getattr(config, 'RESULT_CACHE_MAX_BYTES', 128 * 1024 * 1024)
+SHARED_RESULT_CACHE = getattr(config, 'SHARED_RESULT_CACHE', True)
+
+CacheEntry = namedtuple('CacheEntry', ['body', 'mimetype', 'headers', 'expires'])
+
+# The request arguments that identify a plot. Anything else (such as the
+# jQuery cache-busting "_" argument) does not affect the result.
+KEY_ARGS = ('plotType', 'volcano', 'dateFrom', 'dateTo', 'addArgs') + downsample.REQUEST_ARGS
+
+
+def plot_key(args) -> tuple:
+    """Build a cache key from a mapping of /getPlot request arguments"""
+    return tuple(args.get(arg) or '' for arg in KEY_ARGS)
+
+
+class ResultCache:
+    """
+    Thread-safe LRU cache of response bodies, bounded by total byte size.
+
+    ARGUMENTS
+    ---------
+        max_bytes: The maximum combined size of all cached bodies.
+        default_ttl: Lifetime, in seconds, of entries stored without an explicit TTL.
+        shared: Optional shared_cache.SharedCache consulted on a miss, and
+                written through to, so entries are shared between processes.
+    """
+
+    def __init__(self, max_bytes = MAX_BYTES, default_ttl = DEFAULT_TTL, shared = None):
+        self.default_ttl = default_ttl
+        self.shared = shared
+        self._entries = lru.SizedLRU(max_bytes, lambda entry: len(entry.body))
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the CacheEntry for key, or None if missing or expired"""
+        entry = self._entries.get(key, valid = lambda entry: entry.expires > time.monotonic())
+        if entry is not None:
+            with self._lock:
+                self.hits += 1
+            return entry
+
+        if self.shared is not None:
+            found = self.shared.get_entry(key)
+            if found is not None:
+                (body, mimetype, headers), expires = found
+                entry = self._store(key, body, mimetype, headers, expires - time.time())
+                with self._lock:
+                    self.hits += 1
+                    self.shared_hits += 1
+                return entry
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, body: bytes, mimetype: str, ttl = None, headers = None):
+        """
+        Store a response body, along with any headers that should be replayed
+        with it. Bodies larger than the whole cache, or with a TTL of zero, are
+        not stored.
+        """
+        if ttl is None:
+            ttl = self.default_ttl
+
+        if self._store(key, body, mimetype, headers, ttl) is not None and self.shared is not None:
+            self.shared.put(key, (body, mimetype, headers or {}), ttl)
+
+    def _store(self, key, body, mimetype, headers, ttl):
+        """Add an entry to this process's cache, returning it (or None if not stored)"""
+        if ttl <= 0:
+            return None
+
+        entry = CacheEntry(body, mimetype, headers or {}, time.monotonic() + ttl)
+        return entry if self._entries.put(key, entry) else None
+
+    def clear(self):
+        """Empty the cache, including the shared tier"""
+        self._entries.clear()
+
+        if self.shared is not None:
+            self.shared.clear()
+
+    def stats(self) -> dict:
+        entries = self._entries.stats()
+        with self._lock:
+            return {
+                'entries': entries['entries'],
+                'bytes': entries['bytes'],
+                'max_bytes': entries['max_bytes'],
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'evictions': entries['evictions'],
+            }
+
+
+def _shared_tier():
+    if not SHARED_RESULT_CACHE:
+        return None
+
+    shared = shared_cache.SharedCache('results', DEFAULT_TTL)
+    # Without a shared database there is nothing to add to the local cache.
+    return shared if shared.shared else None
+
+
+RESULTS = ResultCache(shared = _shared_tier())
@@ -0,0 +1,217 @@
+"""
+Columnar, memory-mapped copies of the SeismoAcoustic event catalogs.
+
+The relocated and temporally complete catalogs are CSV files of up to
+hundreds of thousands of events. Rather than parsing them, the generators can
+read a column store made from each one by convert() (or the
+convert_catalogs.py script): a directory next to the CSV file, named after it
+with a ".columns" suffix, holding one NumPy .npy file per column and a
+meta.json naming them.
+
+    Pavlof_relocated_catalog.csv
+    Pavlof_relocated_catalog.columns/
+        meta.json
+        0.npy
+        1.npy
+        ...
+
+The rows are sorted by time, so the rows in a date window are found with a
+binary search, and the .npy files are opened with mmap, so only the pages of
+the columns and rows actually used are read. Those pages live in the OS page
+cache, where all worker processes share them.
+
+The CSV file stays the source of truth: a store records the modification time
+and size of the CSV it was made from, and open_store() ignores a store that
+no longer matches, so the generators fall back to parsing the CSV until it
+is converted again.
+"""
+
+import json
+import os
+import shutil
+
+import numpy
+import pandas
+
+from . import filecache
+
+STORE_SUFFIX = '.columns'
+META_FILE = 'meta.json'
+FORMAT_VERSION = 1
+
+
+def store_path(csv_path) -> str:
+    """The column store directory for a CSV file"""
+    return os.path.splitext(csv_path)[0] + STORE_SUFFIX
+
+
+def _source_stamp(csv_path) -> dict:
+    stat = os.stat(csv_path)
+    return {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+
+
+def is_current(csv_path) -> bool:
+    """True if csv_path has a column store made from its current contents"""
+    try:
+        with open(os.path.join(store_path(csv_path), META_FILE)) as f:
+            meta = json.load(f)
+        return (meta.get('version') == FORMAT_VERSION
+                and meta.get('source') == _source_stamp(csv_path))
+    except (OSError, ValueError):
+        return False
+
+
+def convert(csv_path, time_column = 'UTCDateTime', force = False) -> bool:
+    """
+    Write the column store for a catalog CSV file, unless it is already
+    current.
+
+    ARGUMENTS
+    ---------
+        csv_path: The catalog to convert
+        time_column: The column of event times, which the rows are sorted by
+        force: Convert even if the store is current
+
+    RETURNS
+    -------
+        bool: True if the store was (re)written
+    """
+    if not force and is_current(csv_path):
+        return False
+
+    stamp = _source_stamp(csv_path)
+    data = pandas.read_csv(csv_path, parse_dates = [time_column])
+    data = data.sort_values(time_column, kind = 'stable', ignore_index = True)
+
+    times = data[time_column]
+    tz = None
+    if isinstance(times.dtype, pandas.DatetimeTZDtype):
+        tz = str(times.dt.tz)
+        times = times.dt.tz_convert(None)
+
+    target = store_path(csv_path)
+    tmp_dir = f"{target}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors = True)
+    os.makedirs(tmp_dir)
+
+    columns = {}
+    for idx, name in enumerate(data.columns):
+        values = times if name == time_column else data[name]
+        filename = f"{idx}.npy"
+        column = {'file': filename}
+
+        if values.dtype == object or pandas.api.types.is_string_dtype(values.dtype):
+            # Text columns are stored as fixed width unicode, with a mask for missing values
+            missing = values.isna().to_numpy()
+            array = values.fillna('').astype(str).to_numpy(dtype = str)
+            if missing.any():
+                column['mask'] = f"{idx}.mask.npy"
+                numpy.save(os.path.join(tmp_dir, column['mask']), missing)
+        else:
+            array = values.to_numpy()
+
+        numpy.save(os.path.join(tmp_dir, filename), array)
+        columns[name] = column
+
+    meta = {
+        'version': FORMAT_VERSION,
+        'source': stamp,
+        'rows': len(data),
+        'time_column': time_column,
+        'tz': tz,
+        'columns': columns,
+    }
+    with open(os.path.join(tmp_dir, META_FILE), 'w') as f:
+        json.dump(meta, f, indent = 1)
+
+    # Swap the new store in. Readers that already opened the old one keep
+    # their mapped files until they are done with them.
+    old_dir = f"{target}.{os.getpid()}.old"
+    if os.path.exists(target):
+        os.replace(target, old_dir)
+    os.replace(tmp_dir, target)
+    shutil.rmtree(old_dir, ignore_errors = True)
+
+    return True
+
+
+class ColumnStore:
+    """
+    A converted catalog, with every column memory-mapped.
+
+    ARGUMENTS
+    ---------
+        meta_path: The meta.json file of the store
+    """
+
+    def __init__(self, meta_path):
+        self.path = os.path.dirname(meta_path)
+        with open(meta_path) as f:
+            self.meta = json.load(f)
+
+        self.columns = list(self.meta['columns'])
+        self.time_column = self.meta['time_column']
+
+        # Mapping reads nothing yet, and doing it up front means a store
+        # replaced by convert() can still be read by whoever opened it.
+        self._arrays = {}
+        self._masks = {}
+        for name, column in self.meta['columns'].items():
+            self._arrays[name] = numpy.load(os.path.join(self.path, column['file']), mmap_mode = 'r')
+            if 'mask' in column:
+                self._masks[name] = numpy.load(os.path.join(self.path, column['mask']), mmap_mode = 'r')
+
+        self.times = self._arrays[self.time_column]
+
+    def __len__(self):
+        return self.meta['rows']
+
+    def _timestamp(self, t):
+        """t as a numpy datetime64 comparable with self.times"""
+        t = pandas.Timestamp(t)
+        if self.meta['tz'] is not None:
+            t = t.tz_localize(self.meta['tz']) if t.tzinfo is None else t
+            t = t.tz_convert('UTC').tz_localize(None)
+        elif t.tzinfo is not None:
+            t = t.tz_convert('UTC').tz_localize(None)
+        return t.to_datetime64()
+
+    def window(self, start = None, end = None) -> slice:
+        """The rows with start <= time <= end, found by binary search"""
+        first = 0 if start is None else numpy.searchsorted(self.times, self._timestamp(start), side = 'left')
+        last = len(self) if end is None else numpy.searchsorted(self.times, self._timestamp(end), side = 'right')
+        return slice(int(first), int(last))
+
+    def read(self, columns = None, start = None, end = None) -> pandas.DataFrame:
+        """
+        Read some columns (default: all) of the rows between start and end
+        (either may be None) into a new data frame, in the column order of
+        the original CSV.
+        """
+        rows = self.window(start, end)
+        wanted = self.columns if columns is None else [name for name in self.columns if name in columns]
+
+        data = {}
+        for name in wanted:
+            values = numpy.array(self._arrays[name][rows])
+            if name == self.time_column:
+                values = pandas.DatetimeIndex(values)
+                if self.meta['tz'] is not None:
+                    values = values.tz_localize('UTC').tz_convert(self.meta['tz'])
+            elif name in self._masks:
+                values = pandas.Series(values, dtype = object).mask(self._masks[name][rows]).to_numpy()
+            elif values.dtype.kind == 'U':
+                values = values.astype(object)
+            data[name] = values
+
+        return pandas.DataFrame(data)
+
+
+def open_store(csv_path):
+    """
+    Return the ColumnStore for csv_path, or None if it hasn't been converted
+    (or has changed since). Opened stores are kept by the file cache.
+    """
+    if not is_current(csv_path):
+        return None
+    return filecache.load(os.path.join(store_path(csv_path), META_FILE), ColumnStore)
@@ -0,0 +1,178 @@
+"""
+A compact binary alternative to JSON for /getPlot responses.
+
+Clients that send "Accept: application/vnd.multiplot.columnar" (or the
+request argument format=columnar) receive the generator result with every
+numeric, boolean or timestamp column moved out of the JSON and into a raw,
+little-endian typed buffer that the browser can wrap in a Float64Array
+without parsing. JSON remains the default.
+
+Layout of an encoded response:
+
+    bytes 0-3    magic, b"MPC1"
+    bytes 4-7    header length, uint32 little-endian
+    header       UTF-8 JSON, padded with spaces so the buffers that follow
+                 start on an 8-byte boundary
+    buffers      column data, each starting on an 8-byte boundary
+
+The header is an object {"data": ..., "columns": [...]}. "data" is the
+generator result with each converted column replaced by {"$col": n}, an index
+into "columns". Each column is described by {"dtype", "offset", "length"},
+where offset is relative to the start of the buffers section and length is
+the number of values. dtype is one of:
+
+    float64       IEEE doubles. Missing values are NaN.
+    int64         signed integers
+    bool          one byte per value, 0 or 1
+    timestamp_ms  int64 milliseconds since the epoch. Timestamps are taken
+                  at their wall-clock value (any UTC offset is dropped),
+                  matching how Plotly displays ISO date strings.
+"""
+
+import math
+import re
+import struct
+
+import flask
+import numpy
+import pandas
+
+from .serialization import DateColumn
+
+MAGIC = b'MPC1'
+MIMETYPE = 'application/vnd.multiplot.columnar'
+JSON_MIMETYPE = 'application/json'
+
+ISO_DATE = re.compile(
+    r'^\d{4}-\d{2}-\d{2}([T ]\d{2}:\d{2}(:\d{2}(\.\d+)?)?)?(Z|[+-]\d{2}:?\d{2})?$'
+)
+_TZ_SUFFIX = r'(Z|[+-]\d{2}:?\d{2})$'
+
+
+def requested_format(args) -> str:
+    """Return the response mimetype the client asked for"""
+    if args.get('format') == 'columnar':
+        return MIMETYPE
+    if args.get('format') == 'json':
+        return JSON_MIMETYPE
+
+    if flask.has_request_context():
+        best = flask.request.accept_mimetypes.best_match([JSON_MIMETYPE, MIMETYPE])
+        if best == MIMETYPE:
+            return MIMETYPE
+
+    return JSON_MIMETYPE
+
+
+def _to_column(values):
+    """
+    Try to convert a list or array into a typed numpy array.
+    Returns (array, dtype name), or None if it should stay as JSON.
+    """
+    if isinstance(values, DateColumn) and values.epoch_ms is not None:
+        return values.epoch_ms.astype('<i8'), 'timestamp_ms'
+
+    if isinstance(values, numpy.ndarray):
+        array = values
+    else:
+        if not values:
+            return None
+
+        first = values[0]
+        if isinstance(first, str):
+            return _to_timestamp_column(values)
+
+        try:
+            array = numpy.asarray(values)
+        except ValueError:
+            return None
+
+        if array.dtype == object:
+            # Numbers mixed with None become floats with NaN
+            try:
+                array = numpy.array(values, dtype = float)
+            except (TypeError, ValueError):
+                return None
+
+    if array.ndim != 1:
+        return None
+
+    kind = array.dtype.kind
+    if kind == 'b':
+        return array.astype('u1'), 'bool'
+    if kind in 'iu':
+        return array.astype('<i8'), 'int64'
+    if kind == 'f':
+        return array.astype('<f8'), 'float64'
+    if kind == 'M':
+        return array.astype('datetime64[ms]').astype('<i8'), 'timestamp_ms'
+    if kind in 'OU':
+        values = array.tolist()
+        if values and isinstance(values[0], str):
+            return _to_timestamp_column(values)
+
+    return None
+
+
+def _to_timestamp_column(values):
+    if not (ISO_DATE.match(values[0]) and ISO_DATE.match(values[-1])):
+        return None
+
+    try:
+        strings = pandas.Series(values, dtype = object)
+        wall_time = pandas.to_datetime(
+            strings.str.replace(_TZ_SUFFIX, '', regex = True),
+            format = 'ISO8601'
+        )
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+    if wall_time.isna().any():
+        return None
+
+    return wall_time.to_numpy(dtype = 'datetime64[ms]').astype('<i8'), 'timestamp_ms'
+
+
+def encode(data) -> bytes:
+    """Encode a generator result in the columnar envelope format"""
+    columns = []
+    buffers = []
+    offset = 0
+
+    def convert(item):
+        nonlocal offset
+
+        if isinstance(item, dict):
+            return {key: convert(value) for key, value in item.items()}
+
+        if isinstance(item, (list, tuple, numpy.ndarray)):
+            column = _to_column(item)
+            if column is None:
+                if isinstance(item, numpy.ndarray):
+                    item = item.tolist()
+                return [convert(value) for value in item]
+
+            array, dtype = column
+            raw = array.tobytes()
+            columns.append({'dtype': dtype, 'offset': offset, 'length': len(array)})
+            buffers.append(raw)
+            padding = -len(raw) % 8
+            if padding:
+                buffers.append(b'\0' * padding)
+            offset += len(raw) + padding
+            return {'$col': len(columns) - 1}
+
+        if isinstance(item, numpy.generic):
+            item = item.item()
+
+        if isinstance(item, float) and not math.isfinite(item):
+            # JSON has no NaN or infinity; null is what the JSON format sends.
+            return None
+
+        return item
+
+    # Encoded as the JSON responses are, so datetimes and Decimals work the same
+    header = flask.current_app.json.dumps({'data': convert(data), 'columns': columns}).encode()
+    header += b' ' * (-(len(header) + 8) % 8)
+
+    return b''.join([MAGIC, struct.pack('<I', len(header)), header] + buffers)
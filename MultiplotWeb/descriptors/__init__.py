@@ -1,8 +1,13 @@
-from MultiplotWeb import utils, app, config
+from MultiplotWeb import utils, app, config, shared_cache
 
 from ._utils import (
     DESCRIPTION_SOURCES, 
     description_source, 
     create_description_dataframe,
     get_descriptions
-)
\ No newline at end of file
+)
+from ._index import (
+    DESCRIPTIONS,
+    DescriptionIndex,
+    DescriptionSnapshot
+)
@@ -0,0 +1,115 @@
+"""
+The descriptions from every source, combined once and kept ready to serve.
+
+Combining the descriptions means calling every description source (database
+queries, the Google sheet) and merging the results, which is far too slow
+to do for every page load. DESCRIPTIONS holds the result instead, as the
+{category: {label: description}} mapping served by /getDescriptions, already
+encoded as JSON, with an ETag. Each worker rebuilds it in a background
+thread every DESCRIPTIONS_REFRESH_INTERVAL seconds (from config, 300 if
+unset), and only replaces it, and so the ETag, when the descriptions
+changed.
+"""
+
+import hashlib
+import os
+import threading
+import time
+
+from collections import defaultdict, namedtuple
+
+from MultiplotWeb import app, config
+
+from ._utils import get_descriptions
+
+DESCRIPTIONS_REFRESH_INTERVAL = getattr(config, 'DESCRIPTIONS_REFRESH_INTERVAL', 300)  # seconds
+
+DescriptionSnapshot = namedtuple('DescriptionSnapshot', ['descriptions', 'body', 'etag'])
+
+
+def build_snapshot() -> DescriptionSnapshot:
+    """Combine the descriptions from every source into a DescriptionSnapshot"""
+    data = get_descriptions()
+    data['Category'] = data['Category'].apply(lambda x: '' if not x else x)
+    data['Dataset'] = data['Dataset'].apply(lambda x: '' if not x else x)
+
+    descriptions = defaultdict(dict)
+    for category, dataset, description in data[['Category', 'Dataset', 'Description']].itertuples(index = False):
+        descriptions[category][dataset] = description
+    descriptions = dict(descriptions)
+
+    body = app.json.dumps(descriptions).encode()
+    return DescriptionSnapshot(descriptions, body, hashlib.sha1(body).hexdigest())
+
+
+class DescriptionIndex:
+    """
+    A DescriptionSnapshot, built on first use and refreshed in the background.
+
+    ARGUMENTS
+    ---------
+        build: Function returning a new DescriptionSnapshot
+        interval: Seconds between refreshes. 0 or None to never refresh
+    """
+
+    def __init__(self, build = build_snapshot, interval = DESCRIPTIONS_REFRESH_INTERVAL):
+        self._build = build
+        self.interval = interval
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._refresher_pid = None
+
+    def get(self) -> DescriptionSnapshot:
+        """Return the current snapshot, building it if there isn't one yet"""
+        self._start_refresher()
+
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._snapshot = self._build()
+                snapshot = self._snapshot
+
+        return snapshot
+
+    def refresh(self) -> bool:
+        """Rebuild the snapshot now, returning True if the descriptions changed"""
+        snapshot = self._build()
+        with self._lock:
+            changed = self._snapshot is None or self._snapshot.etag != snapshot.etag
+            if changed:
+                self._snapshot = snapshot
+        return changed
+
+    def clear(self):
+        with self._lock:
+            self._snapshot = None
+
+    # The same name as functools' caches, so tools that reset those reset this too
+    cache_clear = clear
+
+    def _start_refresher(self):
+        # Threads don't survive a fork, so each worker process starts its own.
+        if not self.interval or self._refresher_pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._refresher_pid == os.getpid():
+                return
+            self._refresher_pid = os.getpid()
+
+        thread = threading.Thread(target = self._refresh_loop, name = 'descriptions', daemon = True)
+        thread.start()
+
+    def _refresh_loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                if self.refresh():
+                    app.logger.info("Descriptions changed")
+            except Exception as e:
+                # Keep serving the descriptions we have.
+                app.logger.warning(f"Unable to refresh the descriptions: {e}")
+
+
+DESCRIPTIONS = DescriptionIndex()
@@ -3,11 +3,10 @@ Simple code to pull "global" descriptions in from a Google sheets sheet.
 """
 
 import os
-from cachetools.func import ttl_cache
 
 import pandas
 
-from . import app, description_source
+from . import app, description_source, shared_cache
 
 from apiclient import discovery
 from google.oauth2 import service_account
@@ -22,8 +21,9 @@ def auth():
     return creds
 
 
-@ttl_cache(ttl = 300)
+# description_source must be outermost, so the cached function is the one registered.
 @description_source
+@shared_cache.shared_ttl_cache(ttl = 300)
 def get_data():
     service = discovery.build('sheets', 'v4', credentials = auth())
     sheet = service.spreadsheets()
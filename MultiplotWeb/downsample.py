@@ -0,0 +1,230 @@
+"""
+Shape-preserving downsampling of time series before they are serialized.
+
+A plot panel is only so many pixels wide, so sending it hundreds of thousands
+of points costs encode, transfer and render time without adding any detail.
+Generators hand their DataFrames to downsample_groups(), which reduces each
+trace to at most the number of points requested by the client through the
+"maxPoints" (or "width", in pixels) request argument. If the client did not
+ask for a limit the data is returned untouched.
+
+Two methods are available, selected with the "downsample" request argument:
+
+lttb
+    Largest-Triangle-Three-Buckets (the default). Keeps the points that best
+    preserve the visual shape of the line.
+minmax
+    Keeps the minimum and maximum of each bucket, so no peak is ever lost.
+"""
+
+from contextvars import ContextVar
+
+import flask
+import numpy
+import pandas
+
+from . import utils
+
+METHODS = ('lttb', 'minmax')
+
+# Arguments that change the downsampled result, and so must be part of any cache key.
+REQUEST_ARGS = ('maxPoints', 'width', 'downsample')
+
+# What the current plot's data was reduced from and to, kept per context
+# rather than in flask.g so concurrent plots in one batch don't mix.
+_decimated = ContextVar('decimated', default = None)
+
+
+def start():
+    """Begin tracking decimation for the current plot"""
+    _decimated.set(None)
+
+
+def requested_max_points():
+    """
+    Return the maximum number of points per trace requested by the client,
+    or None for no limit.
+    """
+    args = utils.plot_args()
+    try:
+        if args.get('maxPoints'):
+            return max(int(args['maxPoints']), 3)
+        if args.get('width'):
+            # minmax emits two points per bucket, and one bucket per pixel is
+            # all the resolution the panel can display.
+            return max(int(float(args['width'])) * 2, 3)
+    except ValueError:
+        flask.abort(400, 'maxPoints and width must be numbers')
+
+    return None
+
+
+def lttb(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets downsampling.
+
+    ARGUMENTS
+    ---------
+        x: Sorted, numeric x values
+        y: y values
+        n_out: The number of points to keep (at least 3)
+
+    RETURNS
+    -------
+        numpy.ndarray: Indices of the points to keep, in ascending order
+    """
+    n_in = len(x)
+    if n_out >= n_in:
+        return numpy.arange(n_in)
+
+    # The first and last points are always kept; the rest are split evenly
+    # into n_out - 2 buckets, each of which contributes one point.
+    edges = numpy.linspace(1, n_in - 1, n_out - 1).astype(int)
+    keep = numpy.empty(n_out, dtype = int)
+    keep[0] = 0
+    keep[-1] = n_in - 1
+
+    prev = 0
+    for i in range(n_out - 2):
+        start, stop = edges[i], edges[i + 1]
+
+        # Average of the next bucket (or the last point, for the last bucket)
+        next_stop = edges[i + 2] if i + 2 < len(edges) else n_in
+        avg_x = x[stop:next_stop].mean()
+        avg_y = y[stop:next_stop].mean()
+
+        # Pick the point in this bucket forming the largest triangle with
+        # the previously selected point and the next bucket's average.
+        bucket_x = x[start:stop]
+        bucket_y = y[start:stop]
+        area = numpy.abs(
+            (x[prev] - avg_x) * (bucket_y - y[prev])
+            - (x[prev] - bucket_x) * (avg_y - y[prev])
+        )
+        prev = start + int(numpy.argmax(area))
+        keep[i + 1] = prev
+
+    return keep
+
+
+def minmax(x, y, n_out):
+    """
+    Min/max-per-bucket downsampling.
+
+    Splits the series into n_out // 2 buckets of equal width along x and keeps
+    the minimum and maximum y of each.
+
+    RETURNS
+    -------
+        numpy.ndarray: Indices of the points to keep, in ascending order
+    """
+    n_in = len(x)
+    n_buckets = max(n_out // 2, 1)
+    if n_out >= n_in:
+        return numpy.arange(n_in)
+
+    # Bucket number for each point, from its position along the x range.
+    span = x[-1] - x[0]
+    if span <= 0:
+        bucket = numpy.zeros(n_in, dtype = int)
+    else:
+        bucket = numpy.minimum(((x - x[0]) / span * n_buckets).astype(int), n_buckets - 1)
+
+    frame = pandas.DataFrame({'bucket': bucket, 'y': y})
+    grouped = frame.groupby('bucket')['y']
+    keep = numpy.union1d(grouped.idxmin().to_numpy(), grouped.idxmax().to_numpy())
+    return keep
+
+
+def downsample_frame(df, x_col, y_col, max_points, method = 'lttb'):
+    """
+    Reduce df to at most max_points rows, chosen on the shape of df[y_col]
+    against df[x_col]. All other columns are carried along with the kept rows.
+    """
+    if max_points is None or len(df) <= max_points:
+        return df
+
+    if not df[x_col].is_monotonic_increasing:
+        df = df.sort_values(x_col)
+
+    x = df[x_col]
+    if pandas.api.types.is_datetime64_any_dtype(x) or x.dtype == object:
+        x = pandas.to_datetime(x, utc = True).astype('int64')
+
+    x = x.to_numpy(dtype = float)
+    y = df[y_col].to_numpy(dtype = float)
+
+    if method == 'minmax':
+        keep = minmax(x, y, max_points)
+    else:
+        keep = lttb(x, y, max_points)
+
+    return df.iloc[keep].copy()
+
+
+def downsample_groups(df, x_col, y_col, group_col = None):
+    """
+    Downsample df, one trace (group_col value) at a time, to the limit
+    requested by the client, recording the reduction for the response headers.
+
+    ARGUMENTS
+    ---------
+        df: The data frame to reduce
+        x_col: Name of the x (time) column
+        y_col: Name of the y (value) column
+        group_col: Column identifying the trace each row belongs to, if any
+
+    RETURNS
+    -------
+        pandas.DataFrame: The reduced frame (df itself if no reduction was needed)
+    """
+    max_points = requested_max_points()
+    if max_points is None:
+        return df
+
+    method = utils.plot_args().get('downsample', 'lttb')
+    if method not in METHODS:
+        flask.abort(400, f"Unknown downsample method {method}")
+
+    if group_col is None:
+        reduced = downsample_frame(df, x_col, y_col, max_points, method)
+    else:
+        groups = df.groupby(group_col, sort = False, dropna = False)
+        if all(len(group) <= max_points for _, group in groups):
+            return df
+
+        reduced = pandas.concat([
+            downsample_frame(group, x_col, y_col, max_points, method)
+            for _, group in groups
+        ])
+
+    if len(reduced) < len(df):
+        mark_decimated(len(df), len(reduced), method)
+
+    return reduced
+
+
+def mark_decimated(original, returned, method):
+    """
+    Record that the data for the current plot has been reduced, to be
+    reported in the X-Decimated response header.
+    """
+    previous = _decimated.get()
+    if previous is not None:
+        original += previous['original']
+        returned += previous['returned']
+
+    _decimated.set({
+        'original': original,
+        'returned': returned,
+        'method': method,
+    })
+
+
+def decimated_header():
+    """Return the X-Decimated header value for the current plot, if any"""
+    decimated = _decimated.get()
+    if decimated is None:
+        return None
+
+    return f"{decimated['method']}; original={decimated['original']}; returned={decimated['returned']}"
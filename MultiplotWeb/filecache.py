@@ -0,0 +1,131 @@
+"""
+In-process cache of parsed data files.
+
+Several generators read CSV files from DATA_DIR that change rarely but are
+slow to parse (dates in particular). FILES keeps the result of parsing each
+file, keyed on the file and the function that parsed it, so a repeat request
+only has to stat() the file:
+
+    data = filecache.load(path, _load_catalog)
+
+Each entry remembers the file's modification time and size, and is reloaded
+if either has changed. Memory is bounded by FILE_CACHE_MAX_BYTES (from
+config, 256 MB if unset), with the least recently used entries evicted first.
+
+The loader should do all the per-file work (parsing, indexing by time,
+splitting by volcano) so that callers only select from its result. Values are
+shared between requests, so callers must not modify them in place.
+"""
+
+import os
+import sys
+import threading
+
+from collections import namedtuple
+
+import pandas
+
+from . import config, lru
+
+FILE_CACHE_MAX_BYTES = getattr(config, 'FILE_CACHE_MAX_BYTES', 256 * 1024 * 1024)
+
+FileEntry = namedtuple('FileEntry', ['value', 'mtime', 'size'])
+
+
+def _sizeof(value) -> int:
+    """Approximate memory used by a loaded value"""
+    if isinstance(value, pandas.DataFrame):
+        return int(value.memory_usage(deep = True).sum())
+    if isinstance(value, pandas.Series):
+        return int(value.memory_usage(deep = True))
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(_sizeof(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(_sizeof(item) for item in value)
+    return sys.getsizeof(value)
+
+
+class FileCache:
+    """
+    Thread-safe LRU cache of loaded files, bounded by their approximate size.
+
+    ARGUMENTS
+    ---------
+        max_bytes: The maximum combined size of all cached values.
+    """
+
+    def __init__(self, max_bytes = FILE_CACHE_MAX_BYTES):
+        self._entries = lru.SizedLRU(max_bytes, lambda entry: _sizeof(entry.value))
+        self._lock = threading.Lock()
+        self._loading = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, path, loader, *args):
+        """
+        Return loader(path, *args), from the cache if path has not changed
+        since it was last loaded.
+
+        ARGUMENTS
+        ---------
+            path: The file to load
+            loader: A module-level function taking the path (and args)
+            args: Extra, hashable, arguments for loader
+
+        RETURNS
+        -------
+            The loader's return value, shared with other callers
+        """
+        stat = os.stat(path)
+        key = (path, loader, args)
+
+        def unchanged(entry):
+            return (entry.mtime, entry.size) == (stat.st_mtime_ns, stat.st_size)
+
+        entry = self._entries.get(key, valid = unchanged)
+        with self._lock:
+            if entry is not None:
+                self.hits += 1
+                return entry.value
+
+            self.misses += 1
+            # Requests that miss at the same time wait for one load.
+            lock = self._loading.setdefault(key, threading.Lock())
+
+        with lock:
+            entry = self._entries.get(key, valid = unchanged)
+            if entry is not None:
+                return entry.value
+
+            value = loader(path, *args)
+            self._entries.put(key, FileEntry(value, stat.st_mtime_ns, stat.st_size))
+
+        with self._lock:
+            if self._loading.get(key) is lock:
+                del self._loading[key]
+
+        return value
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        entries = self._entries.stats()
+        with self._lock:
+            return {
+                'entries': entries['entries'],
+                'bytes': entries['bytes'],
+                'max_bytes': entries['max_bytes'],
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': entries['evictions'],
+            }
+
+
+FILES = FileCache()
+
+
+def load(path, loader, *args):
+    """Load path with loader through the shared FILES cache (see FileCache.load)"""
+    return FILES.load(path, loader, *args)
@@ -1,6 +1,9 @@
 import inspect
+import os
 import re
 import textwrap
+import threading
+import time
 import warnings
 
 from collections import defaultdict
@@ -9,6 +12,7 @@ from functools import wraps
 
 import pandas
 
+from . import app, config
 from .descriptors import create_description_dataframe
 from .descriptors import DESCRIPTION_SOURCES
 
@@ -26,8 +30,19 @@ from .descriptors import DESCRIPTION_SOURCES
 GEN_FUNCS = {}
 GEN_CATEGORIES = defaultdict(list)
 JS_FUNCS = {}
-
-def generator(label_or_labels_or_func):
+GEN_CACHE_TTLS = {}
+
+# Generators whose labels come from a function (a database query, say), with
+# the labels each is registered under, so that refresh_labels() can pick up
+# labels added or removed since without a restart. Each worker does so in a
+# background thread every LABEL_REFRESH_INTERVAL seconds, once
+# start_label_refresher() has been called.
+LABEL_SOURCES = []
+LABEL_REFRESH_INTERVAL = getattr(config, 'LABEL_REFRESH_INTERVAL', 60)  # seconds
+_refresh_lock = threading.Lock()
+_refresher_pid = None
+
+def generator(label_or_labels_or_func, cache_ttl = None):
     """
     Decorator to register a function under one or more (label, category) pairs.
 
@@ -38,6 +53,9 @@ def generator(label_or_labels_or_func):
         a list of string labels (all use the default or global category),
         a list of (label, category) tuples,
         or a function returning one of the above.
+    cache_ttl : int, optional
+        Number of seconds a result from this function may be served from the
+        result cache. None uses the cache default, 0 disables caching.
 
     Returns
     -------
@@ -58,6 +76,7 @@ def generator(label_or_labels_or_func):
     frame = inspect.stack()[1]
 
     category = frame.frame.f_globals.get('CATEGORY') # May be None, fine depending on how labels is passed.
+    default_category = category
 
     labels = resolve_labels(label_or_labels_or_func, category)
     category_doc = desc_from_docstring(frame.frame.f_globals.get('__doc__'))
@@ -70,17 +89,10 @@ def generator(label_or_labels_or_func):
             if category is None:
                 raise ValueError(f"No category provided for label {label}")
 
-            if category not in GEN_CATEGORIES:
-                GEN_CATEGORIES[category] = []
-
-            tag = f"{category}|{label}"
-
-            if label in GEN_CATEGORIES[category]:
+            if label in GEN_CATEGORIES.get(category, ()):
                 raise ValueError(f"Label '{label}' is duplicated in category '{category}'.")
 
-            GEN_CATEGORIES[category].append(label)
-            GEN_FUNCS[tag] = func
-            JS_FUNCS[tag] = func.__name__
+            _register(func, label, category, cache_ttl)
 
             # descriptions
             # Add function-level label description
@@ -99,6 +111,15 @@ def generator(label_or_labels_or_func):
             df = create_description_dataframe(desc_rows.values())
             DESCRIPTION_SOURCES.append(df)
 
+        if callable(label_or_labels_or_func):
+            LABEL_SOURCES.append({
+                'source': label_or_labels_or_func,
+                'category': default_category,
+                'func': func,
+                'cache_ttl': cache_ttl,
+                'labels': set(labels),
+            })
+
         @wraps(func)
         def wrapper(*args, **kwargs):
             return func(*args, **kwargs)
@@ -107,6 +128,102 @@ def generator(label_or_labels_or_func):
 
     return inner
 
+def _register(func, label, category, cache_ttl):
+    tag = f"{category}|{label}"
+    GEN_CATEGORIES[category].append(label)
+    GEN_FUNCS[tag] = func
+    JS_FUNCS[tag] = func.__name__
+    if cache_ttl is not None:
+        GEN_CACHE_TTLS[tag] = cache_ttl
+
+
+def _unregister(label, category):
+    tag = f"{category}|{label}"
+    GEN_FUNCS.pop(tag, None)
+    JS_FUNCS.pop(tag, None)
+    GEN_CACHE_TTLS.pop(tag, None)
+    if label in GEN_CATEGORIES.get(category, ()):
+        GEN_CATEGORIES[category].remove(label)
+        if not GEN_CATEGORIES[category]:
+            del GEN_CATEGORIES[category]
+
+
+def refresh_labels() -> bool:
+    """
+    Call the label functions of the generators registered with one again,
+    registering any new labels and removing those no longer returned.
+
+    RETURNS
+    -------
+        bool: True if any label was added or removed
+    """
+    changed = False
+    for source in LABEL_SOURCES:
+        # The label functions can be slow, so the labels are only locked
+        # while they are being changed.
+        try:
+            labels = set(resolve_labels(source['source'], source['category']))
+        except Exception as e:
+            # Keep serving the labels we have.
+            app.logger.warning(f"Unable to refresh the labels of {source['func'].__name__}: {e}")
+            continue
+
+        with _refresh_lock:
+            for label, category in source['labels'] - labels:
+                _unregister(label, category)
+                changed = True
+
+            registered = source['labels'] & labels
+            for label, category in labels - source['labels']:
+                if category is None or label in GEN_CATEGORIES.get(category, ()):
+                    app.logger.warning(f"Not registering label {label!r} in category {category!r}")
+                    continue
+
+                _register(source['func'], label, category, source['cache_ttl'])
+                registered.add((label, category))
+                changed = True
+
+            source['labels'] = registered
+
+    return changed
+
+
+def registered_labels() -> tuple:
+    """
+    Return copies of JS_FUNCS and GEN_CATEGORIES, which stay consistent while
+    the labels are being refreshed.
+    """
+    with _refresh_lock:
+        return dict(JS_FUNCS), {category: list(labels) for category, labels in GEN_CATEGORIES.items()}
+
+
+def start_label_refresher():
+    """Start refreshing the labels in the background, unless this process already is"""
+    global _refresher_pid
+
+    # Threads don't survive a fork, so each worker process starts its own.
+    if not LABEL_SOURCES or not LABEL_REFRESH_INTERVAL or _refresher_pid == os.getpid():
+        return
+
+    with _refresh_lock:
+        if _refresher_pid == os.getpid():
+            return
+        _refresher_pid = os.getpid()
+
+    thread = threading.Thread(target = _refresh_loop, name = 'labels', daemon = True)
+    thread.start()
+
+
+def _refresh_loop():
+    while True:
+        time.sleep(LABEL_REFRESH_INTERVAL)
+        try:
+            if refresh_labels():
+                app.logger.info("Plot labels changed")
+        except Exception as e:
+            app.logger.warning(f"Unable to refresh the plot labels: {e}")
+
+
 def desc_from_docstring(docstring: str) -> str:
     """
     Extracts the DESCRIPTION section from a docstring.
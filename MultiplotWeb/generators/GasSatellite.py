@@ -13,7 +13,7 @@ import pandas
 
 from .RemoteSensing import get_detection_data
 from .database import plot_db_dataset
-from . import utils, app, generator, config
+from . import utils, app, generator, config, filecache, serialization
 
 
 def so2_data(volcano, start, end) -> pandas.DataFrame:
@@ -26,8 +26,6 @@ def so2_data(volcano, start, end) -> pandas.DataFrame:
     if data.size <= 0:
         raise FileNotFoundError
 
-    data['date'] = data['date'].apply(lambda x: x.isoformat())
-
     return data
 
 
@@ -39,12 +37,12 @@ def so2_rate_fioletov(volcano, start, end):
     db_data['lower']=db_data['rate']-db_data['error']
     db_data['year'] = pandas.to_datetime(db_data['datetime']).dt.year
     db_data = db_data.drop(columns = 'datetime')
-    return db_data.to_dict(orient = "list")
+    return serialization.frame_to_dict(db_data)
 
 @generator("SO<sub>2</sub> Emission Rate")
 def so2_em_rate_combined(volcano, start, end):
     ret_data = {}
-    query = flask.request.args.get('addArgs', '')
+    query = utils.plot_args().get('addArgs', '')
     requested = parse_qs(query).get('types', ['Fioletov', 'AVO'])
 
     if not requested:
@@ -61,7 +59,7 @@ def so2_em_rate_combined(volcano, start, end):
         try:
             avo = so2_data(volcano, start, end)
             avo.dropna(inplace=True)
-            avo = avo.to_dict(orient = "list")
+            avo = serialization.frame_to_dict(avo)
             ret_data['avo'] = avo
         except FileNotFoundError:
             app.logger.error("Unable to load so2 rate (AVO) for selected options")
@@ -77,12 +75,11 @@ def so2_mass(volcano, start, end) -> pandas.DataFrame:
 
     #Drop the rate column, we don't care about it, and it can cause issues if it is NaN
     data = data.drop(columns=['rate']).dropna()
-    return data.to_dict(orient = "list")
+    return serialization.frame_to_dict(data)
 
 
-def so2_mass_carn(volcano, start, end):
-    data_filename = "GVP_Emission_Results.csv"
-    data_path = os.path.join(config.DATA_DIR, data_filename)
+def _load_gvp_emissions(data_path) -> dict:
+    """Parse the global GVP emissions file into a frame per volcano"""
     data = pandas.read_csv(
         data_path,
         header = 1,
@@ -90,8 +87,20 @@ def so2_mass_carn(volcano, start, end):
         parse_dates = ['Start Date', 'End Date']
     )
 
+    return {
+        volcano: volc_data.reset_index()
+        for volcano, volc_data in data.groupby(level = 0, sort = False)
+    }
+
+
+def so2_mass_carn(volcano, start, end):
+    data_filename = "GVP_Emission_Results.csv"
+    data_path = os.path.join(config.DATA_DIR, data_filename)
+    # Parsed once per change of the file, rather than on every request
+    data = filecache.load(data_path, _load_gvp_emissions)
+
     try:
-        volc_data = data.loc[[volcano]].reset_index()
+        volc_data = data[volcano]
     except KeyError:
         raise FileNotFoundError
 
@@ -100,16 +109,14 @@ def so2_mass_carn(volcano, start, end):
     volc_data = volc_data[volc_data['Start Date'] <= end]
 
     volc_data = volc_data[['Start Date', 'End Date', 'Total SO2 Mass (kt)']]
-    volc_data['Start Date'] = volc_data['Start Date'].apply(lambda x: x.isoformat())
-    volc_data['End Date'] = volc_data['End Date'].apply(lambda x: x.isoformat())
 
-    return volc_data.to_dict(orient = "list")
+    return serialization.frame_to_dict(volc_data)
 
 
 @generator("SO<sub>2</sub> Mass")
 def so2_mass_combined(volcano, start, end):
     ret_data = {}
-    query = flask.request.args.get('addArgs', '')
+    query = utils.plot_args().get('addArgs', '')
     requested = parse_qs(query).get('types', ['Carn', 'AVO'])
 
     if not requested:
@@ -10,15 +10,12 @@ import os
 
 import pandas
 
-from . import config, generator
+from . import config, filecache, generator, serialization
 
 ##############Petrology###############
 
 
-@generator("Diffusion")
-def plot_diffusion(volcano, start = None, end = None):
-    data_filename = f"{volcano} Moshrefzadeh.csv"
-    data_path = os.path.join(config.DATA_DIR, 'Diffusion', data_filename)
+def _load_diffusion(data_path):
     date_cols = [
         'cpx date',
         'cpx date neg',
@@ -27,7 +24,14 @@ def plot_diffusion(volcano, start = None, end = None):
         # 'Plag Date Neg',
         # 'plag date pos'
     ]
-    data = pandas.read_csv(data_path, parse_dates = date_cols)
+    return pandas.read_csv(data_path, parse_dates = date_cols)
+
+
+@generator("Diffusion", cache_ttl = 86400)
+def plot_diffusion(volcano, start = None, end = None):
+    data_filename = f"{volcano} Moshrefzadeh.csv"
+    data_path = os.path.join(config.DATA_DIR, 'Diffusion', data_filename)
+    data = filecache.load(data_path, _load_diffusion)
     cpx_data = data.loc[:, ['cpx date', 'cpx date neg', 'cpx date pos']]
     cpx_data.dropna(inplace = True)
     cpx_data.loc[:, 'type'] = 'cpx'
@@ -63,18 +67,16 @@ def plot_diffusion(volcano, start = None, end = None):
 
     data.loc[:, 'index'] = data.index
 
-    data['date'] = data['date'].apply(lambda x: pandas.to_datetime(x).isoformat())
-    data['date neg'] = data['date neg'].apply(lambda x: pandas.to_datetime(x).isoformat())
-    data['date pos'] = data['date pos'].apply(lambda x: pandas.to_datetime(x).isoformat())
-
-    lines = data.loc[:, ['date neg', 'date pos', 'index']]
+    lines = data.loc[:, ['date neg', 'date pos', 'index']].copy()
+    lines['date neg'] = serialization.iso_format(lines['date neg'])
+    lines['date pos'] = serialization.iso_format(lines['date pos'])
 
     cpx_points = data.loc[data['type'] == 'cpx', ['date', 'index']]
     plag_points = data.loc[data['type'] == 'plag', ['date', 'index']]
 
     ret_data = {
-        'cpx': cpx_points.to_dict(orient = "list"),
-        'plag': plag_points.to_dict(orient = "list"),
+        'cpx': serialization.frame_to_dict(cpx_points),
+        'plag': serialization.frame_to_dict(plag_points),
         'lines': lines.to_dict(orient = "records"),
     }
 
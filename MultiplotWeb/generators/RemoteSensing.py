@@ -10,10 +10,9 @@ CATEGORY = "Remote Sensing"
 import json
 from urllib.parse import parse_qs
 
-import flask
 import pandas
 
-from . import utils, config, generator
+from . import utils, config, generator, serialization
 
 ############ Remote Detections #################
 def get_detection_data(volcano: str, start, end) -> pandas.DataFrame:
@@ -82,7 +81,7 @@ def rs_detections(volcano, start, end) -> pandas.DataFrame:
         'Steam/Water': [25],
     }
 
-    types_string = flask.request.args.get('addArgs')
+    types_string = utils.plot_args().get('addArgs')
     types_dict = parse_qs(types_string)
     types = types_dict.get('types', list(rs_types.keys()))
     selectedTypes = []
@@ -98,12 +97,11 @@ def rs_detections(volcano, start, end) -> pandas.DataFrame:
     # so just set it to 1 everywhere
     data.loc[:, 'rate'] = 1
 
-    data['date'] = data['date'].apply(lambda x: x.isoformat())
     found_types = data['type'].unique().tolist()
     grouped_data = data.groupby('type')
 
     result = {
-        str(x): grouped_data.get_group(x)['date'].tolist()
+        str(x): serialization.iso_format(grouped_data.get_group(x)['date'])
         for x in found_types
     }
 
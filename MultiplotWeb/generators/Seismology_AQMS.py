@@ -6,26 +6,219 @@ DESCRIPTION: Data generation functions for the Seismology discipline, using the
 
 CATEGORY = "Seismology"
 
+import math
+import threading
+import time
+
+from collections import OrderedDict
+from datetime import timezone
 from urllib.parse import parse_qs
 
-import flask
+import numpy
 import pandas
 
 from psycopg.rows import dict_row
 
-from . import utils, config, generator
+from . import utils, config, generator, serialization
+
+# The AQMS catalog is cached per volcano, as a contiguous time range of
+# already-processed events, so the four AQMS plots (and widening the date
+# range) don't each re-run the query. Only the parts of a request outside the
+# cached range are fetched.
+AQMS_CATALOG_TTL = getattr(config, 'AQMS_CATALOG_TTL', 3600)  # seconds an entry lives, in total
+AQMS_CATALOG_REFRESH = getattr(config, 'AQMS_CATALOG_REFRESH', 60)  # seconds before recent events are re-checked
+AQMS_CATALOG_SETTLE = getattr(config, 'AQMS_CATALOG_SETTLE', 2 * 86400)  # seconds during which events may still be revised
+AQMS_CATALOG_MAX_VOLCANOES = getattr(config, 'AQMS_CATALOG_MAX_VOLCANOES', 32)
+
+# Read events from the aqms_event_volcano table that associate_aqms.py keeps
+# up to date in the multiplot database, instead of searching the AQMS catalog.
+AQMS_USE_ASSOCIATION = getattr(config, 'AQMS_USE_ASSOCIATION', False)
+
+AQMS_COLUMNS = ['eventId', 'unixTime', 'lat', 'long', 'depthKM', 'auto', 'type', 'mag',
+                'azimuthal-gap', 'num-phases-used', 'horizontal-error', 'vertical-error', 'distance']
+
+
+class _CatalogEntry():
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.events = None
+        self.lo = math.inf  # covered range, epoch seconds
+        self.hi = -math.inf
+        self.refreshed = 0  # time.time() of the last fetch up to the present
+        self.created = time.monotonic()
+
+
+_catalogs = OrderedDict()
+_catalogs_lock = threading.Lock()
+
+
+def _catalog_entry(volcano) -> _CatalogEntry:
+    with _catalogs_lock:
+        entry = _catalogs.get(volcano)
+        if entry is None or time.monotonic() - entry.created > AQMS_CATALOG_TTL:
+            entry = _catalogs[volcano] = _CatalogEntry()
+        _catalogs.move_to_end(volcano)
+        while len(_catalogs) > AQMS_CATALOG_MAX_VOLCANOES:
+            _catalogs.popitem(last = False)
+        return entry
+
+
+def _epoch(t, default):
+    """Seconds since the epoch of t, taking a naive datetime to be UTC"""
+    if t is None:
+        return default
+    if t.tzinfo is None:
+        t = t.replace(tzinfo = timezone.utc)
+    return t.timestamp()
+
 
 def get_aqms_data(volcano, t_start = None, t_end = None):
+    """
+    Return the AQMS events closest to volcano, between t_start and t_end
+    (either may be None for an open range), served from the catalog cache.
+    The frame is shared with the cache, so callers must not modify it in place.
+    """
+    lo = _epoch(t_start, -math.inf)
+    hi = _epoch(t_end, math.inf)
+
+    entry = _catalog_entry(volcano)
+    with entry.lock:
+        now = time.time()
+        if entry.refreshed and now - entry.refreshed > AQMS_CATALOG_REFRESH:
+            # Recently added events may since have been revised or removed.
+            entry.hi = min(entry.hi, entry.refreshed - AQMS_CATALOG_SETTLE)
+
+        chunks = []
+        if entry.events is None:
+            chunks.append(_fetch_aqms_data(volcano, lo, hi))
+            entry.lo = lo
+            entry.hi = min(hi, now)
+            if hi >= now:
+                entry.refreshed = now
+        else:
+            chunks.append(entry.events)
+            if lo < entry.lo:
+                chunks.insert(0, _fetch_aqms_data(volcano, lo, entry.lo))
+                entry.lo = lo
+
+            if min(hi, now) > entry.hi:
+                # Anything already cached from here on is fetched again.
+                cached = chunks.pop()
+                chunks.append(cached[cached['unixTime'] < entry.hi * 1000])
+                chunks.append(_fetch_aqms_data(volcano, entry.hi, hi))
+                entry.hi = min(hi, now)
+                if hi >= now:
+                    entry.refreshed = now
+
+        if len(chunks) > 1:
+            events = pandas.concat(chunks)
+            events = events[~events['eventId'].duplicated(keep = 'last')]
+            entry.events = events.sort_values('unixTime', kind = 'stable')
+        else:
+            entry.events = chunks[0]
+
+        events = entry.events
+
+    times = events['unixTime'].to_numpy()
+    first = numpy.searchsorted(times, lo * 1000, side = 'left')
+    last = numpy.searchsorted(times, hi * 1000, side = 'right')
+    return events.iloc[first:last]
+
+
+def _clear_catalogs():
+    with _catalogs_lock:
+        _catalogs.clear()
+
+
+get_aqms_data.cache_clear = _clear_catalogs
+
+
+# Degrees of latitude per km, for the bounding box around a volcano
+_KM_PER_DEG_LAT = 111.0
+
+
+def _bounding_box(v_lat, v_lon, radius):
+    """
+    Return (lat_min, lat_max, lon_min, lon_max) in degrees, a box that
+    contains every point within radius km of (v_lat, v_lon). lon_min and
+    lon_max are None if the box would cross the antimeridian.
+    """
+    # Pad by 10% so the box never clips the circle ST_DWithin checks exactly.
+    d_lat = radius * 1.1 / _KM_PER_DEG_LAT
+    lat_min, lat_max = v_lat - d_lat, v_lat + d_lat
+
+    if abs(lat_min) >= 90 or abs(lat_max) >= 90:
+        return lat_min, lat_max, None, None
+
+    d_lon = d_lat / math.cos(math.radians(max(abs(lat_min), abs(lat_max))))
+    lon_min, lon_max = v_lon - d_lon, v_lon + d_lon
+    if lon_min < -180 or lon_max > 180:
+        return lat_min, lat_max, None, None
+
+    return lat_min, lat_max, lon_min, lon_max
+
+
+def _search_terms(volcano, lo, hi):
+    """
+    Return (where_terms, args) selecting the AQMS events within max_dist of
+    volcano, between epoch seconds lo and hi (either may be infinite).
+    """
     v_lat, v_lon = utils.VOLCANOES[volcano][:2]
     max_dist = 20 #in KM
 
+    lat_min, lat_max, lon_min, lon_max = _bounding_box(v_lat, v_lon, max_dist)
     args = {
         'volcLon': v_lon,
         'volcLat': v_lat,
         'maxDist': max_dist,
+        'latMin': lat_min,
+        'latMax': lat_max,
     }
 
-    where_terms = []
+    # The search is written so the database can answer it from an index,
+    # rather than computing the distance to every event in the catalog:
+    #  - the lat/lon bounding box can use a plain B-tree index on origin
+    #    (CREATE INDEX origin_lat_lon_idx ON origin (lat, lon)),
+    #  - ST_DWithin on geography can use a GiST index on the same expression
+    #    (CREATE INDEX origin_geog_idx ON origin
+    #         USING gist ((ST_SetSRID(ST_MakePoint(lon, lat), 4326)::geography))).
+    # Either one alone is enough; ST_DWithin then makes the exact check.
+    where_terms = [
+        "lat BETWEEN %(latMin)s AND %(latMax)s",
+    ]
+
+    if lon_min is not None:
+        where_terms.append("lon BETWEEN %(lonMin)s AND %(lonMax)s")
+        args['lonMin'] = lon_min
+        args['lonMax'] = lon_max
+
+    # start with a max distance of 20km to associate with this volcano.
+    where_terms.append("""ST_DWithin(ST_SetSRID(ST_MakePoint(lon, lat), 4326)::geography,
+                  ST_SetSRID(ST_MakePoint(%(volcLon)s, %(volcLat)s), 4326)::geography,
+                  %(maxDist)s*1000,
+                  false)""")
+
+    if lo != -math.inf:
+        where_terms.append("o.datetime >= %(starttime)s")
+        args['starttime'] = lo
+
+    if hi != math.inf:
+        where_terms.append("o.datetime <= %(endtime)s")
+        args['endtime'] = hi
+
+    where_terms.append("bogusflag=0")
+    where_terms.append("selectflag=1")
+    where_terms.append("o.rflag in ('A','F')")
+
+    return where_terms, args
+
+
+def _fetch_aqms_data(volcano, lo, hi):
+    """Query AQMS for the events near volcano between epoch seconds lo and hi"""
+    if AQMS_USE_ASSOCIATION:
+        return _fetch_associated_data(volcano, lo, hi)
+
+    where_terms, args = _search_terms(volcano, lo, hi)
 
     query = """
     SELECT  e.evid as "eventId",
@@ -40,32 +233,15 @@ def get_aqms_data(volcano, t_start = None, t_end = None):
             ndef as "num-phases-used",
             erhor as "horizontal-error",
             sdep as "vertical-error",
-            ST_Distance(ST_SetSRID(ST_MakePoint(lon, lat), 4326),
-                        ST_SetSRID(ST_MakePoint(%(volcLon)s, %(volcLat)s), 4326),
+            ST_Distance(ST_SetSRID(ST_MakePoint(lon, lat), 4326)::geography,
+                        ST_SetSRID(ST_MakePoint(%(volcLon)s, %(volcLat)s), 4326)::geography,
                         false) as distance
         FROM event e
         INNER JOIN origin o ON o.orid=e.prefor
         INNER JOIN netmag n ON e.prefmag=n.magid
     WHERE
-    -- start with a max distance of 20km to associate with this volcano.
-    ST_Distance(ST_SetSRID(ST_MakePoint(lon, lat), 4326),
-                ST_SetSRID(ST_MakePoint(%(volcLon)s, %(volcLat)s), 4326),
-                false) < (%(maxDist)s*1000)
-    AND
     """
 
-    if t_start is not None:
-        where_terms.append("o.datetime >= %(starttime)s")
-        args['starttime'] = t_start.timestamp()
-
-    if t_end is not None:
-        where_terms.append("o.datetime <= %(endtime)s")
-        args['endtime'] = t_end.timestamp()
-
-    where_terms.append("bogusflag=0")
-    where_terms.append("selectflag=1")
-    where_terms.append("o.rflag in ('A','F')")
-
     query += " AND ".join(where_terms)
     query += """
     ORDER BY datetime;
@@ -75,59 +251,190 @@ def get_aqms_data(volcano, t_start = None, t_end = None):
                                 password = config.AQMS_PASS, host = config.AQMS_HOST,
                                 row_factory = dict_row) as cur:
         cur.execute(query, args)
-        events = pandas.DataFrame(cur)
-
-    if events.size > 0:
-        events.loc[:, 'eventId'] = "av" + events.eventId.astype(str)
-        events['unixTime'] *= 1000
-        events.loc[:, 'date'] = pandas.to_datetime(events.unixTime, unit = 'ms')
-        events.set_index('date', drop = False, inplace = True)
+        events = pandas.DataFrame(cur.fetchall(), columns = AQMS_COLUMNS)
 
-    # Get a list of volcanoes that are within 40 km of this one.
-    # Since we limited the results to events that are within 20km of this volcano,
-    # any volcano that is more than twice that distance from this one is going to be more
-    # than 20km from the event, and therfore further from the event than this one.
-    # Since there are fewer volcanoes than events typically, this should minimize
-    # computational resources.
+    # Limit to only events that are closest to this volcano
+    events = events[_closest_to(volcano, events)]
 
-    volc_locs = pandas.DataFrame([(key, val[1], val[0]) for key, val in utils.VOLCANOES.items() if key != volcano],
-                                 columns = ['volc', 'lon', 'lat'])
+    return _finish_events(events)
 
-    volc_locs.loc[:, 'dist'] = utils.haversine_np(v_lon, v_lat, volc_locs.lon, volc_locs.lat)
 
-    canidate_volcs = volc_locs[volc_locs.dist < (max_dist * 2)]
-    #canidate_volcs = volc_locs
-    if canidate_volcs.size > 0:
+def _fetch_associated_data(volcano, lo, hi):
+    """
+    Read the events associated with volcano, between epoch seconds lo and hi,
+    from the aqms_event_volcano table (see associate_aqms.py), where the
+    nearest-volcano assignment has already been made.
+    """
+    args = {'volc': utils.VOLC_IDS[volcano]}
+    where_terms = ["volcano=%(volc)s"]
 
-        # Limit to only events that are closest to this volcano
-        # get distance to all volcanoes
-        dist_cols = ['distance', ]
-        for volc_rec in canidate_volcs.itertuples():
-            if volc_rec.volc == volcano:
-                continue #already have this value.
+    if lo != -math.inf:
+        where_terms.append("unix_time >= %(starttime)s")
+        args['starttime'] = lo
 
-            dist_col_name = f"dist_{volc_rec.volc}"
-            dist_cols.append(dist_col_name)
+    if hi != math.inf:
+        where_terms.append("unix_time <= %(endtime)s")
+        args['endtime'] = hi
 
-            #Convert km to m to keep units the same
-            events.loc[:, dist_col_name] = utils.haversine_np(volc_rec.lon,
-                                                              volc_rec.lat,
-                                                              events['long'],
-                                                              events['lat']) * 1000
+    query = """
+    SELECT  evid as "eventId",
+            unix_time as "unixTime",
+            lat,
+            lon as "long",
+            depth_km as "depthKM",
+            auto,
+            type,
+            mag,
+            gap as "azimuthal-gap",
+            ndef as "num-phases-used",
+            erhor as "horizontal-error",
+            sdep as "vertical-error",
+            distance
+        FROM aqms_event_volcano
+    WHERE
+    """
+    query += " AND ".join(where_terms)
+    query += """
+    ORDER BY unix_time;
+    """
 
-        # Get the distance to the closest volcano
-        events.loc[:, 'min_dist'] = events.loc[:, dist_cols].min(axis = 1)
+    with utils.PostgreSQLCursor("multiplot", row_factory = dict_row) as cur:
+        cur.execute(query, args)
+        events = pandas.DataFrame(cur.fetchall(), columns = AQMS_COLUMNS)
 
-        # Filter the data to only those where the closest volcano is the volcano of interest
-        events = events[events.min_dist == events.distance]
+    return _finish_events(events)
 
-    events.loc[:, 'distance'] = (events['distance'] / 1000).round(2)
 
-    # Make the date column be in ISO format for plotting
-    events['date'] = events['date'].apply(lambda x: x.isoformat())
+def _finish_events(events):
+    """Convert the columns of a queried event frame to the form the plots use"""
+    events['eventId'] = "av" + events['eventId'].astype(str)
+    events['unixTime'] = events['unixTime'].astype(float) * 1000
+    events['date'] = pandas.to_datetime(events['unixTime'], unit = 'ms')
+    events.set_index('date', drop = False, inplace = True)
+    events['distance'] = (events['distance'] / 1000).round(2)
 
     return events
 
+
+def _nearby_volcanoes(volcano, reach):
+    """Return (lats, lons) of the other volcanoes within reach km of volcano"""
+    others = [(val[0], val[1]) for key, val in utils.VOLCANOES.items() if key != volcano]
+    if not others:
+        return numpy.empty(0), numpy.empty(0)
+
+    v_lat, v_lon = utils.VOLCANOES[volcano][:2]
+    volc_lat, volc_lon = numpy.array(others, dtype = float).T
+    nearby = utils.haversine_np(v_lon, v_lat, volc_lon, volc_lat) < reach
+    return volc_lat[nearby], volc_lon[nearby]
+
+
+def _closest_to(volcano, events):
+    """
+    Return a boolean array, True for each event that is no further from
+    volcano than from any other volcano in utils.VOLCANOES.
+    """
+    if events.empty:
+        return numpy.ones(0, dtype = bool)
+
+    # Every event is within max_dist of this volcano, so only volcanoes within
+    # twice the furthest event's distance of it can be closer to any event.
+    volc_lat, volc_lon = _nearby_volcanoes(volcano, events['distance'].max() / 1000 * 2)
+    if not len(volc_lat):
+        return numpy.ones(len(events), dtype = bool)
+
+    # One (events x nearby volcanoes) distance matrix, in m like 'distance'
+    ev_lat = events['lat'].to_numpy(dtype = float)[:, numpy.newaxis]
+    ev_lon = events['long'].to_numpy(dtype = float)[:, numpy.newaxis]
+    dists = utils.haversine_np(volc_lon, volc_lat, ev_lon, ev_lat) * 1000
+
+    return events['distance'].to_numpy(dtype = float) <= dists.min(axis = 1)
+
+def get_aqms_counts(volcano, t_start, t_end, bin_size):
+    """
+    Count the AQMS events closest to volcano in each day, week or month
+    (bin_size) between t_start and t_end, with the grouping done by the database
+    so that only the counts are transferred.
+
+    RETURNS
+    -------
+        DataFrame: date and y (the count) columns, one row per bin from the
+                   first to the last with any events, labelled as pandas
+                   labels them (weeks by their Sunday)
+    """
+    lo = _epoch(t_start, -math.inf)
+    hi = _epoch(t_end, math.inf)
+
+    if AQMS_USE_ASSOCIATION:
+        args = {'volc': utils.VOLC_IDS[volcano], 'bin_size': bin_size}
+        where_terms = ["volcano=%(volc)s"]
+        if lo != -math.inf:
+            where_terms.append("unix_time >= %(starttime)s")
+            args['starttime'] = lo
+        if hi != math.inf:
+            where_terms.append("unix_time <= %(endtime)s")
+            args['endtime'] = hi
+
+        query = """
+        SELECT date_trunc(%(bin_size)s, to_timestamp(unix_time) AT TIME ZONE 'UTC') as bucket,
+               count(*) as count
+            FROM aqms_event_volcano
+        WHERE
+        """
+        query += " AND ".join(where_terms)
+        query += " GROUP BY bucket ORDER BY bucket"
+        cursor = utils.PostgreSQLCursor("multiplot")
+    else:
+        where_terms, args = _search_terms(volcano, lo, hi)
+        args['bin_size'] = bin_size
+
+        # The SQL equivalent of _closest_to: no nearby volcano is closer.
+        volc_lat, volc_lon = _nearby_volcanoes(volcano, args['maxDist'] * 2)
+        if len(volc_lat):
+            args['otherLats'] = volc_lat.tolist()
+            args['otherLons'] = volc_lon.tolist()
+            where_terms.append("""NOT EXISTS (
+                SELECT 1 FROM unnest(%(otherLons)s::float8[], %(otherLats)s::float8[]) AS other(v_lon, v_lat)
+                WHERE ST_Distance(ST_SetSRID(ST_MakePoint(lon, lat), 4326)::geography,
+                                  ST_SetSRID(ST_MakePoint(v_lon, v_lat), 4326)::geography,
+                                  false)
+                    < ST_Distance(ST_SetSRID(ST_MakePoint(lon, lat), 4326)::geography,
+                                  ST_SetSRID(ST_MakePoint(%(volcLon)s, %(volcLat)s), 4326)::geography,
+                                  false))""")
+
+        query = """
+        SELECT date_trunc(%(bin_size)s,
+                          to_timestamp(truetime.true2nominalf(o.datetime)) AT TIME ZONE 'UTC') as bucket,
+               count(*) as count
+            FROM event e
+            INNER JOIN origin o ON o.orid=e.prefor
+            INNER JOIN netmag n ON e.prefmag=n.magid
+        WHERE
+        """
+        query += " AND ".join(where_terms)
+        query += " GROUP BY bucket ORDER BY bucket"
+        cursor = utils.PostgreSQLCursor(config.AQMS_DB, user = config.AQMS_USER,
+                                        password = config.AQMS_PASS, host = config.AQMS_HOST)
+
+    with cursor as cur:
+        cur.execute(query, args)
+        rows = cur.fetchall()
+
+    freq = utils.COUNT_BINS[bin_size]
+    if not rows:
+        return pandas.DataFrame({'date': pandas.DatetimeIndex([]), 'y': numpy.empty(0, dtype = int)})
+
+    buckets, counts = zip(*rows)
+    buckets = pandas.DatetimeIndex(buckets)
+    if bin_size == 'week':
+        # date_trunc starts weeks on Monday; pandas labels them by the Sunday ending them
+        buckets = buckets + pandas.Timedelta(days = 6)
+
+    counts = pandas.Series(counts, index = buckets, dtype = int)
+    # pandas includes the empty bins between the first and last, so do the same
+    counts = counts.reindex(pandas.date_range(buckets[0], buckets[-1], freq = freq), fill_value = 0)
+
+    return pandas.DataFrame({'date': counts.index, 'y': counts.to_numpy()})
+
 ################# SEISDB #################
 keyword_sort_order = {
     71: 1,
@@ -192,7 +499,7 @@ AND volcano_id=%s
 def seisdb_keywords(volcano, start, end) -> pandas.DataFrame:
     data = get_seisdb_data(volcano, start, end)
 
-    types_string = flask.request.args.get('addArgs')
+    types_string = utils.plot_args().get('addArgs')
     types_dict = parse_qs(types_string)
     if types_dict:
         selectedTypes = [int(x) for x in types_dict['types']]
@@ -201,13 +508,12 @@ def seisdb_keywords(volcano, start, end) -> pandas.DataFrame:
     if data.size <= 0:
         return {}
 
-    data['date'] = data['date'].apply(lambda x: x.isoformat())
     found_keywords = data['keyword_id'].unique().tolist()
 
     grouped_data = data.groupby('keyword_id')
 
     data = {
-        str(x): grouped_data.get_group(x)['date'].tolist()
+        str(x): serialization.iso_format(grouped_data.get_group(x)['date'])
         for x in found_keywords
     }
     order = sorted(found_keywords, key = keyword_sort_order.get)
@@ -224,8 +530,8 @@ def seisdb_keywords(volcano, start, end) -> pandas.DataFrame:
 @generator("Distance (AQMS)")
 def aqms_distances(volcano, start = None, end = None):
     data = get_aqms_data(volcano, start, end)
-    data.rename(columns={'distance': 'y'}, inplace=True)
-    ret = data[['date', 'y']].to_dict(orient = "list")
+    data = data[['date', 'distance']].rename(columns={'distance': 'y'})
+    ret = serialization.frame_to_dict(data)
     ret['ylabel'] = 'Distance (km)'
     return ret
 
@@ -233,9 +539,8 @@ def aqms_distances(volcano, start = None, end = None):
 @generator("Magnitude (AQMS)")
 def aqms_magnitude(volcano, start = None, end = None):
     data = get_aqms_data(volcano, start, end)
-    data = data.loc[:, ['date', 'mag']]
-    data.rename(columns={'mag': 'y'}, inplace=True)
-    ret = data.to_dict(orient = "list")
+    data = data[['date', 'mag']].rename(columns={'mag': 'y'})
+    ret = serialization.frame_to_dict(data)
     ret['ylabel'] = "Magnitude"
 
     return ret
@@ -243,25 +548,19 @@ def aqms_magnitude(volcano, start = None, end = None):
 
 @generator("Depth (AQMS)")
 def aqms_depth(volcano, start = None, end = None):
-    data = get_aqms_data(volcano)
+    data = get_aqms_data(volcano, start, end)
     data = data.loc[:, ['date', 'depthKM']]
 
-    return data.to_dict(orient = "list")
+    return serialization.frame_to_dict(data)
 
 
 @generator("Weekly Event Count (AQMS)")
 def aqms_event_count(volcano, start = None, end = None):
-    data = get_aqms_data(volcano, start, end)
-
-    # Group by the index, which is the date as an object
-    grouper = pandas.Grouper(level = 0, freq = 'W')
-
-    # Too much chaining to get a single-line function :-)
-    counts = data.loc[:, 'mag'].groupby([grouper]).count().reset_index(drop = False).rename(columns = {'mag': 'y'})
+    # Weekly by default, or per day or month with addArgs=bin=day|month
+    bin_size = utils.count_bin(utils.plot_args().get('addArgs'))
+    counts = get_aqms_counts(volcano, start, end, bin_size)
 
-    #Plotly wants an ISO string for the date, simple json doesn't convert correctly.
-    counts['date'] = counts['date'].apply(lambda x: pandas.to_datetime(x).isoformat())
-    ret = counts.to_dict(orient = "list")
-    ret['ylabel'] = "Events/week"
+    ret = serialization.frame_to_dict(counts)
+    ret['ylabel'] = f"Events/{bin_size}"
 
     return ret 
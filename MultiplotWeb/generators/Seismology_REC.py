@@ -8,14 +8,38 @@ CATEGORY = "Seismology (REC)"
 import glob
 import os
 
-from datetime import timezone
-
 import pandas
 
-from . import utils, generator, config
+from . import utils, generator, config, catalog_store, filecache, serialization
+
+def get_seismology_rec(volcano, columns = None, start = None, end = None):
+    """
+    Utility function to retrieve the relocated catalog for a volcano as a pandas data frame.
+    The frame may be shared through the file cache, so must not be modified in place.
+
+    ARGUMENTS
+    ---------
+        volcano: The volcano to get the catalog for
+        columns: The columns needed, besides date. Default: all
+        start, end: Only return events in this time range (either may be None)
+    """
+    data_file = get_rec_file(volcano)
+
+    # Read from the column store (see catalog_store) if the catalog has been converted.
+    store = catalog_store.open_store(data_file)
+    if store is not None:
+        wanted = None if columns is None else ['UTCDateTime', 'Magnitude', *columns]
+        data = store.read(wanted, start, end).rename(columns = {'UTCDateTime': 'date', })
+        data.set_index('date', drop = False, inplace = True)
+        data = data.loc[data['Magnitude'] > -5]
+    else:
+        data = utils.select_window(filecache.load(data_file, _load_rec), start, end)
+
+    return data if columns is None else data.loc[:, ['date', *columns]]
 
-def get_seismology_rec(volcano):
-    """Utility function to retrieve the relocated catalog for a volcano as a pandas data frame"""
+
+def get_rec_file(volcano):
+    """Return the path of the relocated catalog for a volcano"""
     data_dir = os.path.join(config.DATA_DIR, "SeismoAcoustic_Data")
     volc_dir = glob.glob(os.path.join(data_dir, f"{volcano}*"))
     if not volc_dir:
@@ -23,77 +47,65 @@ def get_seismology_rec(volcano):
 
     volc_dir = volc_dir[0]
     data_file = glob.glob(os.path.join(volc_dir, "*_relocated_catalog.csv"))
-    data_file = data_file[0]
+    return data_file[0]
+
+
+def _load_rec(data_file):
     data = pandas.read_csv(
         data_file,
         parse_dates = ['UTCDateTime']).rename(columns = {'UTCDateTime': 'date', })
     data.set_index('date', drop = False, inplace = True)
-    data['date'] = data['date'].apply(lambda x: pandas.to_datetime(x).isoformat())
 
-    return data.loc[data['Magnitude'] > -5]
+    data = data.loc[data['Magnitude'] > -5]
+    return data.sort_index(kind = 'stable')
 
 
-@generator("Frequency Index")
+@generator("Frequency Index", cache_ttl = 3600)
 def eq_frequency_index_rec(volcano, start = None, end = None):
-    data = get_seismology_rec(volcano)
-    data = data.loc[:, ['date', 'FI']]
+    data = get_seismology_rec(volcano, ['FI'], start, end)
 
     data.rename(columns={'FI': 'y',}, inplace=True)
-    resp = data.to_dict(orient = "list")
+    resp = serialization.frame_to_dict(data)
     resp['ylabel'] = 'Frequency Index'
 
     return resp
 
 
-@generator("Magnitude")
+@generator("Magnitude", cache_ttl = 3600)
 def eq_magnitude(volcano, start = None, end = None):
-    data = get_seismology_rec(volcano)
-    data = data.loc[:, ['date', 'Magnitude']]
+    data = get_seismology_rec(volcano, ['Magnitude'], start, end)
 
     data.rename(columns={'Magnitude': 'y',}, inplace=True)
-    resp = data.to_dict(orient = "list")
+    resp = serialization.frame_to_dict(data)
     resp['ylabel'] = 'Magnitude'
 
     return resp
 
 
-@generator("Depth")
+@generator("Depth", cache_ttl = 3600)
 def eq_depth(volcano, start = None, end = None):
-    data = get_seismology_rec(volcano)
-    data = data.loc[:, ['date', 'Depth_km']]
+    data = get_seismology_rec(volcano, ['Depth_km'], start, end)
 
-    return data.to_dict(orient = "list")
+    return serialization.frame_to_dict(data)
 
 
-@generator("Distance")
+@generator("Distance", cache_ttl = 3600)
 def eq_distance(volcano, start = None, end = None):
-    data = get_seismology_rec(volcano)
-    data = data.loc[data['Magnitude'] > -5, ['date', 'Latitude', 'Longitude']]
+    data = get_seismology_rec(volcano, ['Latitude', 'Longitude'], start, end)
     v_lat, v_lon = utils.VOLCANOES[volcano][:2]
     distances = utils.haversine_np(v_lon, v_lat, data['Longitude'], data['Latitude'])
     data.loc[:, 'y'] = distances
 
-    resp = data.to_dict(orient = "list")
+    resp = serialization.frame_to_dict(data)
     resp['ylabel'] = 'Distance (km)'
 
     return resp
 
 
-@generator("Location/Depth")
+@generator("Location/Depth", cache_ttl = 3600)
 def eq_location_depth(volcano, start = None, end = None):
-    data = get_seismology_rec(volcano)
-    data = data.loc[:, ['date', 'Latitude', 'Longitude', 'Depth_km']]
-
-    # Filter the data by date, since we do not have a date axis
-    # to zoom on with our plotly grah for this.
-    if start is not None or end is not None:
-        dateFilter = pandas.to_datetime(data['date'])
-        if start is not None:
-            start = start.replace(tzinfo = timezone.utc)
-            data = data[dateFilter >= start]
-
-        if end is not None:
-            end = end.replace(tzinfo = timezone.utc)
-            data = data[dateFilter <= end]
-
-    return data.to_dict(orient = "list")
+    # Filtering by date matters most here, since we do not have a date
+    # axis to zoom on with our plotly graph for this.
+    data = get_seismology_rec(volcano, ['Latitude', 'Longitude', 'Depth_km'], start, end)
+
+    return serialization.frame_to_dict(data)
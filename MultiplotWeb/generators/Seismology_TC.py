@@ -10,10 +10,10 @@ import os
 
 import pandas
 
-from . import config, generator
+from . import utils, config, catalog_store, filecache, generator, serialization
 
-def get_seismology_tc(volcano):
-    """Utility function to retrieve the temporally complete event list for a volcano as a pandas data frame"""
+def get_tc_file(volcano):
+    """Return the path of the temporally complete event list for a volcano"""
     data_dir = os.path.join(config.DATA_DIR, "SeismoAcoustic_Data")
     volc_dir = glob.glob(os.path.join(data_dir, f"{volcano}*"))
     if not volc_dir:
@@ -21,36 +21,93 @@ def get_seismology_tc(volcano):
 
     volc_dir = volc_dir[0]
     data_file = glob.glob(os.path.join(volc_dir, "*_temporally_complete_event_list.csv"))
-    data_file = data_file[0]
+    return data_file[0]
+
+
+def get_seismology_tc(volcano, columns = None, start = None, end = None):
+    """
+    Utility function to retrieve the temporally complete event list for a volcano as a pandas data frame.
+    The frame may be shared through the file cache, so must not be modified in place.
+
+    ARGUMENTS
+    ---------
+        volcano: The volcano to get the catalog for
+        columns: The columns needed, besides date. Default: all
+        start, end: Only return events in this time range (either may be None)
+    """
+    data_file = get_tc_file(volcano)
+
+    # Read from the column store (see catalog_store) if the catalog has been converted.
+    store = catalog_store.open_store(data_file)
+    if store is not None:
+        wanted = None if columns is None else ['UTCDateTime', *columns]
+        data = store.read(wanted, start, end).rename(columns = {'UTCDateTime': 'date', })
+        data.set_index('date', drop = False, inplace = True)
+        return data
+
+    data = utils.select_window(filecache.load(data_file, _load_tc), start, end)
+    return data if columns is None else data.loc[:, ['date', *columns]]
+
+
+def _load_tc(data_file):
     data = pandas.read_csv(data_file, parse_dates = ['UTCDateTime']).rename(columns = {'UTCDateTime': 'date', })
     data.set_index('date', drop = False, inplace = True)
-    data['date'] = data['date'].apply(lambda x: pandas.to_datetime(x).isoformat())
+    return data.sort_index(kind = 'stable')
 
-    return data
 
+def get_tc_counts(volcano, bin_size, start = None, end = None):
+    """
+    Return the number of TC events in each bin (a utils.COUNT_BINS key)
+    between start and end as a date/y frame, with one row per bin from the
+    first to the last with any events.
+    """
+    # Built from daily counts, which are cached alongside the catalog (so only
+    # recomputed when the file changes). Requested date ranges are whole days,
+    # so a window of days is exact.
+    daily = filecache.load(get_tc_file(volcano), _tc_daily_counts)
+    daily = utils.select_window(daily, start, end)
 
-@generator("Weekly Event Count")
-def tc_event_count(volcano, start = None, end = None):
-    data = get_seismology_tc(volcano)
+    # Drop empty days before the first and after the last event in the window
+    nonzero = daily.to_numpy().nonzero()[0]
+    daily = daily.iloc[nonzero[0]:nonzero[-1] + 1] if len(nonzero) else daily.iloc[:0]
+
+    if bin_size == 'day':
+        counts = daily
+    else:
+        counts = daily.resample(utils.COUNT_BINS[bin_size]).sum()
+
+    return counts.rename('y').rename_axis('date').reset_index(drop = False)
+
+
+def _tc_daily_counts(data_file):
+    store = catalog_store.open_store(data_file)
+    if store is not None:
+        data = store.read(['UTCDateTime', 'FI']).set_index('UTCDateTime')
+    else:
+        data = filecache.load(data_file, _load_tc)
 
     # Group by the index, which is the date as an object
-    grouper = pandas.Grouper(level = 0, freq = 'W')
-    # Too much chaining to get a single-line function :-)
-    counts = data.loc[:, 'FI'].groupby([grouper]).count().reset_index(drop = False).rename(columns = {'FI': 'y'})
+    grouper = pandas.Grouper(level = 0, freq = 'D')
+    return data.loc[:, 'FI'].groupby([grouper]).count()
+
+
+@generator("Weekly Event Count", cache_ttl = 3600)
+def tc_event_count(volcano, start = None, end = None):
+    # Weekly by default, or per day or month with addArgs=bin=day|month
+    bin_size = utils.count_bin(utils.plot_args().get('addArgs'))
+    counts = get_tc_counts(volcano, bin_size, start, end)
 
-    #Plotly wants an ISO string for the date, simple json doesn't convert correctly.
-    counts['date'] = counts['date'].apply(lambda x: pandas.to_datetime(x).isoformat())
-    ret = counts.to_dict(orient = "list")
+    ret = serialization.frame_to_dict(counts)
     ret['ylabel'] = 'TC Event Count'
 
     return ret
 
 
-@generator("Frequency Index")
+@generator("Frequency Index", cache_ttl = 3600)
 def eq_frequency_index_tc(volcano, start = None, end = None):
-    data = get_seismology_tc(volcano)
-    data.rename(columns={'FI': 'y',}, inplace=True)
-    resp = data.to_dict(orient = "list")
+    data = get_seismology_tc(volcano, ['FI'], start, end)
+    data = data.rename(columns={'FI': 'y',})
+    resp = serialization.frame_to_dict(data)
     resp['ylabel'] = 'Frequency Index'
 
     return resp
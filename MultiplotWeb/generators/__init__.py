@@ -1,2 +1,2 @@
-from MultiplotWeb import utils, app, config
+from MultiplotWeb import utils, app, catalog_store, config, downsample, filecache, serialization, shared_cache, timing
 from MultiplotWeb.generator import generator
@@ -2,11 +2,10 @@
 from datetime import timedelta
 from urllib.parse import parse_qs
 
-import flask
 import pandas
 import psycopg
 
-from . import utils, generator
+from . import utils, generator, serialization
 
 
 def get_db_labels():
@@ -23,7 +22,7 @@ def plot_db_dataset(volcano, start=None, end=None):
     tag = utils.current_plot_tag.get()
 
     category, title = tag.split("|")
-    query_string = flask.request.args.get('addArgs', '')
+    query_string = utils.plot_args().get('addArgs', '')
     requested_types = parse_qs(query_string).get('types')
 
     METADATA_SQL = """SELECT
@@ -108,7 +107,6 @@ def plot_db_dataset(volcano, start=None, end=None):
     if len(df) == 0:
         raise FileNotFoundError("Unable to find requested data")
 
-    df['datetime'] = df['datetime'].apply(lambda x: pandas.to_datetime(x).isoformat())
     result ={
         'labels': units,
         'plotOverrides': plot_format,
@@ -118,12 +116,12 @@ def plot_db_dataset(volcano, start=None, end=None):
         type_df = df.groupby("type")
         for record_type in types:
             try:
-                result[record_type] = type_df.get_group(record_type).to_dict(orient='list')
+                result[record_type] = serialization.frame_to_dict(type_df.get_group(record_type))
             except KeyError:
                 if type(units) == dict and record_type in units:
                     del units[record_type]
     else:
-        result[title] = df.to_dict(orient='list')
+        result[title] = serialization.frame_to_dict(df)
 
 
     return result
@@ -7,7 +7,7 @@ from urllib.parse import parse_qs
 import flask
 import pandas
 
-from . import utils, generator
+from . import utils, generator, downsample
 column_mapping = {
     'SO<sub>2</sub> rate': ('so2_rate_t_d', 'SO<sub>2</sub> EM Rate (t/d)'),
     'Wind Speed': ('wind_speed',"Wind Speed (m/s)"),
@@ -47,6 +47,9 @@ def plot_doas(volcano, start=None, end=None):
     if df.empty:
         raise FileNotFoundError("Unable to find requested data")
 
+    # Thin out each instrument's trace to what the client can display, if it asked.
+    df = downsample.downsample_groups(df, 'date', 'y', 'type')
+
     df['date'] = df['date'].dt.strftime('%Y-%m-%d %H:%M:%S')
     grouped_df = df.groupby('type')
 
@@ -2,7 +2,6 @@ CATEGORY = "Geodesy"
 
 from urllib.parse import parse_qs
 
-import flask
 import pandas
 import requests
 
@@ -24,7 +23,7 @@ def plot_geodesy_dataset(volcano, start, end):
         part = "UD"
         error = "UDE"
 
-    query_string = flask.request.args.get('addArgs', '')
+    query_string = utils.plot_args().get('addArgs', '')
     args = parse_qs(query_string)
     station = args.get('station')
     base = args.get('base')
@@ -1,13 +1,20 @@
 """Generic database table plotting function. Should be written to work with ANY table provided."""
 
+import copy
 import decimal
+import functools
+import hashlib
+import heapq
+import json
+import os
 import re
-import time
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 from urllib.parse import parse_qs
 
 import numpy
-from cachetools.func import ttl_cache
 from cachetools import TTLCache, cached
 from cachetools.keys import hashkey
 
@@ -15,13 +22,38 @@ import flask
 import pandas
 import psycopg
 
-from . import generator, utils, app
+from . import generator, utils, app, config, downsample, filecache, serialization, shared_cache, timing
+
+# Metadata is cached (in the cache shared by all workers) under a fingerprint
+# of the tables it is read from, so any change to them invalidates it. The
+# fingerprint is itself re-read at most every PREEVENTS_METADATA_VERSION_TTL
+# seconds, which bounds how long a change can go unnoticed.
+PREEVENTS_METADATA_CACHE = getattr(config, 'PREEVENTS_METADATA_CACHE', True)
+PREEVENTS_METADATA_TTL = getattr(config, 'PREEVENTS_METADATA_TTL', 86400)  # seconds
+PREEVENTS_METADATA_VERSION_TTL = getattr(config, 'PREEVENTS_METADATA_VERSION_TTL', 10)  # seconds
+
+PREEVENTS_METADATA_TABLES = ('datastreams', 'datasets', 'disciplines', 'devices',
+                             'variables', 'displaynames', 'units')
+
+# The preevents labels, and the version of the tables they came from. Set to
+# None to query the labels every time (see preevents_label_query()).
+PREEVENTS_LABELS_FILE = getattr(config, 'PREEVENTS_LABELS_FILE', '/run/multiplot/preevents_labels.json')
+
+# When the client limits the points per trace (see downsample.py), have the
+# database reduce each trace to that many time buckets, returning the mean
+# with the min and max as error bars, rather than fetching every sample.
+PREEVENTS_AGGREGATE = getattr(config, 'PREEVENTS_AGGREGATE', True)
+
+# A dataset whose datastreams are spread over several observation tables is
+# read with one query per table, run concurrently on separate connections by
+# this pool, shared by all requests in the worker.
+TABLE_POOL = ThreadPoolExecutor(
+    max_workers = getattr(config, 'PREEVENTS_TABLE_WORKERS', 4),
+    thread_name_prefix = 'preevents'
+)
 
 ########## Label queries ############
-@ttl_cache(ttl = 86400) # cache for one day.
-def preevents_label_query():
-    with utils.PREEVENTSSQLCursor() as cursor:
-        cursor.execute("""
+LABELS_SQL = """
 WITH displayname_dataset_counts AS (
     SELECT
         display_names.displayname,
@@ -55,22 +87,103 @@ INNER JOIN displayname_dataset_counts AS ddc ON ddc.displayname = display_names.
 WHERE variables.unit_id != 6 --id 6 = categorical
 ORDER BY discipline_name, enhanced_displayname
 """
-                    )
+
+
+def _query_preevents_labels():
+    with utils.PREEVENTSSQLCursor() as cursor:
+        cursor.execute(LABELS_SQL)
         return cursor.fetchall()
 
-def get_preevents_labels():
+
+def _load_label_snapshot(path):
+    with open(path) as f:
+        snapshot = json.load(f)
+    snapshot['labels'] = [tuple(label) for label in snapshot['labels']]
+    return snapshot
+
+
+def _save_label_snapshot(version, labels):
+    path = PREEVENTS_LABELS_FILE
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok = True)
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': version, 'labels': [list(label) for label in labels]}, f)
+        os.replace(tmp_path, path)
+    except (OSError, TypeError, ValueError) as e:
+        app.logger.warning(f"Unable to save the preevents labels to {path}: {e}")
+
+
+def preevents_label_query():
+    """
+    Return a (displayname, discipline, dataset_id, variable_id, variable
+    name, variable description, dataset description) row for every
+    non-categorical dataset variable in the preevents database.
+
+    The rows are kept in a snapshot file (PREEVENTS_LABELS_FILE), shared by
+    every worker, along with the version of the tables they were read from.
+    The query only runs again once those tables have changed, and if the
+    database can't be reached, the snapshot is used regardless.
+    """
+    try:
+        version = hashlib.sha1(f"{LABELS_SQL}{preevents_metadata_version()}".encode()).hexdigest()
+    except psycopg.Error as e:
+        app.logger.warning(f"Unable to check the preevents labels for changes: {e}")
+        version = None
+
+    snapshot = None
+    if PREEVENTS_LABELS_FILE:
+        try:
+            snapshot = filecache.load(PREEVENTS_LABELS_FILE, _load_label_snapshot)
+        except (OSError, ValueError, KeyError, TypeError):
+            snapshot = None
+
+    if snapshot is not None and version in (None, snapshot['version']):
+        return snapshot['labels']
+
+    labels = [tuple(label) for label in _query_preevents_labels()]
+    if PREEVENTS_LABELS_FILE and version is not None:
+        _save_label_snapshot(version, labels)
+    return labels
+
+######## Display settings ###########
+# The preevents table of the multiplot database holds, for each dataset and
+# variable, whether to hide it and any plotly overrides for its plot. It is
+# small, so every worker keeps all of it, and only reads it again when its
+# version changes.
+@shared_cache.shared_ttl_cache(ttl = PREEVENTS_METADATA_VERSION_TTL)
+def preevents_settings_version() -> str:
+    """The version (see _table_version) of the multiplot preevents table"""
     with utils.PostgreSQLCursor("multiplot") as cursor:
-        cursor.execute("SELECT dataset_id,variable_id,hidden FROM preevents")
-        display_flags = {
-            (x[0], x[1]): x[2]
-            for x in cursor
+        return _table_version(cursor, ('preevents', ))
+
+
+@cached(cache = TTLCache(maxsize = 4, ttl = 86400))
+def _preevents_settings(version):
+    with utils.PostgreSQLCursor("multiplot") as cursor:
+        cursor.execute("SELECT dataset_id, variable_id, hidden, overrides FROM preevents")
+        return {
+            (dataset_id, variable_id): (hidden, overrides)
+            for dataset_id, variable_id, hidden, overrides in cursor
         }
 
+
+def preevents_settings() -> dict:
+    """
+    Return {(dataset_id, variable_id): (hidden, overrides)} for every row of
+    the preevents table. The overrides are shared, so copy before changing them.
+    """
+    return _preevents_settings(preevents_settings_version())
+
+
+def get_preevents_labels():
+    display_flags = preevents_settings()
+
     try:
         labels = [
             label[:2]
             for label in preevents_label_query()
-            if not display_flags.get(label[2:4], False)
+            if not display_flags.get(label[2:4], (False, None))[0]
         ]
     except Exception as e:
         app.logger.error(f"Error getting preevents labels: {e}")
@@ -130,14 +243,79 @@ def preevents_metadata_web():
 
     return flask.jsonify(metadata)
 
-def meta_key(meta_args, cursor = None, requested_types = ()):
-    if requested_types is None:
-        requested_types = ()    
-    return hashkey(*meta_args, tuple(requested_types))
+def _table_version(cursor, tables) -> str:
+    """
+    A fingerprint of some tables, which changes whenever a row of any of
+    them is inserted, updated or deleted.
+
+    It is read from the tables themselves: the row count, which every delete
+    lowers, and the newest transaction id (xmin) of any row, which every
+    insert or update advances. So unlike the statistics views it is up to
+    date as soon as a change commits, survives restarts, and is the same on
+    a standby as on the primary. It does mean reading every row, so only use
+    it for small tables.
+    """
+    # xid has no ordering, but its text form is a number.
+    cursor.execute(psycopg.sql.SQL(' UNION ALL ').join(
+        psycopg.sql.SQL("SELECT {name}, count(*), max(xmin::text::bigint) FROM {table}").format(
+            name = psycopg.sql.Literal(table),
+            table = psycopg.sql.Identifier(table),
+        )
+        for table in sorted(tables)
+    ))
+    stats = cursor.fetchall()
+
+    return hashlib.sha1(repr(stats).encode()).hexdigest()
+
 
-##### DEBUG: REMOVE COMMENT #####
-#@cached(cache = TTLCache(maxsize = 128, ttl = 86400), key = meta_key)
-def get_preevents_metadata(meta_args, cursor = None, requested_types = None ):
+# The version is the same whichever cursor reads it, so the cursor is not part of the key.
+@shared_cache.shared_ttl_cache(ttl = PREEVENTS_METADATA_VERSION_TTL, key = lambda cursor = None: hashkey())
+def preevents_metadata_version(cursor = None) -> str:
+    """
+    The version (see _table_version) of the tables the metadata is read from,
+    read with cursor if given, or else a connection of its own.
+    """
+    if cursor is None:
+        with utils.PREEVENTSSQLCursor() as cursor:
+            return _table_version(cursor, PREEVENTS_METADATA_TABLES)
+
+    return _table_version(cursor, PREEVENTS_METADATA_TABLES)
+
+
+_metadata_cache = shared_cache.SharedCache('preevents_metadata', PREEVENTS_METADATA_TTL)
+
+
+def get_preevents_metadata(meta_args, cursor = None, requested_types = None):
+    """
+    Return (datastream ids, device names, unit names, observation tables,
+    dataset id, variable id) for meta_args, a (discipline, displayname,
+    volcano id) sequence, optionally limited to the requested devices.
+    Returns None if there is no such dataset.
+    """
+    if not PREEVENTS_METADATA_CACHE:
+        return _query_preevents_metadata(meta_args, cursor, requested_types)
+
+    requested = None if requested_types is None else tuple(requested_types)
+    key = (preevents_metadata_version(cursor), *meta_args, requested)
+    entry = _metadata_cache.get_entry(key)
+    if entry is not None:
+        return entry[0]
+
+    metadata = _query_preevents_metadata(meta_args, cursor, requested_types)
+    _metadata_cache.put(key, metadata)
+    return metadata
+
+
+def invalidate_preevents_metadata():
+    """Forget all cached metadata, in every worker, e.g. after editing the preevents tables"""
+    preevents_metadata_version.cache_clear()
+    _metadata_cache.clear()
+
+
+get_preevents_metadata.cache_clear = invalidate_preevents_metadata
+
+
+def _query_preevents_metadata(meta_args, cursor, requested_types):
     if cursor is None:
         with utils.PREEVENTSSQLCursor() as cursor:
             return _fetch_preevents_metadata(meta_args, cursor, requested_types)
@@ -165,6 +343,8 @@ def _fetch_preevents_metadata(meta_args, cursor, requested_types):
         AND volcano_id=%s
     """
 
+    # A copy, so the caller's list (and the cache key made from it) is unchanged
+    meta_args = list(meta_args)
     if requested_types is not None:
         METADATA_SQL += " AND device_name=ANY(%s)"
         meta_args.append(requested_types)
@@ -177,43 +357,24 @@ def _fetch_preevents_metadata(meta_args, cursor, requested_types):
     return cursor.fetchone()
 
 
-@generator(get_preevents_labels)
-def plot_preevents_dataset(volcano, start=None, end=None):
-    """Get plot data for a specified dataset from the database"""
-
-    volc_id = utils.VOLC_IDS[volcano]
-    tag = utils.current_plot_tag.get()
-
-    category, title = tag.split("|")
-    query_string = flask.request.args.get('addArgs', '')
-    query_args = parse_qs(query_string)
-    requested_types = query_args.get('types')
-    requested_filters = query_args.get('filters', [])
-    requested_subFeature = query_args.get('subFeature', ['__NONE__'])[0]
-    if requested_subFeature != "__NONE__":
-        volc_id = requested_subFeature
-
-    args = {
-        'volcano_id': volc_id,
-    }
+######## Data queries ##########
+class DataFilter(namedtuple('DataFilter', ['variable_id', 'is_json', 'field', 'key', 'operator', 'value'])):
+    """
+    A parsed "variable_id|condition" filter: only keep the data points at
+    times where the filter variable, from the same device and dataset,
+    meets the condition.
+    """
 
-    data_withs = []
-    data_wheres = [
-        psycopg.sql.SQL("dv.datastream_id = ANY(%(datastream_ids)s)"),
-        psycopg.sql.SQL("dv.datavalue IS NOT NULL"),
-        psycopg.sql.SQL("dv.datavalue::text!='NaN'")
-    ]
+    @property
+    def shape(self):
+        """Everything that goes into the SQL text, as opposed to the parameters"""
+        return (self.is_json, self.field, self.key, self.operator)
 
-    if start is not None:
-        data_wheres.append(psycopg.sql.SQL("dv.timestamp>=%(start_time)s"))
-        # start -= timedelta(days = 366)
-        args['start_time'] = start
-    if end is not None:
-        # end += timedelta(days = 366)
-        data_wheres.append(psycopg.sql.SQL("dv.timestamp<=%(end_time)s"))
-        args['end_time'] = end
 
-    for i, filter_value in enumerate(requested_filters):
+def parse_filters(requested_filters):
+    """Parse the filters argument into DataFilters, skipping (and logging) bad ones"""
+    filters = []
+    for filter_value in requested_filters:
         try:
             filter_var_id, condition = filter_value.split('|')
             filter_var_id = int(filter_var_id)
@@ -224,25 +385,57 @@ def plot_preevents_dataset(volcano, start=None, end=None):
             app.logger.error(f"Bad filter passed. Not using. {filter_value}")
             continue
 
-        # Alias values
-        filter_alias = psycopg.sql.Identifier(f"filter_{i}")
-        datavalue_alias = psycopg.sql.Identifier(f"dv{i}")
-        var_param = f"variable_id_{i}"
-        value_param = f"value_{i}"
+        filters.append(DataFilter(filter_var_id, is_json, field, key, operator, value))
 
-        filter_sql = psycopg.sql.SQL("""
-        {filter_alias} AS (
-            SELECT datastream_id, device_id, dataset_id, volcano_id
-            FROM datastreams
-            WHERE variable_id={var_id}
-            AND volcano_id=%(volcano_id)s
-        )
-        """).format(
-               filter_alias=filter_alias,
-               var_id=psycopg.sql.Placeholder(var_param),
-        )
-        data_withs.append(filter_sql)
-        args[var_param] = filter_var_id
+    return filters
+
+
+@functools.lru_cache(maxsize = 256)
+def compile_data_query(table, filter_shapes, has_start, has_end,
+                       aggregate = False) -> psycopg.sql.Composed:
+    """
+    Compose the statement selecting the data of a dataset, for a data table,
+    the shapes (DataFilter.shape) of the filters to apply, and which ends of
+    the time window are given. Only the shapes go into the SQL text, so a
+    statement is composed once and reused for every request like it.
+
+    The statement takes the parameters volcano_id, datastream_ids,
+    start_time and end_time (if given), and variable_id_<n> and value_<n>
+    for the nth filter.
+
+    Without aggregate, the rows are (timestamp, value, device) samples.
+    With it (which needs has_start), the samples of each device are grouped
+    into buckets of bucket_seconds (another parameter) from start_time, and
+    the rows are (device, bucket, samples, time, min, mean, max). The time
+    is the mean time of the bucket's samples, so a bucket of one sample is
+    returned exactly. If no device has more than max_points (a parameter
+    too) samples, each sample is returned as a bucket of its own instead.
+
+    Either way, the rows are ordered by device (in byte order, as python
+    compares strings, with no device last), then bucket (if any), then time,
+    so that rows from several tables can be merged (see _fetch_tables()).
+
+    Each filter becomes one CTE of the (device, dataset, time) keys at which
+    its condition holds, limited to the same time window as the data, and
+    the data are semi-joined against each set of keys. That lets the planner
+    hash each filter once, rather than probe it again for every data row.
+    """
+    time_wheres = []
+    if has_start:
+        time_wheres.append(psycopg.sql.SQL("{}.timestamp>=%(start_time)s"))
+    if has_end:
+        time_wheres.append(psycopg.sql.SQL("{}.timestamp<=%(end_time)s"))
+
+    data_withs = []
+    data_wheres = [
+        psycopg.sql.SQL("dv.datastream_id = ANY(%(datastream_ids)s)"),
+        psycopg.sql.SQL("dv.datavalue IS NOT NULL"),
+        psycopg.sql.SQL("dv.datavalue::text!='NaN'")
+    ]
+    data_wheres += [where.format(psycopg.sql.SQL("dv")) for where in time_wheres]
+
+    for i, (is_json, field, key, operator) in enumerate(filter_shapes):
+        filter_alias = psycopg.sql.Identifier(f"filter_{i}")
 
         if is_json:
             # Safely construct: column->>'key'
@@ -253,87 +446,256 @@ def plot_preevents_dataset(volcano, start=None, end=None):
         else:
             field_expr = psycopg.sql.Identifier(field)
 
-        join_sql = psycopg.sql.SQL("""
-        EXISTS (SELECT 1
-            FROM {f_alias} f{idx}
-            JOIN datavalues {dv_alias}
-              ON {dv_alias}.datastream_id = f{idx}.datastream_id
-              AND {dv_alias}.timestamp = dv.timestamp
-              AND {dv_alias}.{field} {op} {threshold}
-            WHERE f{idx}.device_id = d.device_id
-            AND f{idx}.dataset_id = ds.dataset_id
-            AND {dv_alias}.timestamp>=%(start_time)s
-            AND {dv_alias}.timestamp<=%(end_time)s
+        filter_wheres = [
+            psycopg.sql.SQL("f.variable_id={}").format(psycopg.sql.Placeholder(f"variable_id_{i}")),
+            psycopg.sql.SQL("f.volcano_id=%(volcano_id)s"),
+            psycopg.sql.SQL("fv.{} {} {}").format(
+                field_expr,
+                psycopg.sql.SQL(operator),
+                psycopg.sql.Placeholder(f"value_{i}")
+            ),
+        ]
+        filter_wheres += [where.format(psycopg.sql.SQL("fv")) for where in time_wheres]
+
+        data_withs.append(psycopg.sql.SQL("""
+        {filter_alias} AS (
+            SELECT f.device_id, f.dataset_id, fv.timestamp
+            FROM datastreams f
+            JOIN datavalues fv ON fv.datastream_id=f.datastream_id
+            WHERE {wheres}
         )
         """).format(
-            f_alias=filter_alias,
-            dv_alias=datavalue_alias,
-            idx=psycopg.sql.SQL(str(i)),
-            field=field_expr,
-            op=psycopg.sql.SQL(operator),
-            threshold=psycopg.sql.Placeholder(value_param)
-        )
-        data_wheres.append(join_sql)
-        args[value_param] = value
+            filter_alias = filter_alias,
+            wheres = psycopg.sql.SQL('\n            AND ').join(filter_wheres),
+        ))
 
+        data_wheres.append(psycopg.sql.SQL(
+            "(d.device_id, ds.dataset_id, dv.timestamp) IN "
+            "(SELECT device_id, dataset_id, timestamp FROM {filter_alias})"
+        ).format(filter_alias = filter_alias))
 
-    wheres_sql = (
-        psycopg.sql.SQL("WHERE ") + psycopg.sql.SQL('\nAND ').join(data_wheres)
-        if data_wheres
-        else psycopg.sql.SQL("")
+    from_sql = psycopg.sql.SQL("""
+    FROM {table} dv
+    INNER JOIN datastreams ds ON ds.datastream_id=dv.datastream_id
+    LEFT JOIN devices d ON d.device_id=ds.device_id
+    WHERE {wheres}""").format(
+        table = psycopg.sql.Identifier(table),
+        wheres = psycopg.sql.SQL('\n    AND ').join(data_wheres),
     )
 
+    if aggregate:
+        bucket_sql = psycopg.sql.SQL(
+            "floor(extract(epoch FROM dv.timestamp - %(start_time)s) / %(bucket_seconds)s)"
+        )
+        data_withs.append(psycopg.sql.SQL("""
+        buckets AS (
+            SELECT d.device_name,
+                {bucket} AS bucket,
+                count(*) AS samples,
+                CASE WHEN count(*)=1 THEN min(dv.timestamp)
+                     ELSE %(start_time)s + avg(dv.timestamp - %(start_time)s)
+                END AS timestamp,
+                min(dv.datavalue)::float8 AS min,
+                avg(dv.datavalue)::float8 AS avg,
+                max(dv.datavalue)::float8 AS max{from_}
+            GROUP BY d.device_name, bucket
+        ),
+        aggregated AS (
+            SELECT coalesce(max(samples), 0) > %(max_points)s AS needed
+            FROM (SELECT sum(samples) AS samples FROM buckets GROUP BY device_name) AS devices
+        )
+        """).format(bucket = bucket_sql, from_ = from_sql))
+
+        # Whether any device has more than max_points samples is known from
+        # the buckets, and only if none has are the samples read (as buckets
+        # of one sample), so either way the data takes one statement.
+        select_sql = psycopg.sql.SQL("""
+    SELECT * FROM (
+        SELECT * FROM buckets
+        WHERE (SELECT needed FROM aggregated)
+        UNION ALL
+        SELECT d.device_name, {bucket}, 1, dv.timestamp,
+            dv.datavalue::float8, dv.datavalue::float8, dv.datavalue::float8{from_}
+        AND NOT (SELECT needed FROM aggregated)
+    ) AS data
+    ORDER BY device_name COLLATE "C", bucket, timestamp""").format(bucket = bucket_sql, from_ = from_sql)
+    else:
+        select_sql = psycopg.sql.SQL("""
+    SELECT dv.timestamp, dv.datavalue, d.device_name{from_}
+    ORDER BY d.device_name COLLATE "C", dv.timestamp""").format(from_ = from_sql)
+
     with_sql = (
         psycopg.sql.SQL("WITH ") + psycopg.sql.SQL(',\n').join(data_withs)
         if data_withs
         else psycopg.sql.SQL("")
     )
 
-    data_sql = psycopg.sql.SQL("""
+    return psycopg.sql.SQL("""
     {withs}
-    SELECT dv.timestamp, dv.datavalue, d.device_name
-    FROM {table} dv
-    INNER JOIN datastreams ds ON ds.datastream_id=dv.datastream_id
-    LEFT JOIN devices d ON d.device_id=ds.device_id
-    {wheres}
-    ORDER BY d.device_name, dv.timestamp
-    """)
+    {select}
+    """).format(withs = with_sql, select = select_sql)
 
-    meta_args = [category, title, volc_id]
 
+def _fetch_table(data_sql, args):
     with utils.PREEVENTSSQLCursor() as cursor:
-        metadata = get_preevents_metadata(meta_args, cursor, requested_types)
+        cursor.execute(data_sql, args)
+        return cursor.fetchall()
 
-        if metadata is None:
-            raise FileNotFoundError(f"Unable to locate metadata for {category} - {title}")
 
-        datastreams, types, units, tables, dataset_id, variable_id = metadata
-        units = [u if u != 'unitless' else '' for u in units]
-        if all(x == units[0] for x in units):
-            units = units[0]
-        else:
-            units = dict(zip(types, units))
+def _fetch_tables(tables, compile_sql, args, key):
+    """
+    Run the data query for each table, compile_sql(table), and return the
+    rows of all of them in the order of the query (device, then time).
 
-        if len(set(tables)) != 1:
-            # If this is something we want to deal with, we can re-structure the data_sql
-            # to do a UNION_ALL of selects (the section after the withs but before the ORDER BY)
-            # built off of all the tables.
-            raise ValueError("Multiple data tables found!")
-        else:
-            table = tables[0]
+    Several tables are read concurrently, each on its own connection from the
+    pool, and their rows, each already in order, merged with key (a function
+    of a row) as they are. The caller must not hold a connection meanwhile,
+    or requests waiting on the pool could take all of it between them.
+    """
+    if len(tables) == 1:
+        return _fetch_table(compile_sql(tables[0]), args)
+
+    # The queries' own spans are lost in the pool threads, so the wait for
+    # all of them is the database time of this request.
+    with timing.span('db_execute'):
+        results = list(TABLE_POOL.map(lambda table: _fetch_table(compile_sql(table), args), tables))
+
+    return list(heapq.merge(*results, key = key))
+
+
+def _sample_key(row):
+    timestamp, _, device = row
+    return (device is None, device or '', timestamp)
+
+
+def _bucket_key(row):
+    device, bucket, _, timestamp, *_ = row
+    return (device is None, device or '', bucket, timestamp)
+
+
+def _combine_buckets(buckets):
+    """Combine the buckets of a device that came from different tables into one"""
+    if buckets.empty:
+        return buckets
+
+    weights = buckets['samples']
+    offset = buckets['datetime'] - buckets['datetime'].min()
+    weighted = buckets.assign(
+        offset = offset.dt.total_seconds() * weights,
+        value = buckets['value'] * weights,
+    )
+
+    combined = weighted.groupby(['type', 'bucket'], sort = False, dropna = False).agg(
+        samples = ('samples', 'sum'),
+        offset = ('offset', 'sum'),
+        min = ('min', 'min'),
+        value = ('value', 'sum'),
+        max = ('max', 'max'),
+    ).reset_index()
+
+    combined['datetime'] = (buckets['datetime'].min()
+                            + pandas.to_timedelta(combined['offset'] / combined['samples'], unit = 's'))
+    combined['value'] = combined['value'] / combined['samples']
+    return combined[buckets.columns]
+
+
+def _fetch_aggregated(tables, compile_sql, args, max_points):
+    """
+    Run the aggregated data query for each table, and return a data frame of
+    datetime, value and type. If a trace has more than max_points samples,
+    the rows are buckets, with value the mean, and error and error2 columns
+    with the distance to the max and min (as the database plots' error bars).
+    Otherwise they are the samples themselves.
+    """
+    args = dict(args, max_points = max_points)
+    rows = _fetch_tables(tables, compile_sql, args, _bucket_key)
+    buckets = pandas.DataFrame(rows, columns = ['type', 'bucket', 'samples', 'datetime',
+                                                'min', 'value', 'max'])
+
+    samples = buckets.groupby('type', dropna = False)['samples'].sum()
+    if len(samples) == 0 or samples.max() <= max_points:
+        # Every table returned its samples.
+        return buckets[['datetime', 'value', 'type']]
 
-        args['datastream_ids'] = datastreams
+    # A table whose traces are all short returns samples rather than buckets,
+    # which combine with the buckets of the same time from other tables.
+    if len(tables) > 1:
+        buckets = _combine_buckets(buckets)
 
-        # Compose the data request SQL statement
-        t1 = time.time()
-        data_sql = data_sql.format(
-            withs=with_sql,
-            wheres=wheres_sql,
-            table = psycopg.sql.Identifier(table)
+    buckets['error'] = buckets['max'] - buckets['value']
+    buckets['error2'] = buckets['value'] - buckets['min']
+    downsample.mark_decimated(int(samples.sum()), len(buckets), 'aggregate')
+
+    return buckets[['datetime', 'value', 'type', 'error', 'error2']]
+
+
+@generator(get_preevents_labels)
+def plot_preevents_dataset(volcano, start=None, end=None):
+    """Get plot data for a specified dataset from the database"""
+
+    volc_id = utils.VOLC_IDS[volcano]
+    tag = utils.current_plot_tag.get()
+
+    category, title = tag.split("|")
+    query_string = utils.plot_args().get('addArgs', '')
+    query_args = parse_qs(query_string)
+    requested_types = query_args.get('types')
+    requested_filters = query_args.get('filters', [])
+    requested_subFeature = query_args.get('subFeature', ['__NONE__'])[0]
+    if requested_subFeature != "__NONE__":
+        volc_id = requested_subFeature
+
+    args = {
+        'volcano_id': volc_id,
+    }
+
+    if start is not None:
+        args['start_time'] = start
+    if end is not None:
+        args['end_time'] = end
+
+    filters = parse_filters(requested_filters)
+    for i, data_filter in enumerate(filters):
+        args[f"variable_id_{i}"] = data_filter.variable_id
+        args[f"value_{i}"] = data_filter.value
+
+    meta_args = [category, title, volc_id]
+
+    with utils.PREEVENTSSQLCursor() as cursor:
+        metadata = get_preevents_metadata(meta_args, cursor, requested_types)
+
+    if metadata is None:
+        raise FileNotFoundError(f"Unable to locate metadata for {category} - {title}")
+
+    datastreams, types, units, tables, dataset_id, variable_id = metadata
+    units = [u if u != 'unitless' else '' for u in units]
+    if all(x == units[0] for x in units):
+        units = units[0]
+    else:
+        units = dict(zip(types, units))
+
+    # Datastreams that aren't in a table just don't match in its query.
+    tables = sorted(set(tables))
+    args['datastream_ids'] = datastreams
+
+    filter_shapes = tuple(f.shape for f in filters)
+
+    max_points = downsample.requested_max_points()
+    if PREEVENTS_AGGREGATE and max_points is not None and start is not None and end is not None:
+        # One bucket per point the client can show, the last one ending at end
+        args['bucket_seconds'] = max((end - start).total_seconds() / (max_points - 1), 1)
+        df = _fetch_aggregated(
+            tables,
+            lambda table: compile_data_query(table, filter_shapes, True, True, aggregate = True),
+            args, max_points
         )
-        cursor.execute(data_sql, args)
-        app.logger.warning(f"Ran preevents query in {time.time() - t1}")
-        df = pandas.DataFrame(cursor, columns=['datetime', 'value', 'type'])
+    else:
+        rows = _fetch_tables(
+            tables,
+            lambda table: compile_data_query(table, filter_shapes, start is not None, end is not None),
+            args, _sample_key
+        )
+        df = pandas.DataFrame(rows, columns=['datetime', 'value', 'type'])
 
     if len(df) == 0:
         raise FileNotFoundError("Unable to find requested data")
@@ -341,14 +703,16 @@ def plot_preevents_dataset(volcano, start=None, end=None):
     # Get rid of any NaN values. There shouldn't be any at this point, but better safe (belt-and-suspenders)
     df = df.dropna(subset = ['value'])
 
-    df['datetime'] = df['datetime'].apply(lambda x: pandas.to_datetime(x).isoformat())
+    # convert Decimal values to *real* numbers
+    if len(df) > 0 and isinstance(df['value'].iloc[0], decimal.Decimal):
+        df['value'] = df['value'].astype(float)
+
+    # Thin out each trace to what the client can display, if it asked.
+    df = downsample.downsample_groups(df, 'datetime', 'value', 'type')
+
     # look for any overrides for this plot
-    with utils.PostgreSQLCursor("multiplot") as cursor:
-        cursor.execute("SELECT overrides FROM preevents WHERE dataset_id=%s and variable_id=%s",
-                       (dataset_id, variable_id))
-        overrides = cursor.fetchone()
-        if overrides is not None:
-            overrides = overrides[0]
+    _, overrides = preevents_settings().get((dataset_id, variable_id), (False, None))
+    overrides = copy.deepcopy(overrides)
 
     # Set a log Y Axis for the specified plot types if value exceeds threshold
     log_types = {'HotLINK Radiative Power'}
@@ -367,10 +731,6 @@ def plot_preevents_dataset(volcano, start=None, end=None):
         'plotOverrides': overrides,
     }
 
-    # convert Decimal values to *real* numbers
-    if len(df) > 0 and isinstance(df['value'].iloc[0], decimal.Decimal):
-        df['value'] = df['value'].astype(float)
-
     valid_types = [t for t in types if t is not None] if types else []
 
     if valid_types:
@@ -379,12 +739,12 @@ def plot_preevents_dataset(volcano, start=None, end=None):
         for record_type in types:
             lookup_type = 'None' if record_type is None else record_type
             try:
-                result[lookup_type] = type_df.get_group(lookup_type).to_dict(orient='list')
+                result[lookup_type] = serialization.frame_to_dict(type_df.get_group(lookup_type))
             except KeyError:
                 if type(units) == dict and record_type in units:
                     del units[record_type]
     else:
-        result[title] = df.to_dict(orient='list')
+        result[title] = serialization.frame_to_dict(df)
 
 
     return result
@@ -0,0 +1,91 @@
+"""
+A least recently used cache bounded by the combined size of its values,
+rather than by their number, for the in-process caches (see cache and
+filecache).
+"""
+
+import threading
+
+from collections import OrderedDict
+
+
+class SizedLRU:
+    """
+    Thread-safe LRU mapping, bounded by the combined size of its values.
+
+    ARGUMENTS
+    ---------
+        max_bytes: The maximum combined size of all values.
+        sizeof: Function returning the size, in bytes, of a value.
+    """
+
+    def __init__(self, max_bytes, sizeof = len):
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof
+        self._entries = OrderedDict()  # key: (value, size)
+        self._size = 0
+        self._lock = threading.Lock()
+
+        self.evictions = 0
+
+    def get(self, key, valid = None):
+        """
+        Return the value for key, now the most recently used, or None if it is
+        missing. A value for which valid(value) is false is dropped, and None
+        returned.
+        """
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+
+            value = item[0]
+            if valid is not None and not valid(value):
+                self._remove(key)
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value) -> bool:
+        """
+        Store value, evicting the least recently used values to make room.
+        Returns False, without storing it, if value is larger than the whole
+        cache.
+        """
+        size = self._sizeof(value)
+        if size > self.max_bytes:
+            return False
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = (value, size)
+            self._size += size
+
+            while self._size > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._size,
+                'max_bytes': self.max_bytes,
+                'evictions': self.evictions,
+            }
+
+    def _remove(self, key):
+        # Caller must hold the lock
+        _, size = self._entries.pop(key)
+        self._size -= size
@@ -1,14 +1,18 @@
+import contextvars
 import glob
 import json
 import os
 import pathlib
+import time
 
 import flask
 
-from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dateutil.parser import parse
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import HTTPException
 
-from . import app, utils, generator, descriptors
+from . import app, config, utils, generator, descriptors, cache, columnar, downsample, filecache, singleflight, timing
 
 
 @app.route('/')
@@ -52,13 +56,18 @@ def api():
 
 @app.route('/headers')
 def headers():
+    # Plot types added (or removed) since start up, such as new preevents
+    # datasets, are picked up in the background.
+    generator.start_label_refresher()
+    js_funcs, categories = generator.registered_labels()
+
     args = {
         'prefix': getPrefix(),
-        'js_funcs': json.dumps(generator.JS_FUNCS)
+        'js_funcs': json.dumps(js_funcs)
     }
 
     plottypes = []
-    for cat, types in sorted(generator.GEN_CATEGORIES.items(), key = lambda x: x[0]):
+    for cat, types in sorted(categories.items(), key = lambda x: x[0]):
         plottypes.append(f"---{cat}---")
         for item in sorted(types):
             tag = "|".join((cat, item))
@@ -87,14 +96,73 @@ def body():
 
 @app.route('/getPlot')
 def get_plot():
-    plot_type = flask.request.args['plotType']
+    return render_plot(flask.request.args)
+
+
+def render_plot(args) -> flask.Response:
+    """
+    Generate, or retrieve from the result cache, the plot described by args
+    (a mapping of /getPlot request arguments) and return it as a response.
+    """
+    t_start = time.perf_counter()
+    spans = timing.start()
+    downsample.start()
+    utils.current_plot_args.set(args)
+
+    plot_type = args['plotType']
+    response_format = columnar.requested_format(args)
+
+    cache_key = cache.plot_key(args) + (response_format, )
+    with timing.span('cache'):
+        cached = cache.RESULTS.get(cache_key)
+
+    if cached is not None:
+        response = flask.Response(cached.body, mimetype = cached.mimetype,
+                                  headers = cached.headers)
+        response.headers['X-Cache'] = 'HIT'
+        response.vary.add('Accept')
+        _record_timing(response, plot_type, spans, t_start)
+        return response
+
+    # Identical requests that arrive while this one is being generated wait
+    # for, and share, its result rather than all querying the database.
+    (body, status, mimetype, extra_headers), shared = singleflight.do(
+        cache_key,
+        lambda: _generate(args, plot_type, response_format)
+    )
+
+    response = flask.Response(body, status = status, mimetype = mimetype,
+                              headers = extra_headers)
+
+    if status == 200:
+        cache.RESULTS.set(
+            cache_key,
+            body,
+            mimetype,
+            generator.GEN_CACHE_TTLS.get(plot_type),
+            extra_headers
+        )
+    response.headers['X-Cache'] = 'SHARED' if shared else 'MISS'
+    response.vary.add('Accept')
+    _record_timing(response, plot_type, spans, t_start)
+
+    return response
 
+
+def _generate(args, plot_type, response_format) -> tuple:
+    """
+    Run the generator for a plot and serialize its result.
+
+    RETURNS
+    -------
+        tuple: (body, status code, mimetype, headers to send with the body)
+    """
     # Make the plot type "tag" available to any function that wants it.
     utils.current_plot_tag.set(plot_type)
 
-    volcano = flask.request.args['volcano']
-    start_date = flask.request.args.get('dateFrom')
-    end_date = flask.request.args.get('dateTo')
+    volcano = args['volcano']
+    start_date = args.get('dateFrom')
+    end_date = args.get('dateTo')
 
     if start_date:
         start_date = parse(start_date)
@@ -108,33 +176,191 @@ def get_plot():
         end_date = None
 
     try:
-        data = generator.GEN_FUNCS[plot_type](volcano, start_date, end_date)
+        with timing.span('generate'):
+            data = generator.GEN_FUNCS[plot_type](volcano, start_date, end_date)
+    except HTTPException:
+        # Bad request arguments (flask.abort) keep their own status
+        raise
+    except Exception as e:
+        return _error_result(e)
+
+    try:
+        with timing.span('serialize'):
+            if response_format == columnar.MIMETYPE and not isinstance(data, str):
+                response = flask.Response(columnar.encode(data), mimetype = columnar.MIMETYPE)
+            else:
+                # Pre-encoded (string) results are passed through as-is
+                response = flask.make_response(data)
     except Exception as e:
-        app.logger.warning(str(e))
-        return str(e), 404
+        return _error_result(e)
+
+    extra_headers = {}
+    decimated = downsample.decimated_header()
+    if decimated is not None:
+        extra_headers['X-Decimated'] = decimated
+
+    return response.get_data(), response.status_code, response.mimetype, extra_headers
+
 
-    return data
+def _error_result(e) -> tuple:
+    """The _generate result for a plot that could not be generated or serialized"""
+    app.logger.warning(str(e))
+    response = flask.make_response((str(e), 404))
+    return response.get_data(), response.status_code, response.mimetype, {}
+
+
+def _record_timing(response, tag, spans, t_start):
+    """Add the Server-Timing header to response, and record spans for /metrics"""
+    # Whatever the generator spent outside the database was spent
+    # transforming the data (pandas, etc).
+    if 'generate' in spans:
+        db_time = sum(spans.get(name, 0) for name in timing.DB_SPANS)
+        spans['transform'] = max(spans.pop('generate') - db_time, 0)
+
+    spans['total'] = time.perf_counter() - t_start
+    response.headers['Server-Timing'] = timing.server_timing(spans)
+    timing.record(tag, spans)
+
+
+# Shared by all batch requests in this worker, so the number of generators
+# running concurrently (and thus database connections) stays bounded.
+BATCH_POOL = ThreadPoolExecutor(
+    max_workers = getattr(config, 'BATCH_WORKERS', 8),
+    thread_name_prefix = 'getPlots'
+)
+
+
+def _batch_plot(render, args):
+    # render runs on a copy of the batch's request context, which would reuse
+    # the batch request's app context, and with it flask.g, so each plot gets
+    # a fresh app context first.
+    with app.app_context():
+        return render(args)
+
+
+@app.route('/getPlots', methods = ["POST"])
+def get_plots():
+    """
+    Generate multiple plots concurrently.
+
+    Expects a JSON body of the form {"plots": [spec, ...]}, where each spec is
+    an object with the same arguments as /getPlot. Results are streamed back
+    as newline-delimited JSON, one line per plot in the order they complete:
+    {"index": <position in plots>, "status": <http status>, "data": ...} on
+    success, or with an "error" message in place of "data" on failure. Plots
+    that were downsampled also carry the X-Decimated header as "decimated".
+    """
+    try:
+        specs = flask.request.json['plots']
+        # Batch results are always JSON, whatever format was requested.
+        specs = [
+            MultiDict({
+                **{key: str(value) for key, value in spec.items() if value is not None},
+                'format': 'json',
+            })
+            for spec in specs
+        ]
+    except (KeyError, TypeError, AttributeError):
+        flask.abort(400, 'Expected a JSON object with a list of plots')
+
+    # Each plot runs on (a copy of) this request, with its own arguments,
+    # which generators read through utils.plot_args().
+    futures = {
+        BATCH_POOL.submit(contextvars.copy_context().run, _batch_plot,
+                          flask.copy_current_request_context(render_plot), spec): idx
+        for idx, spec in enumerate(specs)
+    }
+
+    def results():
+        for future in as_completed(futures):
+            idx = futures[future]
+            header = {'index': idx, 'plotType': specs[idx].get('plotType')}
+            try:
+                response = future.result()
+            except HTTPException as e:
+                header.update({'status': e.code, 'error': e.description})
+                yield json.dumps(header) + '\n'
+                continue
+            except Exception as e:
+                app.logger.warning(str(e))
+                header.update({'status': 500, 'error': str(e)})
+                yield json.dumps(header) + '\n'
+                continue
+
+            header['status'] = response.status_code
+            if 'X-Decimated' in response.headers:
+                header['decimated'] = response.headers['X-Decimated']
+            body = response.get_data(as_text = True)
+            if response.status_code != 200:
+                header['error'] = body
+                yield json.dumps(header) + '\n'
+                continue
+
+            if not response.is_json:
+                # Some generators (e.g. color_code) return pre-encoded JSON as text
+                try:
+                    json.loads(body)
+                except ValueError:
+                    body = json.dumps(body)
+
+            # Splice the already-serialized body in, rather than decoding
+            # and re-encoding it. Flask ends JSON bodies with a newline, which
+            # would split the line.
+            yield json.dumps(header)[:-1] + ', "data": ' + body.rstrip() + '}\n'
+
+    return flask.Response(results(), mimetype = 'application/x-ndjson')
+
+
+@app.route('/cacheStats')
+def cache_stats():
+    return flask.jsonify(cache.RESULTS.stats())
+
+
+@app.route('/metrics')
+def metrics():
+    stats = cache.RESULTS.stats()
+    counters = {
+        'multiplot_result_cache_hits_total': ('Result cache hits in this worker.', stats['hits']),
+        'multiplot_result_cache_shared_hits_total': (
+            'Result cache hits in this worker served from the cache shared between workers.',
+            stats['shared_hits']
+        ),
+        'multiplot_result_cache_misses_total': ('Result cache misses in this worker.', stats['misses']),
+        'multiplot_result_cache_evictions_total': ('Result cache evictions in this worker.', stats['evictions']),
+    }
+    file_stats = filecache.FILES.stats()
+    counters.update({
+        'multiplot_file_cache_hits_total': ('Parsed data file cache hits in this worker.', file_stats['hits']),
+        'multiplot_file_cache_misses_total': ('Parsed data file cache misses in this worker.', file_stats['misses']),
+    })
+    return flask.Response(timing.prometheus_text(counters), mimetype = 'text/plain; version=0.0.4')
+
+
+def _descriptions_response(snapshot, body) -> flask.Response:
+    # Clients revalidate with the ETag, and get a 304 while the descriptions are unchanged.
+    response = flask.Response(body, mimetype = 'application/json')
+    response.set_etag(snapshot.etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(flask.request)
 
 
 @app.route('/getDetails')
 def get_details():
     plot_type = flask.request.args['plotType']
     cat, label = plot_type.split('|')
-    details = descriptors.get_descriptions()
+    snapshot = descriptors.DESCRIPTIONS.get()
+
+    try:
+        description = snapshot.descriptions[cat][label]
+    except KeyError:
+        flask.abort(404)
 
-    description = details.loc[cat, label]
-    return flask.jsonify(description)
+    return _descriptions_response(snapshot, app.json.dumps(description))
 
 @app.route('/getDescriptions')
 def get_descriptions():
-    data = descriptors.get_descriptions()
-    data['Category'] = data['Category'].apply(lambda x: '' if not x else x)
-    data['Dataset'] = data['Dataset'].apply(lambda x: '' if not x else x)
-    data = data[['Category', 'Dataset', 'Description']].reset_index(drop = True)
-    return_obj = defaultdict(dict)
-    for idx, row in data.iterrows():
-        return_obj[row['Category']][row['Dataset']] = row['Description']
-    return return_obj
+    snapshot = descriptors.DESCRIPTIONS.get()
+    return _descriptions_response(snapshot, snapshot.body)
 
 
 @app.route('/list-js/<subdir>')
@@ -1,10 +1,11 @@
 import io
+import time
 
 import flask
 import plotly.graph_objects as go
 import pymupdf
 
-from . import app
+from . import app, timing
 
 def clean_layout(layout, mode):
     if mode == 'dark':
@@ -13,6 +14,9 @@ def clean_layout(layout, mode):
 
 @app.route('/generatePDF', methods=["POST"])
 def generate_pdf():
+    t_start = time.perf_counter()
+    spans = timing.start()
+
     data = flask.request.json
     plots = data['plots']
     mode = data['mode']
@@ -27,9 +31,10 @@ def generate_pdf():
     for plotDict in plots:
         clean_layout(plotDict['layout'], mode)
         
-        plot = go.Figure(plotDict)
-    
-        img_bytes = plot.to_image(format='pdf')
+        with timing.span('render'):
+            plot = go.Figure(plotDict)
+
+            img_bytes = plot.to_image(format='pdf')
         pdf = pymupdf.open("pdf", img_bytes)
         total_height += pdf[0].rect.height
         pdf_buffers.append(pdf)
@@ -52,22 +57,30 @@ def generate_pdf():
         output_page.draw_rect(rect, color=None, fill=bg_color)
     
     y_offset = 0
-    for plot in pdf_buffers:
-        page = plot[0]
-        page_height = page.rect.height
-        
-        target_rect = pymupdf.Rect(left, y_offset, left + width, y_offset + page_height)
-        output_page.show_pdf_page(target_rect, plot, 0)
-        y_offset += page_height
-    
-    output_buffer = io.BytesIO()
-    output.save(output_buffer, garbage=4, deflate=True)
-    output.close()
-    output_buffer.seek(0)
+    with timing.span('compose'):
+        for plot in pdf_buffers:
+            page = plot[0]
+            page_height = page.rect.height
+
+            target_rect = pymupdf.Rect(left, y_offset, left + width, y_offset + page_height)
+            output_page.show_pdf_page(target_rect, plot, 0)
+            y_offset += page_height
+
+    with timing.span('serialize'):
+        output_buffer = io.BytesIO()
+        output.save(output_buffer, garbage=4, deflate=True)
+        output.close()
+        output_buffer.seek(0)
     
-    return flask.send_file(
+    response = flask.send_file(
         output_buffer,
         mimetype="application/pdf",
         as_attachment=True,
         download_name="plots.pdf"
-    )
\ No newline at end of file
+    )
+
+    spans['total'] = time.perf_counter() - t_start
+    response.headers['Server-Timing'] = timing.server_timing(spans)
+    timing.record('generatePDF', spans)
+
+    return response
\ No newline at end of file
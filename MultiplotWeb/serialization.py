@@ -0,0 +1,177 @@
+"""
+Shared serialization of generator results.
+
+Generators hand their DataFrames to frame_to_dict() in place of
+DataFrame.to_dict(orient='list'). Timestamp columns are formatted to ISO
+strings in one vectorized pass, numeric columns are passed through as NumPy
+arrays, and Decimal columns are converted to floats. JSONProvider, installed
+on the app by create_app(), then writes those arrays straight from their
+buffers using orjson, when it is available.
+"""
+
+import datetime
+import decimal
+
+import numpy
+import pandas
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class DateColumn(list):
+    """
+    A list of ISO date strings that also carries the same timestamps as
+    wall-clock epoch milliseconds (epoch_ms), for encoders that want numbers.
+    Serializes to JSON as a plain list.
+    """
+
+    def __init__(self, strings, epoch_ms):
+        super().__init__(strings)
+        self.epoch_ms = epoch_ms
+
+
+def _offset_string(offset_ns):
+    minutes = int(offset_ns // 60_000_000_000)
+    sign = '-' if minutes < 0 else '+'
+    hours, minutes = divmod(abs(minutes), 60)
+    return f"{sign}{hours:02d}:{minutes:02d}"
+
+
+def iso_format(values) -> DateColumn:
+    """
+    Format timestamps as ISO 8601 strings, vectorized.
+
+    The output matches pandas.Timestamp.isoformat() value for value:
+    fractional seconds are only included where non-zero, and timezone-aware
+    values keep their wall-clock time with their UTC offset appended.
+
+    ARGUMENTS
+    ---------
+        values: A Series, Index, array or list of timestamps
+
+    RETURNS
+    -------
+        DateColumn: The formatted strings
+    """
+    series = pandas.Series(values, copy = False)
+    if not pandas.api.types.is_datetime64_any_dtype(series):
+        try:
+            series = pandas.to_datetime(series)
+        except (TypeError, ValueError):
+            # Mixed timezones, or something pandas can't parse in bulk.
+            strings = [pandas.to_datetime(x).isoformat() for x in series]
+            return DateColumn(strings, None)
+
+    suffix = None
+    if series.dt.tz is not None:
+        wall = series.dt.tz_localize(None)
+        offsets = (
+            wall.to_numpy('datetime64[ns]').astype('int64')
+            - series.dt.tz_convert(None).to_numpy('datetime64[ns]').astype('int64')
+        )
+        # Only a handful of distinct offsets (DST), so format each once.
+        unique, inverse = numpy.unique(offsets, return_inverse = True)
+        suffix = numpy.array([_offset_string(x) for x in unique])[inverse]
+    else:
+        wall = series
+
+    wall = wall.to_numpy('datetime64[ns]')
+    strings = numpy.datetime_as_string(wall, unit = 's')
+
+    fractional = wall.astype('int64') % 1_000_000_000 != 0
+    fractional &= ~numpy.isnat(wall)
+    if fractional.any():
+        strings = numpy.where(
+            fractional,
+            numpy.datetime_as_string(wall, unit = 'us'),
+            strings
+        )
+
+    if suffix is not None:
+        strings = numpy.char.add(strings, numpy.where(numpy.isnat(wall), '', suffix))
+
+    return DateColumn(strings.tolist(), wall.astype('datetime64[ms]').astype('int64'))
+
+
+def frame_to_dict(df: pandas.DataFrame) -> dict:
+    """
+    Vectorized replacement for df.to_dict(orient='list').
+
+    Datetime columns (including object columns holding datetimes) become
+    lists of ISO strings (see iso_format), numeric and
+    bool columns become NumPy arrays, Decimal columns become float arrays and
+    anything else becomes a plain list.
+    """
+    result = {}
+    for column in df.columns:
+        series = df[column]
+        if pandas.api.types.is_datetime64_any_dtype(series):
+            result[column] = iso_format(series)
+        elif pandas.api.types.is_bool_dtype(series) or pandas.api.types.is_numeric_dtype(series):
+            if pandas.api.types.is_extension_array_dtype(series):
+                values = series.to_numpy(dtype = float, na_value = numpy.nan)
+            else:
+                values = series.to_numpy()
+            result[column] = numpy.ascontiguousarray(values)
+        else:
+            first = series.first_valid_index()
+            first = None if first is None else series[first]
+            if isinstance(first, decimal.Decimal):
+                result[column] = series.to_numpy(dtype = float, na_value = numpy.nan)
+            elif isinstance(first, datetime.datetime):
+                # e.g. timestamps with mixed timezones, or concatenated with empty frames
+                result[column] = iso_format(series)
+            else:
+                result[column] = series.tolist()
+
+    return result
+
+
+def _default(o):
+    """Handle the types that neither orjson nor json know about"""
+    if isinstance(o, numpy.ndarray):
+        return o.tolist()
+    if isinstance(o, numpy.generic):
+        return o.item()
+    if isinstance(o, decimal.Decimal):
+        return float(o)
+
+    return DefaultJSONProvider.default(o)
+
+
+class JSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider that encodes with orjson (writing NumPy arrays
+    directly from their buffers) when it is installed, and understands
+    NumPy/Decimal values either way.
+    """
+
+    default = staticmethod(_default)
+
+    def _orjson_options(self):
+        # Datetimes are passed through to the default handler, so they are
+        # formatted the same way Flask always has.
+        options = (orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+                   | orjson.OPT_PASSTHROUGH_DATETIME)
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        return options
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+
+        return orjson.dumps(obj, default = _default, option = self._orjson_options()).decode()
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default = _default, option = self._orjson_options())
+        return self._app.response_class(body + b"\n", mimetype = self.mimetype)
@@ -0,0 +1,303 @@
+"""
+A cache shared by all the worker processes on a host.
+
+Each gunicorn worker is a separate process, so an ordinary in-memory cache
+is filled (and held in memory) once per worker. SharedCache keeps its entries
+in a SQLite database instead, by default under /run/multiplot, so a value
+computed by any worker is available to all of them.
+
+SharedCache is a MutableMapping, so it can be handed to cachetools as the
+cache of a @cached decorator. shared_ttl_cache() is a drop-in replacement
+for cachetools.func.ttl_cache built on it:
+
+    @shared_cache.shared_ttl_cache(ttl = 86400)
+    def expensive_query():
+        ...
+
+Values are pickled, every entry has an expiry time, and the total size of
+all entries is capped at SHARED_CACHE_MAX_BYTES, with the least recently
+used evicted first. If SHARED_CACHE_PATH is set to None in the config, or
+the database can't be opened, each process falls back to a private
+in-memory cache with the same TTL.
+"""
+
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from collections.abc import MutableMapping
+
+from cachetools import TTLCache, cached
+from cachetools.keys import hashkey
+
+from . import app, config
+
+SHARED_CACHE_PATH = getattr(config, 'SHARED_CACHE_PATH', '/run/multiplot/cache.sqlite')
+SHARED_CACHE_MAX_BYTES = getattr(config, 'SHARED_CACHE_MAX_BYTES', 512 * 1024 * 1024)
+
+# Size of the per-process cache used when there is no shared database
+FALLBACK_MAXSIZE = 256
+
+# Reads only refresh an entry's last-used time when it is this stale, so hot
+# entries don't turn every read into a write.
+_TOUCH_AFTER = 60  # seconds
+_EVICT_INTERVAL = 10  # seconds
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    expires REAL NOT NULL,
+    accessed REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed);
+CREATE INDEX IF NOT EXISTS entries_expires ON entries (expires);
+"""
+
+
+class _Store():
+    """The SQLite database behind every SharedCache using the same path"""
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._last_evict = 0
+
+        # Fail now, rather than on first use, if the database can't be created.
+        self._connection()
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread, and a fresh one after a fork.
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok = True)
+        conn = sqlite3.connect(self.path, timeout = 5, isolation_level = None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript(_SCHEMA)
+
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def get(self, namespace, key):
+        """Return (value, expires), or None if missing or expired"""
+        conn = self._connection()
+        row = conn.execute(
+            'SELECT value, expires, accessed FROM entries WHERE namespace=? AND key=?',
+            (namespace, key)
+        ).fetchone()
+        if row is None:
+            return None
+
+        value, expires, accessed = row
+        now = time.time()
+        if expires <= now:
+            conn.execute('DELETE FROM entries WHERE namespace=? AND key=? AND expires<=?',
+                         (namespace, key, now))
+            return None
+
+        if now - accessed > _TOUCH_AFTER:
+            conn.execute('UPDATE entries SET accessed=? WHERE namespace=? AND key=?',
+                         (now, namespace, key))
+
+        return pickle.loads(value), expires
+
+    def set(self, namespace, key, value, ttl):
+        data = pickle.dumps(value, protocol = pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.max_bytes:
+            raise ValueError('value too large')
+
+        now = time.time()
+        self._connection().execute(
+            'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)',
+            (namespace, key, data, len(data), now + ttl, now)
+        )
+
+        if time.monotonic() - self._last_evict > _EVICT_INTERVAL:
+            self._last_evict = time.monotonic()
+            self.evict()
+
+    def delete(self, namespace, key) -> bool:
+        cursor = self._connection().execute(
+            'DELETE FROM entries WHERE namespace=? AND key=?', (namespace, key)
+        )
+        return cursor.rowcount > 0
+
+    def clear(self, namespace):
+        self._connection().execute('DELETE FROM entries WHERE namespace=?', (namespace, ))
+
+    def keys(self, namespace):
+        rows = self._connection().execute(
+            'SELECT key FROM entries WHERE namespace=? AND expires>?', (namespace, time.time())
+        )
+        return [row[0] for row in rows]
+
+    def evict(self):
+        """Drop expired entries, then least recently used ones until under max_bytes"""
+        conn = self._connection()
+        conn.execute('DELETE FROM entries WHERE expires<=?', (time.time(), ))
+
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        excess = total - self.max_bytes
+        victims = []
+        for namespace, key, size in conn.execute(
+            'SELECT namespace, key, size FROM entries ORDER BY accessed'
+        ):
+            victims.append((namespace, key))
+            excess -= size
+            if excess <= 0:
+                break
+
+        conn.executemany('DELETE FROM entries WHERE namespace=? AND key=?', victims)
+
+    def stats(self) -> dict:
+        entries, size = self._connection().execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries'
+        ).fetchone()
+        return {'entries': entries, 'bytes': size, 'max_bytes': self.max_bytes}
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def _get_store(path):
+    """The shared store at path, or None if there isn't one"""
+    if not path:
+        return None
+
+    with _stores_lock:
+        if path not in _stores:
+            try:
+                _stores[path] = _Store(path, SHARED_CACHE_MAX_BYTES)
+            except (OSError, sqlite3.Error) as e:
+                app.logger.warning(f"Shared cache unavailable at {path}, using per-process caches: {e}")
+                _stores[path] = None
+        return _stores[path]
+
+
+class SharedCache(MutableMapping):
+    """
+    A mapping whose entries are shared by every process using the same path.
+
+    Keys may be anything with a stable repr() (such as the tuples built by
+    cachetools.keys.hashkey); iterating yields those repr strings.
+
+    ARGUMENTS
+    ---------
+        namespace: Keeps the entries of different caches in the same database apart
+        ttl: Lifetime of an entry, in seconds
+        path: The SQLite database file. Defaults to SHARED_CACHE_PATH
+    """
+
+    def __init__(self, namespace, ttl, path = None):
+        self.namespace = namespace
+        self.ttl = ttl
+        self._store = _get_store(SHARED_CACHE_PATH if path is None else path)
+        self._fallback = TTLCache(maxsize = FALLBACK_MAXSIZE, ttl = ttl) if self._store is None else None
+        self._fallback_lock = threading.Lock()
+
+    @property
+    def shared(self) -> bool:
+        return self._store is not None
+
+    def get_entry(self, key):
+        """Return (value, expiry as a time.time() value), or None if missing"""
+        if self._store is None:
+            with self._fallback_lock:
+                value = self._fallback.get(key, self)
+            if value is self:
+                return None
+            return value, time.time() + self.ttl
+
+        try:
+            return self._store.get(self.namespace, repr(key))
+        except (sqlite3.Error, pickle.UnpicklingError, EOFError) as e:
+            app.logger.warning(f"Shared cache read failed: {e}")
+            return None
+
+    def put(self, key, value, ttl = None):
+        """Store value under key, for ttl seconds rather than the default if given"""
+        if self._store is None:
+            with self._fallback_lock:
+                self._fallback[key] = value
+            return
+
+        try:
+            self._store.set(self.namespace, repr(key), value, self.ttl if ttl is None else ttl)
+        except ValueError:
+            pass  # Larger than the whole cache
+        except (sqlite3.Error, pickle.PicklingError, TypeError, AttributeError) as e:
+            # Not fatal: the value just isn't cached.
+            app.logger.warning(f"Shared cache write failed: {e}")
+
+    def __getitem__(self, key):
+        entry = self.get_entry(key)
+        if entry is None:
+            raise KeyError(key)
+        return entry[0]
+
+    def __setitem__(self, key, value):
+        self.put(key, value)
+
+    def __delitem__(self, key):
+        if self._store is None:
+            with self._fallback_lock:
+                del self._fallback[key]
+        elif not self._store.delete(self.namespace, repr(key)):
+            raise KeyError(key)
+
+    def __iter__(self):
+        if self._store is None:
+            with self._fallback_lock:
+                return iter(list(self._fallback))
+        return iter(self._store.keys(self.namespace))
+
+    def __len__(self):
+        if self._store is None:
+            with self._fallback_lock:
+                return len(self._fallback)
+        return len(self._store.keys(self.namespace))
+
+    def clear(self):
+        if self._store is None:
+            with self._fallback_lock:
+                self._fallback.clear()
+        else:
+            self._store.clear(self.namespace)
+
+
+def shared_ttl_cache(ttl = 600, namespace = None, key = hashkey):
+    """
+    Decorator to cache a function's results in a SharedCache, like
+    cachetools.func.ttl_cache but shared by all worker processes. The cache
+    is exposed as func.cache, and can be emptied with func.cache_clear().
+
+    ARGUMENTS
+    ---------
+        ttl: Lifetime of a cached result, in seconds
+        namespace: Name of the cache. Defaults to the function's module and name
+        key: Function building the cache key from the call's arguments, as
+            for cachetools.cached. Defaults to all of the arguments
+    """
+    def decorator(func):
+        name = namespace or f"{func.__module__}.{func.__qualname__}"
+        cache = SharedCache(name, ttl)
+        wrapper = cached(cache = cache, key = key)(func)
+        wrapper.cache = cache
+        wrapper.cache_clear = cache.clear
+        return wrapper
+
+    return decorator
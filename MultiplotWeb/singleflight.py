@@ -0,0 +1,220 @@
+"""
+Coalescing of identical, concurrent plot requests.
+
+When many users open the same plot at once (say, at the start of an
+eruption), every request misses the result cache at the same moment, and
+without coordination each would run the same generator and the same database
+query. Instead, the first request for a key becomes the "leader" and runs the
+work; identical requests that arrive while it is running wait for it and
+share its result.
+
+Within a worker process this is done with an Event per in-flight key. If
+SINGLEFLIGHT_DIR is set in the config (for example /run/multiplot), the
+leader of each process also takes an exclusive lock on a file named after the
+key in that directory, so only one worker runs the work. The winner writes
+its result next to the lock file, and the other workers read it from there
+once the lock is released.
+
+Waiters give up on a leader after SINGLEFLIGHT_TIMEOUT seconds, so a stuck
+leader can only delay requests, never fail them. The first waiter to give up
+takes over as leader, running the work itself, and the rest wait for it in
+turn rather than each running the work.
+"""
+
+import hashlib
+import os
+import pickle
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows
+    fcntl = None
+
+from . import config, timing
+
+SINGLEFLIGHT = getattr(config, 'SINGLEFLIGHT', True)
+SINGLEFLIGHT_DIR = getattr(config, 'SINGLEFLIGHT_DIR', None)
+SINGLEFLIGHT_TIMEOUT = getattr(config, 'SINGLEFLIGHT_TIMEOUT', 60)  # seconds
+
+# Lock files are reused by later requests for the same key, and result files
+# are only needed until every waiting worker has read them.
+RESULT_MAX_AGE = 60  # seconds
+LOCK_MAX_AGE = 3600  # seconds
+_LOCK_POLL = 0.05  # seconds
+
+
+class _Call():
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class Group():
+    """
+    A set of in-flight calls, keyed on anything hashable.
+
+    ARGUMENTS
+    ---------
+        lock_dir: Directory for cross-process lock and result files, or None
+                  to coalesce within this process only.
+        timeout: Seconds to wait for another caller's result before giving up
+                 and running the function directly.
+    """
+
+    def __init__(self, lock_dir = None, timeout = SINGLEFLIGHT_TIMEOUT):
+        self.lock_dir = lock_dir if fcntl is not None else None
+        self.timeout = timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._last_purge = 0
+
+    def do(self, key, func):
+        """
+        Run func(), unless an identical call (same key) is already running,
+        in which case wait for that call and return its result instead.
+
+        RETURNS
+        -------
+            tuple: (result, shared), where shared is True if the result came
+                   from another caller. If the call raised, every waiter
+                   raises the same exception.
+        """
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                if call is None:
+                    call = self._calls[key] = _Call()
+                    break
+
+            with timing.span('coalesce'):
+                finished = call.done.wait(self.timeout)
+            if finished:
+                if call.error is not None:
+                    raise call.error
+                return call.result, True
+
+            # The leader is stuck. Replace its call, so the first waiter to
+            # get here leads a new one, which the others then wait for.
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+
+        try:
+            if self.lock_dir is None:
+                call.result, shared = func(), False
+            else:
+                call.result, shared = self._do_locked(key, func)
+            return call.result, shared
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                # A leader that took too long has already been replaced.
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call.done.set()
+
+    def _paths(self, key):
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        base = os.path.join(self.lock_dir, digest)
+        return f"{base}.lock", f"{base}.result"
+
+    def _do_locked(self, key, func):
+        """Run func() in at most one process at a time, sharing the result"""
+        os.makedirs(self.lock_dir, exist_ok = True)
+        lock_path, result_path = self._paths(key)
+
+        with open(lock_path, 'a') as lock_file:
+            wait_start = time.time()
+            waited = not self._acquire(lock_file, wait = False)
+            if waited:
+                with timing.span('coalesce'):
+                    acquired = self._acquire(lock_file, wait = True)
+                if not acquired:
+                    # Whoever holds the lock is taking too long.
+                    return func(), False
+
+            # Mark the lock file as in use, so _purge leaves it alone.
+            os.utime(lock_path)
+            try:
+                if waited:
+                    result = self._read_result(result_path, wait_start)
+                    if result is not None:
+                        return result, True
+                    # The other worker failed, so try for ourselves.
+
+                result = func()
+                self._write_result(result_path, result)
+                return result, False
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                self._purge()
+
+    def _acquire(self, lock_file, wait):
+        deadline = time.monotonic() + (self.timeout if wait else 0)
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    return False
+                time.sleep(_LOCK_POLL)
+
+    @staticmethod
+    def _read_result(path, newer_than):
+        try:
+            if os.path.getmtime(path) < newer_than:
+                return None  # Left over from an earlier call
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+
+    @staticmethod
+    def _write_result(path, result):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(result, f, protocol = pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except (OSError, pickle.PicklingError):
+            # Waiting workers will simply run the call themselves.
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+
+    def _purge(self):
+        """Remove old result and lock files, at most once a minute"""
+        now = time.time()
+        if now - self._last_purge < RESULT_MAX_AGE:
+            return
+        self._last_purge = now
+
+        try:
+            entries = list(os.scandir(self.lock_dir))
+        except OSError:
+            return
+
+        for entry in entries:
+            max_age = LOCK_MAX_AGE if entry.name.endswith('.lock') else RESULT_MAX_AGE
+            try:
+                if now - entry.stat().st_mtime > max_age:
+                    os.unlink(entry.path)
+            except OSError:
+                pass
+
+
+PLOTS = Group(lock_dir = SINGLEFLIGHT_DIR)
+
+
+def do(key, func):
+    """Run func() once for all concurrent callers with the same key (see Group.do)"""
+    if not SINGLEFLIGHT:
+        return func(), False
+    return PLOTS.do(key, func)
@@ -96,7 +96,7 @@ export async function genPlot(){
     args['_'] = new Date().getTime(); // Add a unique timestamp to the args object
 
     const plotGenerated=new Promise((resolve,reject)=>{
-        $.getJSON(prefix+'getPlot',args).then(async function(data){
+        fetchPlot(args).then(async function(data){
             Plotly.purge(plotElement)
 
             placeholder.remove();
@@ -123,7 +123,7 @@ export async function genPlot(){
 
             plotElement.removeListener('plotly_relayout',plotRangeChanged)
             plotElement.on('plotly_relayout',plotRangeChanged);
-        }).fail(function(e){
+        },function(e){
             if(e.status==404){
                 Plotly.purge(plotDiv);
                 $(plotDiv).empty();
@@ -139,7 +139,7 @@ export async function genPlot(){
                 }
                 reject();
             }
-        }).always(function(){
+        }).finally(function(){
             clearDateAxis(true);
         })
     })
@@ -0,0 +1,180 @@
+"""
+Per-request timing spans and aggregated latency histograms.
+
+Code that does measurable work wraps it in span(name). The durations
+recorded while handling a request are reported back in its Server-Timing
+header, and folded into per-plot-tag histograms that the /metrics endpoint
+serves in Prometheus text format.
+
+The database cursors in utils record the db_connect, db_execute and db_fetch
+spans automatically, so generators need no changes to be measured.
+
+Histograms are kept per worker process. If METRICS_DIR is set in the config,
+each worker also writes a snapshot of its histograms there (at most every
+METRICS_FLUSH_INTERVAL seconds), and /metrics reports the sum over all
+workers, whichever one happens to answer the scrape.
+"""
+
+import json
+import os
+import threading
+import time
+
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from . import config
+
+METRICS_DIR = getattr(config, 'METRICS_DIR', None)
+METRICS_FLUSH_INTERVAL = getattr(config, 'METRICS_FLUSH_INTERVAL', 5)  # seconds
+
+# Upper bounds, in seconds, of the histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float('inf'))
+
+# The spans recorded by database cursors, which are subtracted from the
+# generator run time to give the "transform" (python/pandas) time.
+DB_SPANS = ('db_connect', 'db_execute', 'db_fetch')
+
+_spans = ContextVar('timing_spans', default = None)
+
+
+def start():
+    """Begin collecting spans for the current request (or batch task)"""
+    spans = defaultdict(float)
+    _spans.set(spans)
+    return spans
+
+
+def current():
+    """Return the spans collected so far for the current request, if any"""
+    return _spans.get()
+
+
+@contextmanager
+def span(name):
+    """Time the enclosed block, adding it to the current request's span name"""
+    spans = _spans.get()
+    if spans is None:
+        yield
+        return
+
+    t1 = time.perf_counter()
+    try:
+        yield
+    finally:
+        spans[name] += time.perf_counter() - t1
+
+
+def server_timing(spans) -> str:
+    """Format spans (in seconds) as a Server-Timing header value (in ms)"""
+    return ', '.join(
+        f"{name};dur={duration * 1000:.1f}"
+        for name, duration in spans.items()
+    )
+
+
+class Histograms():
+    """Thread-safe set of latency histograms, keyed by (tag, phase)"""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+        self._last_flush = 0
+
+    def observe(self, tag, spans):
+        with self._lock:
+            for phase, duration in spans.items():
+                counts, total, count = self._data.get((tag, phase), ([0] * len(BUCKETS), 0.0, 0))
+                for idx, bound in enumerate(BUCKETS):
+                    if duration <= bound:
+                        counts[idx] += 1
+                        break
+                self._data[(tag, phase)] = (counts, total + duration, count + 1)
+
+        if METRICS_DIR and time.monotonic() - self._last_flush > METRICS_FLUSH_INTERVAL:
+            self.flush()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {key: (list(counts), total, count) for key, (counts, total, count) in self._data.items()}
+
+    def flush(self):
+        """Write this worker's histograms to METRICS_DIR"""
+        self._last_flush = time.monotonic()
+        data = [[tag, phase, counts, total, count]
+                for (tag, phase), (counts, total, count) in self.snapshot().items()]
+
+        os.makedirs(METRICS_DIR, exist_ok = True)
+        path = os.path.join(METRICS_DIR, f"worker-{os.getpid()}.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def combined(self) -> dict:
+        """Histograms summed over every worker that has written to METRICS_DIR"""
+        if not METRICS_DIR:
+            return self.snapshot()
+
+        self.flush()
+        result = {}
+        for filename in os.listdir(METRICS_DIR):
+            if not filename.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(METRICS_DIR, filename)) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+
+            for tag, phase, counts, total, count in data:
+                prev_counts, prev_total, prev_count = result.get((tag, phase), ([0] * len(BUCKETS), 0.0, 0))
+                result[(tag, phase)] = (
+                    [a + b for a, b in zip(prev_counts, counts)],
+                    prev_total + total,
+                    prev_count + count,
+                )
+
+        return result
+
+
+HISTOGRAMS = Histograms()
+
+
+def record(tag, spans):
+    """Add a finished request's spans to the histograms for its tag"""
+    HISTOGRAMS.observe(tag, spans)
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus_text(extra_counters = None) -> str:
+    """
+    Render the histograms, and any extra counters ({name: (help, value)}),
+    in the Prometheus text exposition format.
+    """
+    name = 'multiplot_request_phase_seconds'
+    lines = [
+        f"# HELP {name} Time spent in each phase of generating a plot, by plot tag.",
+        f"# TYPE {name} histogram",
+    ]
+
+    for (tag, phase), (counts, total, count) in sorted(HISTOGRAMS.combined().items()):
+        labels = f'tag="{_label(tag)}",phase="{_label(phase)}"'
+        cumulative = 0
+        for bound, bucket_count in zip(BUCKETS, counts):
+            cumulative += bucket_count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f'{name}_bucket{{{labels},le="{le}"}} {cumulative}')
+        lines.append(f'{name}_sum{{{labels}}} {total}')
+        lines.append(f'{name}_count{{{labels}}} {count}')
+
+    for counter, (help_text, value) in (extra_counters or {}).items():
+        lines.append(f"# HELP {counter} {help_text}")
+        lines.append(f"# TYPE {counter} counter")
+        lines.append(f'{counter}{{worker="{os.getpid()}"}} {value}')
+
+    return '\n'.join(lines) + '\n'
@@ -1,14 +1,26 @@
+import os
+import threading
+import time
+
 from contextvars import ContextVar
 from functools import partial
+from urllib.parse import parse_qs
 
+import flask
 import psycopg
 import pymysql
 
 from psycopg.cursor import Cursor as Psycopg3Cursor
 
+try:
+    from psycopg_pool import ConnectionPool
+except ImportError:
+    ConnectionPool = None
+
 import numpy as np
+import pandas
 
-from . import config
+from . import config, timing
 
 # TODO: better way of defining this? We need the latitude and longitude of the
 # view center - which may not be the same as the "volcano location" - as well
@@ -29,42 +41,294 @@ VOLC_IDS = {}
 
 current_plot_tag = ContextVar("current_plot_tag")
 
+# The /getPlot arguments of the plot being generated. For a plot in a
+# /getPlots batch these are its own, not those of the request.
+current_plot_args = ContextVar("current_plot_args", default = None)
+
+
+def plot_args():
+    """Return the arguments (plotType, volcano, addArgs, ...) of the plot being generated"""
+    args = current_plot_args.get()
+    return flask.request.args if args is None else args
+
+
+class TimedMySQLCursor(pymysql.cursors.Cursor):
+    """pymysql cursor that records db_execute/db_fetch timing spans"""
+
+    def execute(self, *args, **kwargs):
+        with timing.span('db_execute'):
+            return super().execute(*args, **kwargs)
+
+    def fetchone(self):
+        with timing.span('db_fetch'):
+            return super().fetchone()
+
+    def fetchmany(self, *args, **kwargs):
+        with timing.span('db_fetch'):
+            return super().fetchmany(*args, **kwargs)
+
+    def fetchall(self):
+        with timing.span('db_fetch'):
+            return super().fetchall()
+
+    def __iter__(self):
+        # Time the fetch as a whole, rather than paying for a span per row.
+        return iter(self.fetchall())
+
+
+class TimedPostgreSQLCursor(Psycopg3Cursor):
+    """psycopg cursor that records db_execute/db_fetch timing spans"""
+
+    def execute(self, *args, **kwargs):
+        with timing.span('db_execute'):
+            return super().execute(*args, **kwargs)
+
+    def fetchone(self):
+        with timing.span('db_fetch'):
+            return super().fetchone()
+
+    def fetchmany(self, *args, **kwargs):
+        with timing.span('db_fetch'):
+            return super().fetchmany(*args, **kwargs)
+
+    def fetchall(self):
+        with timing.span('db_fetch'):
+            return super().fetchall()
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+
+# MySQL connection pool settings
+MYSQL_POOL = getattr(config, 'MYSQL_POOL', True)
+MYSQL_POOL_MAX = getattr(config, 'MYSQL_POOL_MAX', 10)  # checked-out connections per server
+MYSQL_POOL_IDLE = getattr(config, 'MYSQL_POOL_IDLE', 4)  # idle connections kept per database
+MYSQL_POOL_MAX_IDLE = getattr(config, 'MYSQL_POOL_MAX_IDLE', 300)  # seconds
+MYSQL_POOL_PING_AFTER = getattr(config, 'MYSQL_POOL_PING_AFTER', 30)  # seconds
+MYSQL_POOL_TIMEOUT = getattr(config, 'MYSQL_POOL_TIMEOUT', 30)  # seconds
+
+
+class MySQLPool():
+    """
+    A small pool of pymysql connections to one database.
+
+    Idle connections are reused most-recently-used first. One that has sat idle
+    for more than MYSQL_POOL_PING_AFTER seconds is pinged before being handed
+    out, and one idle longer than MYSQL_POOL_MAX_IDLE is closed instead. The
+    number of connections checked out at once is capped by limiter, which is
+    shared by all pools on the same server.
+    """
+
+    def __init__(self, host, db, user, password, limiter):
+        self._connect_args = {
+            'host': host,
+            'database': db,
+            'user': user,
+            'password': password,
+        }
+        self._limiter = limiter
+        self._idle = []  # (connection, last used) pairs, most recent last
+        self._lock = threading.Lock()
+
+    def getconn(self) -> pymysql.connections.Connection:
+        if not self._limiter.acquire(timeout = MYSQL_POOL_TIMEOUT):
+            raise TimeoutError(
+                f"No MySQL connection to {self._connect_args['host']} available "
+                f"after {MYSQL_POOL_TIMEOUT} seconds"
+            )
+
+        try:
+            while True:
+                with self._lock:
+                    if not self._idle:
+                        break
+                    conn, last_used = self._idle.pop()
+
+                idle_time = time.monotonic() - last_used
+                if idle_time > MYSQL_POOL_MAX_IDLE:
+                    self._close(conn)
+                    continue
+
+                if idle_time > MYSQL_POOL_PING_AFTER:
+                    try:
+                        conn.ping(reconnect = False)
+                    except pymysql.err.Error:
+                        self._close(conn)
+                        continue
+
+                return conn
+
+            return pymysql.connect(**self._connect_args)
+        except BaseException:
+            self._limiter.release()
+            raise
+
+    def putconn(self, conn, discard = False):
+        try:
+            if discard or not conn.open:
+                self._close(conn)
+                return
+
+            with self._lock:
+                if len(self._idle) < MYSQL_POOL_IDLE:
+                    self._idle.append((conn, time.monotonic()))
+                    conn = None
+
+            if conn is not None:
+                self._close(conn)
+        finally:
+            self._limiter.release()
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except pymysql.err.Error:
+            pass  # Already closed/dead, which is what we wanted anyway.
+
+
+_mysql_pools = {}
+_mysql_limiters = {}
+_mysql_pools_lock = threading.Lock()
+
+
+def get_mysql_pool(host, db, user, password) -> MySQLPool:
+    """Return the (per-process) connection pool for (host, db, user)"""
+    pid = os.getpid()
+    key = (pid, host, db, user)
+    pool = _mysql_pools.get(key)
+    if pool is not None:
+        return pool
+
+    with _mysql_pools_lock:
+        pool = _mysql_pools.get(key)
+        if pool is None:
+            limiter = _mysql_limiters.setdefault(
+                (pid, host), threading.BoundedSemaphore(MYSQL_POOL_MAX)
+            )
+            pool = MySQLPool(host, db, user, password, limiter)
+            _mysql_pools[key] = pool
+
+    return pool
+
+
 class MYSQLCursor():
-    def __init__(self, DB, user = config.GDDB_USER, password = config.GDDB_PASS):
+    def __init__(self, DB, user = config.GDDB_USER, password = config.GDDB_PASS, pooled = None):
         self._conn = None
+        self._pool = None
         self._db = DB
         self._user = user
         self._pass = password
         self._server = config.GDDB_HOST
+        self._pooled = MYSQL_POOL if pooled is None else pooled
 
     def __enter__(self) -> pymysql.cursors.Cursor:
-        self._conn = pymysql.connect(user = self._user, password = self._pass,
-                                     database = self._db, host = self._server)
-        return self._conn.cursor()
+        with timing.span('db_connect'):
+            if self._pooled:
+                self._pool = get_mysql_pool(self._server, self._db, self._user, self._pass)
+                self._conn = self._pool.getconn()
+            else:
+                self._conn = pymysql.connect(user = self._user, password = self._pass,
+                                             database = self._db, host = self._server)
+        return self._conn.cursor(TimedMySQLCursor)
 
     def __exit__(self, *args, **kwargs):
-        self._conn.rollback()
-        self._conn.close()
+        if self._pool is not None:
+            discard = False
+            try:
+                self._conn.rollback()
+            except pymysql.err.Error:
+                discard = True
+            self._pool.putconn(self._conn, discard)
+            self._pool = None
+        else:
+            self._conn.rollback()
+            self._conn.close()
+
+
+# Connection pool settings. Pooling is used whenever psycopg_pool is installed,
+# unless disabled in the config.
+PGDB_POOL = getattr(config, 'PGDB_POOL', ConnectionPool is not None)
+PGDB_POOL_MIN = getattr(config, 'PGDB_POOL_MIN', 1)
+PGDB_POOL_MAX = getattr(config, 'PGDB_POOL_MAX', 10)
+PGDB_POOL_MAX_IDLE = getattr(config, 'PGDB_POOL_MAX_IDLE', 300)  # seconds
+PGDB_POOL_TIMEOUT = getattr(config, 'PGDB_POOL_TIMEOUT', 30)  # seconds
+
+_pg_pools = {}
+_pg_pools_lock = threading.Lock()
+
+
+def get_pg_pool(host, db, user, password):
+    """
+    Return the connection pool for (host, db, user), creating it if needed.
+
+    Pools are per-process (a pool created before a fork is never handed to the
+    child), check each connection is alive before handing it out, and close
+    connections beyond PGDB_POOL_MIN after PGDB_POOL_MAX_IDLE seconds unused.
+    """
+    key = (os.getpid(), host, db, user)
+    pool = _pg_pools.get(key)
+    if pool is not None:
+        return pool
+
+    with _pg_pools_lock:
+        pool = _pg_pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(
+                kwargs = {
+                    'user': user,
+                    'password': password,
+                    'dbname': db,
+                    'host': host,
+                    'connect_timeout': 15,
+                },
+                min_size = PGDB_POOL_MIN,
+                max_size = PGDB_POOL_MAX,
+                max_idle = PGDB_POOL_MAX_IDLE,
+                timeout = PGDB_POOL_TIMEOUT,
+                check = ConnectionPool.check_connection,
+                name = f"{user}@{host}/{db}",
+                open = True,
+            )
+            _pg_pools[key] = pool
+
+    return pool
 
 
 class PostgreSQLCursor():
     def __init__(self, DB, user = config.PGDB_USER, password = config.PGDB_PASS,
-                 host = config.PGDB_HOST, row_factory = None):
+                 host = config.PGDB_HOST, row_factory = None, pooled = None):
         self._conn = None
+        self._pool = None
         self._db = DB
         self._user = user
         self._pass = password
         self._server = host
         self._row_factory = row_factory
+        self._pooled = PGDB_POOL if pooled is None else pooled
 
     def __enter__(self) -> Psycopg3Cursor:
-        self._conn = psycopg.connect(user = self._user, password = self._pass,
-                                     dbname = self._db, host = self._server, connect_timeout = 15)
+        with timing.span('db_connect'):
+            if self._pooled:
+                self._pool = get_pg_pool(self._server, self._db, self._user, self._pass)
+                self._conn = self._pool.getconn()
+            else:
+                self._conn = psycopg.connect(user = self._user, password = self._pass,
+                                             dbname = self._db, host = self._server, connect_timeout = 15)
+        self._conn.cursor_factory = TimedPostgreSQLCursor
         return self._conn.cursor(row_factory = self._row_factory)
 
     def __exit__(self, *args, **kwargs) -> None:
-        self._conn.rollback()
-        self._conn.close()
+        if self._pool is not None:
+            # putconn discards the connection if it was left in a bad state
+            try:
+                self._conn.rollback()
+            finally:
+                self._pool.putconn(self._conn)
+            self._pool = None
+        else:
+            self._conn.rollback()
+            self._conn.close()
 
 # The PREEVENTS db is postgresql, so we can just re-use the above PostgreSQL cursor,
 # but with different default settings.
@@ -101,6 +365,52 @@ def haversine_np(lon1, lat1, lon2, lat2):
     return km
 
 
+def _comparable_time(t, tz):
+    """t as a pandas Timestamp in timezone tz (None for naive UTC), taking naive t to be UTC"""
+    t = pandas.Timestamp(t)
+    if t.tzinfo is None:
+        t = t.tz_localize('UTC')
+    return t.tz_convert('UTC').tz_localize(None) if tz is None else t.tz_convert(tz)
+
+
+def time_window(index, start = None, end = None) -> slice:
+    """
+    Return the positions in a sorted DatetimeIndex with start <= time <= end,
+    found by binary search. Either bound may be None. Naive datetimes (as the
+    generators receive them) are taken to be UTC.
+    """
+    first = 0 if start is None else index.searchsorted(_comparable_time(start, index.tz), side = 'left')
+    last = len(index) if end is None else index.searchsorted(_comparable_time(end, index.tz), side = 'right')
+    return slice(int(first), int(last))
+
+
+def select_window(data, start = None, end = None):
+    """The rows of a frame or series with a sorted DatetimeIndex between start and end (see time_window)"""
+    if start is None and end is None:
+        return data
+    return data.iloc[time_window(data.index, start, end)]
+
+
+# Bins the event count plots can be grouped by (addArgs "bin=<name>"), as
+# pandas frequencies. Weeks end on, and are labelled with, the Sunday.
+COUNT_BINS = {
+    'day': 'D',
+    'week': 'W',
+    'month': 'MS',
+}
+
+
+def count_bin(add_args, default = 'week') -> str:
+    """
+    Return the bin requested by a "bin" entry in the addArgs query string,
+    aborting the request with a 400 if it is not one of COUNT_BINS.
+    """
+    requested = parse_qs(add_args or '').get('bin', [default])[0]
+    if requested not in COUNT_BINS:
+        flask.abort(400, f"Unknown bin {requested!r}, expected one of {', '.join(COUNT_BINS)}")
+    return requested
+
+
 def get_volcs():
     volcs = tuple(VOLCANOES.keys())
     #Default is Geodiva
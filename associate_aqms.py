@@ -0,0 +1,244 @@
+"""
+Assign every AQMS event to its nearest volcano, for the Seismology (AQMS) plots.
+
+Finding the events for a volcano means a radius search over the whole AQMS
+catalog plus a check that no other volcano is closer to each event. This
+script does that work once, ahead of time, and stores the result in the
+aqms_event_volcano table of the multiplot database. With AQMS_USE_ASSOCIATION
+set in the config, get_aqms_data() then reads a volcano's events from that
+table with an index range scan on (volcano, unix_time).
+
+Each run only processes events whose AQMS records changed (by lddate) since
+the high-water mark left by the previous run, so it can be run every few
+minutes from cron:
+
+    python associate_aqms.py
+
+Events that have since been marked bogus or unselected, or moved away from every
+volcano are removed from the table. The assignment depends on the list of
+volcanoes, so run with --rebuild after adding or moving one.
+"""
+
+import argparse
+import datetime
+
+import numpy
+
+from psycopg.rows import dict_row
+
+from MultiplotWeb import config
+from MultiplotWeb.utils import PostgreSQLCursor, VOLCANOES, VOLC_IDS, get_volcs, haversine_np
+
+# Events further than this from every volcano are not stored. Matches the
+# search radius of get_aqms_data().
+MAX_DIST = 20  # km
+
+BATCH_SIZE = 20000
+
+STATE_NAME = 'aqms_event_volcano'
+
+# Start of the high-water mark on the first run
+EPOCH = datetime.datetime(1900, 1, 1)
+
+
+def create_table():
+    with PostgreSQLCursor("multiplot") as cursor:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS aqms_event_volcano (
+                evid BIGINT PRIMARY KEY,
+                volcano INTEGER NOT NULL,
+                unix_time DOUBLE PRECISION NOT NULL,
+                lat DOUBLE PRECISION,
+                lon DOUBLE PRECISION,
+                depth_km NUMERIC,
+                auto BOOLEAN,
+                type TEXT,
+                mag NUMERIC,
+                gap DOUBLE PRECISION,
+                ndef INTEGER,
+                erhor DOUBLE PRECISION,
+                sdep DOUBLE PRECISION,
+                distance DOUBLE PRECISION NOT NULL
+            )
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS aqms_event_volcano_volcano_time
+            ON aqms_event_volcano (volcano, unix_time)
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS aqms_association_state (
+                name TEXT PRIMARY KEY,
+                high_water TIMESTAMP NOT NULL,
+                last_evid BIGINT NOT NULL
+            )
+        """)
+        cursor.connection.commit()
+
+
+def get_high_water():
+    """Return (lddate, evid) of the last event processed"""
+    with PostgreSQLCursor("multiplot") as cursor:
+        cursor.execute("SELECT high_water, last_evid FROM aqms_association_state WHERE name=%s",
+                       (STATE_NAME, ))
+        row = cursor.fetchone()
+
+    if row is None:
+        return EPOCH, 0
+    return row
+
+
+def fetch_changed(since, since_evid):
+    """
+    Fetch the next batch of events changed after (since, since_evid), in
+    (changed, evid) order. Flags are returned rather than filtered on, so
+    events that became invalid can be removed.
+    """
+    query = """
+    SELECT * FROM (
+        SELECT  e.evid,
+                GREATEST(e.lddate, o.lddate, n.lddate) as changed,
+                truetime.true2nominalf(o.datetime) as unix_time,
+                lat,
+                lon,
+                round(depth::numeric, 2) as depth_km,
+                (o.rflag='A') as auto,
+                type,
+                round(magnitude::numeric,2) as mag,
+                o.gap,
+                ndef,
+                erhor,
+                sdep,
+                (bogusflag=0 AND selectflag=1 AND o.rflag in ('A','F')) as valid
+            FROM event e
+            INNER JOIN origin o ON o.orid=e.prefor
+            INNER JOIN netmag n ON e.prefmag=n.magid
+        WHERE e.lddate >= %(since)s OR o.lddate >= %(since)s OR n.lddate >= %(since)s
+    ) changes
+    WHERE (changed, evid) > (%(since)s, %(sinceEvid)s)
+    ORDER BY changed, evid
+    LIMIT %(limit)s
+    """
+
+    with PostgreSQLCursor(config.AQMS_DB, user = config.AQMS_USER,
+                          password = config.AQMS_PASS, host = config.AQMS_HOST,
+                          row_factory = dict_row) as cur:
+        cur.execute(query, {'since': since, 'sinceEvid': since_evid, 'limit': BATCH_SIZE})
+        return cur.fetchall()
+
+
+def nearest_volcanoes(lat, lon):
+    """
+    For arrays of event coordinates, return (volcano ids, distances in km)
+    of the closest volcano to each, as one vectorized distance matrix.
+    """
+    names = [name for name in VOLCANOES if name in VOLC_IDS]
+    volc_lat, volc_lon = numpy.array([VOLCANOES[name][:2] for name in names], dtype = float).T
+
+    dists = haversine_np(volc_lon, volc_lat, lon[:, numpy.newaxis], lat[:, numpy.newaxis])
+    closest = dists.argmin(axis = 1)
+    ids = numpy.array([VOLC_IDS[name] for name in names])
+
+    return ids[closest], dists[numpy.arange(len(closest)), closest]
+
+
+def process_batch(events):
+    """Store or remove each event in the batch, and advance the high-water mark"""
+    valid = [ev for ev in events if ev['valid'] and ev['lat'] is not None and ev['lon'] is not None]
+
+    rows = []
+    if valid:
+        lat = numpy.array([ev['lat'] for ev in valid], dtype = float)
+        lon = numpy.array([ev['lon'] for ev in valid], dtype = float)
+        volc_ids, dists = nearest_volcanoes(lat, lon)
+
+        for ev, volc_id, dist in zip(valid, volc_ids, dists):
+            if dist > MAX_DIST:
+                continue
+            rows.append((
+                ev['evid'], int(volc_id), ev['unix_time'], ev['lat'], ev['lon'], ev['depth_km'],
+                ev['auto'], ev['type'], ev['mag'], ev['gap'], ev['ndef'], ev['erhor'], ev['sdep'],
+                float(dist) * 1000,  # m, as PostGIS reports it
+            ))
+
+    kept = {row[0] for row in rows}
+    removed = [(ev['evid'], ) for ev in events if ev['evid'] not in kept]
+    last = events[-1]
+
+    with PostgreSQLCursor("multiplot") as cursor:
+        if rows:
+            cursor.executemany("""
+                INSERT INTO aqms_event_volcano
+                    (evid, volcano, unix_time, lat, lon, depth_km, auto, type, mag,
+                     gap, ndef, erhor, sdep, distance)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                ON CONFLICT (evid) DO UPDATE SET
+                    volcano=EXCLUDED.volcano,
+                    unix_time=EXCLUDED.unix_time,
+                    lat=EXCLUDED.lat,
+                    lon=EXCLUDED.lon,
+                    depth_km=EXCLUDED.depth_km,
+                    auto=EXCLUDED.auto,
+                    type=EXCLUDED.type,
+                    mag=EXCLUDED.mag,
+                    gap=EXCLUDED.gap,
+                    ndef=EXCLUDED.ndef,
+                    erhor=EXCLUDED.erhor,
+                    sdep=EXCLUDED.sdep,
+                    distance=EXCLUDED.distance
+            """, rows)
+
+        if removed:
+            cursor.executemany("DELETE FROM aqms_event_volcano WHERE evid=%s", removed)
+
+        # Saved in the same transaction, so a failed run is simply repeated.
+        cursor.execute("""
+            INSERT INTO aqms_association_state (name, high_water, last_evid)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (name) DO UPDATE SET
+                high_water=EXCLUDED.high_water,
+                last_evid=EXCLUDED.last_evid
+        """, (STATE_NAME, last['changed'], last['evid']))
+        cursor.connection.commit()
+
+    return len(rows), len(removed)
+
+
+def rebuild():
+    """Forget the high-water mark and every assignment, so the next run starts over"""
+    with PostgreSQLCursor("multiplot") as cursor:
+        cursor.execute("TRUNCATE aqms_event_volcano")
+        cursor.execute("DELETE FROM aqms_association_state WHERE name=%s", (STATE_NAME, ))
+        cursor.connection.commit()
+
+
+def refresh():
+    get_volcs()
+    since, since_evid = get_high_water()
+
+    stored = removed = 0
+    while True:
+        events = fetch_changed(since, since_evid)
+        if not events:
+            break
+
+        batch_stored, batch_removed = process_batch(events)
+        stored += batch_stored
+        removed += batch_removed
+        since, since_evid = events[-1]['changed'], events[-1]['evid']
+
+        if len(events) < BATCH_SIZE:
+            break
+
+    print(f"Stored {stored} events; removed {removed}. High-water mark: {since}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = __doc__.split('\n\n')[0])
+    parser.add_argument('--rebuild', action = 'store_true',
+                        help = 'Reprocess the whole catalog, e.g. after the volcano list changed')
+    args = parser.parse_args()
+
+    create_table()
+    if args.rebuild:
+        rebuild()
+    refresh()
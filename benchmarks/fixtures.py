@@ -0,0 +1,625 @@
+"""
+Local stand-ins for the databases and data files the generators read.
+
+install() replaces utils.PostgreSQLCursor, utils.MYSQLCursor and
+utils.PREEVENTSSQLCursor with replay cursors. Each query a generator runs is
+matched (by a distinctive fragment of its SQL) to a handler below, which
+returns a synthetic, deterministic result of the configured size. Results are
+memoized per (handler, size, query arguments), so a timed run measures the
+application rather than the fixture.
+
+write_data_files() creates the CSV files read from DATA_DIR in the same
+layout as the real data directory.
+
+When a generator's SQL changes, the matching handler here has to follow it;
+a query that no handler recognises raises LookupError, which the benchmark
+reports as a failed run for that plot type.
+"""
+
+import datetime
+import decimal
+import functools
+import os
+import re
+import threading
+import types
+import zlib
+
+from collections.abc import Mapping
+
+import numpy
+import pandas
+import psycopg
+
+# Number of rows each "large" query returns. Set by set_size().
+SIZE = 1000
+
+# The range synthetic time series cover when the request does not give one
+WINDOW = (datetime.datetime(2000, 1, 1), datetime.datetime(2025, 12, 31))
+
+SEED = 0
+
+PREEVENTS_DEVICES = ('DEV1', 'DEV2', 'DEV3')
+DOAS_INSTRUMENTS = ('d2j2200', 'd2j2201')
+RS_TYPES = (4, 9, 35, 40, 45, 25)
+SEISDB_KEYWORDS = (71, 81, 101, 111, 141, 161, 191, 201)
+
+_memo = {}
+_memo_lock = threading.Lock()
+
+
+def standin_config():
+    """A config module with placeholder credentials, for trees without one"""
+    config = types.ModuleType('MultiplotWeb.config')
+    for prefix in ('GDDB', 'PGDB', 'PREEVENTS', 'AQMS', 'RSDB'):
+        setattr(config, f'{prefix}_USER', 'bench')
+        setattr(config, f'{prefix}_PASS', 'bench')
+        setattr(config, f'{prefix}_HOST', 'localhost')
+    config.AQMS_DB = 'aqms'
+    config.RSDB_DB = 'rsdb'
+    config.DATA_DIR = None
+    return config
+
+
+def set_size(size):
+    global SIZE
+    SIZE = size
+
+
+######## Helpers #########
+def _span(name):
+    # Imported late, as the config has to be in place before any of the app is.
+    from MultiplotWeb import timing
+    return timing.span(name)
+
+
+def _rng(name, *extra):
+    return numpy.random.default_rng([SEED, zlib.crc32(repr((name, SIZE) + extra).encode())])
+
+
+def _as_datetime(value, default):
+    if value is None:
+        return default
+    if isinstance(value, (int, float)):
+        return datetime.datetime.fromtimestamp(value, datetime.timezone.utc).replace(tzinfo = None)
+    if isinstance(value, datetime.datetime):
+        return value.replace(tzinfo = None)
+    return pandas.Timestamp(value).to_pydatetime().replace(tzinfo = None)
+
+
+def _times(rng, n, start = None, end = None):
+    """n sorted, naive datetimes between start and end"""
+    start = _as_datetime(start, WINDOW[0])
+    end = _as_datetime(end, WINDOW[1])
+    t0, t1 = pandas.Timestamp(start).value, pandas.Timestamp(end).value
+    stamps = numpy.sort(rng.integers(t0, max(t1, t0 + 1), n))
+    return pandas.to_datetime(stamps).to_pydatetime()
+
+
+def _haversine_m(lon1, lat1, lon2, lat2):
+    lon1, lat1, lon2, lat2 = map(numpy.radians, [lon1, lat1, lon2, lat2])
+    a = (numpy.sin((lat2 - lat1) / 2.0) ** 2
+         + numpy.cos(lat1) * numpy.cos(lat2) * numpy.sin((lon2 - lon1) / 2.0) ** 2)
+    return 6378137 * 2 * numpy.arcsin(numpy.sqrt(a))
+
+
+######## Query handlers ##########
+# Each takes (sql, args) and returns (column names, list of rows)
+
+def volcanoes(sql, args):
+    from MultiplotWeb import utils
+    rows = [
+        (idx + 1, name, lat, lon, None)
+        for idx, (name, (lat, lon, *_)) in enumerate(utils.VOLCANOES.items())
+    ]
+    return ['volcano_id', 'volcano_name', 'latitude', 'longitude', 'child_volcano_ids'], rows
+
+
+def aqms_events(sql, args):
+    # A fixed catalog of SIZE events over the whole window, which each query
+    # filters, so that overlapping queries agree with each other.
+    columns, rows, unix = _aqms_catalog(SIZE, args['volcLat'], args['volcLon'], args.get('maxDist', 20))
+    first = numpy.searchsorted(unix, args.get('starttime', -numpy.inf), side = 'left')
+    last = numpy.searchsorted(unix, args.get('endtime', numpy.inf), side = 'right')
+    return columns, rows[first:last]
+
+
+def aqms_associated(sql, args):
+    # The same catalog, as associate_aqms.py would have stored it
+    from MultiplotWeb import utils
+    volcano = {volc_id: name for name, volc_id in utils.VOLC_IDS.items()}[args['volc']]
+    v_lat, v_lon = utils.VOLCANOES[volcano][:2]
+    return aqms_events(sql, dict(args, volcLat = v_lat, volcLon = v_lon))
+
+
+def aqms_counts(sql, args):
+    # The catalog above, counted per date_trunc(bin) bucket as PostgreSQL would
+    if 'FROM aqms_event_volcano' in sql:
+        _, rows = aqms_associated(sql, args)
+    else:
+        _, rows = aqms_events(sql, args)
+
+    times = pandas.to_datetime(numpy.array([row[1] for row in rows], dtype = float), unit = 's')
+    if args['bin_size'] == 'day':
+        buckets = times.normalize()
+    elif args['bin_size'] == 'week':
+        buckets = times.normalize() - pandas.to_timedelta(times.weekday, unit = 'D')
+    else:
+        buckets = times.to_period('M').start_time
+
+    counts = pandas.Series(1, index = buckets).groupby(level = 0).count()
+    return ['bucket', 'count'], [(t.to_pydatetime(), int(c)) for t, c in counts.items()]
+
+
+@functools.lru_cache(maxsize = 8)
+def _aqms_catalog(size, v_lat, v_lon, max_dist):
+    rng = _rng('aqms', v_lat, v_lon)
+    times = _times(rng, size)
+    unix = numpy.array([t.replace(tzinfo = datetime.timezone.utc).timestamp() for t in times])
+
+    # Scatter the events within max_dist of the volcano
+    radius = rng.uniform(0, max_dist * 1000, size)
+    bearing = rng.uniform(0, 2 * numpy.pi, size)
+    lat = v_lat + radius * numpy.cos(bearing) / 111_320
+    lon = v_lon + radius * numpy.sin(bearing) / (111_320 * numpy.cos(numpy.radians(v_lat)))
+    distance = _haversine_m(lon, lat, v_lon, v_lat)
+
+    depth = rng.uniform(-2, 30, size)
+    mag = rng.normal(0.5, 0.8, size)
+    columns = ['eventId', 'unixTime', 'lat', 'long', 'depthKM', 'auto', 'type', 'mag',
+               'azimuthal-gap', 'num-phases-used', 'horizontal-error', 'vertical-error', 'distance']
+    rows = [
+        (
+            idx + 1, float(unix[idx]), float(lat[idx]), float(lon[idx]),
+            decimal.Decimal(f"{depth[idx]:.2f}"), bool(idx % 3 == 0), 'eq',
+            decimal.Decimal(f"{mag[idx]:.2f}"), 90.0, 12, 0.5, 0.8, float(distance[idx]),
+        )
+        for idx in range(size)
+    ]
+    return columns, rows, unix
+
+
+def seisdb_reports(sql, args):
+    rng = _rng('seisdb', *args)
+    n = max(SIZE // 10, 1)
+    times = _times(rng, n, *(args[1:3]))
+    keywords = rng.choice(SEISDB_KEYWORDS, n)
+    rows = [(args[0], t, int(k)) for t, k in zip(times, keywords)]
+    return ['volcano_id', 'end_report_time', 'keyword_id'], rows
+
+
+def rs_detections(sql, args):
+    rng = _rng('rs', *args)
+    n = max(SIZE // 10, 1)
+    dates = [a for a in args if isinstance(a, datetime.datetime)]
+    times = _times(rng, n, *(dates + [None, None])[:2])
+    kinds = rng.choice(RS_TYPES, n)
+    mass = rng.uniform(0.1, 50, n)
+    age = rng.uniform(1, 24, n)
+    rows = [
+        (t, float(m * 1000 / a * 24), int(k), 'icon.png', float(m))
+        for t, k, m, a in zip(times, kinds, mass, age)
+    ]
+    return ['date', 'rate', 'type', 'icon', 'mass'], rows
+
+
+def color_codes(sql, args):
+    rng = _rng('hans2')
+    n = min(SIZE, 500)
+    times = _times(rng, n, datetime.datetime(2009, 1, 1))
+    codes = rng.choice(['GREEN', 'YELLOW', 'ORANGE', 'RED', 'UNASSIGNED'], n)
+    rows = [(t, str(c)) for t, c in zip(times, codes)]
+
+    dates = [a for a in args if isinstance(a, datetime.datetime)]
+    if 'DESC' in sql:
+        limit = dates[-1] if dates else None
+        rows = [r for r in rows if limit is None or r[0] <= limit][-1:]
+    elif dates:
+        rows = [r for r in rows if r[0] >= dates[0]]
+        if len(dates) > 1:
+            rows = [r for r in rows if r[0] <= dates[1]]
+    return ['sent_utc', 'color_code'], rows
+
+
+def geodiva_codes(sql, args):
+    rng = _rng('geodiva')
+    n = min(SIZE, 100)
+    times = _times(rng, n, datetime.datetime(1990, 1, 1), datetime.datetime(2008, 12, 31))
+    codes = rng.choice(['GREEN', 'YELLOW', 'ORANGE', 'RED'], n)
+    return ['ReleaseDate', 'ColorCode'], [(t, str(c)) for t, c in zip(times, codes)]
+
+
+DB_DATASETS = {
+    # title: (category, table)
+    'Fioletov Catalogue': ('Gas - Satellite SO<sub>2</sub>', 'fioletov'),
+    'Synthetic Series': ('Synthetic', 'synthetic_series'),
+}
+
+
+def db_labels(sql, args):
+    return ['title', 'name'], [(title, cat) for title, (cat, _) in DB_DATASETS.items()]
+
+
+def db_metadata(sql, args):
+    title = args[0]
+    if title not in DB_DATASETS:
+        return ['tablename'], []
+    return (['tablename', 'value_column', 'units', 'types', 'plot_format'],
+            [(DB_DATASETS[title][1], 'value', 'units', None, None)])
+
+
+def db_columns(sql, args):
+    return ['column_name'], [('datetime', ), ('volcano', ), ('value', ), ('error', )]
+
+
+def db_data(sql, args):
+    rng = _rng('db_data', *args)
+    times = _times(rng, SIZE, *(list(args[1:3]) + [None, None])[:2])
+    values = rng.gamma(2, 100, SIZE)
+    errors = values * 0.1
+    return (['datetime', 'value', 'error'],
+            [(t, float(v), float(e)) for t, v, e in zip(times, values, errors)])
+
+
+PREEVENTS_LABELS = [
+    ('Synthetic Variable', 'Synthetic', 1, 1, 'synthetic', 'A synthetic variable', 'A synthetic dataset'),
+    ('HotLINK Radiative Power', 'Remote Sensing', 2, 2, 'radiative_power', 'Radiative power', 'HotLINK'),
+]
+
+
+def preevents_labels(sql, args):
+    return (['enhanced_displayname', 'discipline_name', 'dataset_id', 'variable_id',
+             'variable_name', 'variable_description', 'dataset_description'], PREEVENTS_LABELS)
+
+
+def preevents_settings(sql, args):
+    return ['dataset_id', 'variable_id', 'hidden', 'overrides'], []
+
+
+def preevents_table_versions(sql, args):
+    tables = re.findall(r'FROM "(\w+)"', sql)
+    return ['?column?', 'count', 'max'], [(table, SIZE, SIZE) for table in tables]
+
+
+def preevents_metadata(sql, args):
+    devices = list(PREEVENTS_DEVICES)
+    if len(args) > 3 and args[3]:
+        devices = [d for d in devices if d in args[3]]
+    label = [l for l in PREEVENTS_LABELS if l[:2] == (args[1], args[0])]
+    if not label or not devices:
+        return ['datastreams'], []
+
+    _, _, dataset_id, variable_id, *_ = label[0]
+    ids = [PREEVENTS_DEVICES.index(d) + 1 for d in devices]
+    return (['datastreams', 'devices', 'units', 'tables', 'dataset_id', 'variable_id'],
+            [(ids, devices, ['MW'] * len(ids), ['datavalues'], dataset_id, variable_id)])
+
+
+def preevents_data(sql, args):
+    ids = args.get('datastream_ids') or [1]
+    per_device = max(SIZE // len(ids), 1)
+    rows = []
+    for ident in ids:
+        rng = _rng('preevents', ident, args.get('start_time'), args.get('end_time'))
+        times = _times(rng, per_device, args.get('start_time'), args.get('end_time'))
+        values = rng.lognormal(2, 2, per_device)
+        device = PREEVENTS_DEVICES[(ident - 1) % len(PREEVENTS_DEVICES)]
+        rows.extend((t, float(v), device) for t, v in zip(times, values))
+    return ['timestamp', 'datavalue', 'device_name'], rows
+
+
+def preevents_buckets(sql, args):
+    raw = {k: v for k, v in args.items() if k not in ('bucket_seconds', 'max_points')}
+    _, rows = run_query('SELECT dv.timestamp, dv.datavalue', raw)
+    data = pandas.DataFrame(rows, columns = ['timestamp', 'datavalue', 'device_name'])
+    if len(data) == 0:
+        return ['device_name'], []
+
+    start = pandas.Timestamp(_as_datetime(args['start_time'], WINDOW[0]))
+    offset = (data['timestamp'] - start).dt.total_seconds()
+    data['bucket'] = numpy.floor(offset / args['bucket_seconds'])
+    data['offset'] = offset
+    grouped = data.groupby(['device_name', 'bucket'], sort = True)
+    buckets = grouped.agg(samples = ('datavalue', 'size'), offset = ('offset', 'mean'),
+                          first = ('timestamp', 'min'), min = ('datavalue', 'min'),
+                          mean = ('datavalue', 'mean'), max = ('datavalue', 'max')).reset_index()
+    times = start + pandas.to_timedelta(buckets['offset'], unit = 's')
+    times = times.where(buckets['samples'] > 1, buckets['first'])
+
+    if buckets.groupby('device_name')['samples'].sum().max() <= args['max_points']:
+        # Short enough to return the samples, each as a bucket of its own
+        data = data.sort_values(['device_name', 'bucket', 'timestamp'])
+        values = data['datavalue']
+        return (['device_name', 'bucket', 'samples', 'timestamp', 'min', 'avg', 'max'],
+                list(zip(data['device_name'], data['bucket'], [1] * len(data),
+                         data['timestamp'].dt.to_pydatetime(), values, values, values)))
+
+    return (['device_name', 'bucket', 'samples', 'timestamp', 'min', 'avg', 'max'],
+            list(zip(buckets['device_name'], buckets['bucket'], buckets['samples'],
+                     times.dt.to_pydatetime(), buckets['min'], buckets['mean'], buckets['max'])))
+
+
+def doas_data(sql, args):
+    volc_id, start, end = args
+    rows = []
+    per_instrument = max(SIZE // len(DOAS_INSTRUMENTS), 1)
+    for instrument in DOAS_INSTRUMENTS:
+        rng = _rng('doas', instrument, start, end)
+        times = _times(rng, per_instrument, start, end)
+        values = rng.uniform(0, 2000, per_instrument)
+        rows.extend((t, float(v), instrument, True) for t, v in zip(times, values))
+    return ['date', 'y', 'type', 'plume_complete'], rows
+
+
+def doas_availability(sql, args):
+    start = _as_datetime(args.get('start'), WINDOW[0]).date()
+    end = _as_datetime(args.get('stop'), WINDOW[1]).date()
+    days = pandas.date_range(start, end, freq = 'D').date
+    rng = _rng('doas_availability', start, end)
+    has = rng.random((len(days), len(DOAS_INSTRUMENTS))) > 0.3
+    rows = [
+        (day, instrument, bool(has[i, j]))
+        for i, day in enumerate(days)
+        for j, instrument in enumerate(DOAS_INSTRUMENTS)
+    ]
+    return ['date', 'instrument_id', 'has_records'], rows
+
+
+def descriptions(sql, args):
+    return ['name', 'title', 'description'], [
+        (cat, title, f'{title} (synthetic)') for title, (cat, _) in DB_DATASETS.items()
+    ]
+
+
+def category_descriptions(sql, args):
+    return ['name', '', 'description'], [(cat, '', cat) for cat, _ in DB_DATASETS.values()]
+
+
+# (SQL fragment, handler, memoize). Checked in order; the first match wins.
+HANDLERS = [
+    ('FROM volcano parent', volcanoes, False),
+    ('GROUP BY bucket', aqms_counts, True),
+    ('FROM event e', aqms_events, True),
+    ('FROM aqms_event_volcano', aqms_associated, True),
+    ('INNER JOIN report_volcano ON report.report_id', seisdb_reports, True),
+    ('keyword.keyword_id in', rs_detections, True),
+    ('FROM code_change_date', color_codes, False),
+    ('FROM tblreleaseinfo', geodiva_codes, False),
+    ('FROM plotinfo INNER JOIN categories', db_labels, False),
+    ('INNER JOIN categories ON categories.id=plotinfo.category', descriptions, False),
+    ("SELECT name, '', description FROM categories", category_descriptions, False),
+    ('tablename, value_column', db_metadata, False),
+    ('information_schema.columns', db_columns, False),
+    ('SELECT datetime, ', db_data, True),
+    ('displayname_dataset_counts', preevents_labels, False),
+    ('SELECT dataset_id, variable_id, hidden, overrides FROM preevents', preevents_settings, False),
+    ('max(xmin::text::bigint)', preevents_table_versions, False),
+    ('array_agg(datastream_id)', preevents_metadata, False),
+    ('SELECT dv.timestamp, dv.datavalue', preevents_data, True),
+    ('count(*) AS samples', preevents_buckets, True),
+    ('generate_series', doas_availability, True),
+    ('FROM doas', doas_data, True),
+]
+
+
+def _sql_text(query):
+    if isinstance(query, str):
+        return query
+    try:
+        return query.as_string(None)
+    except Exception:
+        # Composed SQL that needs a connection to render; the repr still
+        # contains every literal SQL fragment.
+        return repr(query)
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+# Named parameters, as written in SQL text and in the repr of composed SQL
+_PARAMETER = re.compile(r"(?<!%)%\((\w+)\)s|Placeholder\('(\w+)'\)")
+
+
+def _check_parameters(sql, args):
+    """Fail, as psycopg would, on a named parameter missing from args"""
+    names = {a or b for a, b in _PARAMETER.findall(sql)}
+    if not names:
+        return
+    if not isinstance(args, Mapping):
+        raise psycopg.ProgrammingError("query parameters should be a mapping when using named placeholders")
+
+    missing = sorted(names - set(args))
+    if missing:
+        raise psycopg.ProgrammingError(f"query parameter missing: {', '.join(missing)}")
+
+
+def run_query(query, args):
+    sql = _sql_text(query)
+    _check_parameters(sql, args)
+    for fragment, handler, memoize in HANDLERS:
+        if fragment in sql:
+            break
+    else:
+        raise LookupError(f"No benchmark fixture for query: {' '.join(sql.split())[:200]}")
+
+    if args is None:
+        args = ()
+
+    if not memoize:
+        return handler(sql, args)
+
+    key = (handler.__name__, SIZE, _freeze(args))
+    with _memo_lock:
+        result = _memo.get(key)
+    if result is None:
+        result = handler(sql, args)
+        with _memo_lock:
+            _memo[key] = result
+    return result
+
+
+######## Cursors ##########
+class FixtureConnection():
+    """Enough of a connection for code that reaches through cursor.connection"""
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+class FixtureCursor():
+    """A DB-API cursor answering queries from the handlers above"""
+
+    def __init__(self, row_factory = None):
+        self._row_factory = row_factory
+        self._rows = []
+        self._pos = 0
+        self.description = None
+        self.rowcount = -1
+        self.connection = FixtureConnection()
+
+    def execute(self, query, args = None, **kwargs):
+        with _span('db_execute'):
+            columns, rows = run_query(query, args)
+            if self._row_factory is not None:
+                # dict_row is the only row factory the generators use
+                rows = [dict(zip(columns, row)) for row in rows]
+        self.description = [(name, None, None, None, None, None, None) for name in columns]
+        self._rows = rows
+        self._pos = 0
+        self.rowcount = len(rows)
+
+    def executemany(self, query, args_seq, **kwargs):
+        for args in args_seq:
+            self.execute(query, args)
+
+    def fetchone(self):
+        with _span('db_fetch'):
+            if self._pos >= len(self._rows):
+                return None
+            self._pos += 1
+            return self._rows[self._pos - 1]
+
+    def fetchmany(self, size = 1):
+        with _span('db_fetch'):
+            rows = self._rows[self._pos:self._pos + size]
+            self._pos += len(rows)
+            return rows
+
+    def fetchall(self):
+        with _span('db_fetch'):
+            rows = self._rows[self._pos:]
+            self._pos = len(self._rows)
+            return rows
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def close(self):
+        pass
+
+
+class FixturePostgreSQLCursor():
+    """Drop-in for utils.PostgreSQLCursor"""
+
+    def __init__(self, DB = None, user = None, password = None, host = None,
+                 row_factory = None, pooled = None):
+        self._row_factory = row_factory
+
+    def __enter__(self):
+        return FixtureCursor(self._row_factory)
+
+    def __exit__(self, *args, **kwargs):
+        pass
+
+
+class FixtureMySQLCursor():
+    """Drop-in for utils.MYSQLCursor"""
+
+    def __init__(self, DB = None, user = None, password = None, pooled = None):
+        pass
+
+    def __enter__(self):
+        return FixtureCursor()
+
+    def __exit__(self, *args, **kwargs):
+        pass
+
+
+def install(utils):
+    """Point the database cursors in utils at the fixtures"""
+    utils.PostgreSQLCursor = FixturePostgreSQLCursor
+    utils.MYSQLCursor = FixtureMySQLCursor
+    utils.PREEVENTSSQLCursor = functools.partial(FixturePostgreSQLCursor, DB = 'preevents')
+
+
+######## Data files ##########
+def write_data_files(data_dir, volcano):
+    """Write synthetic versions of the CSV files under DATA_DIR for volcano"""
+    from MultiplotWeb import utils
+    v_lat, v_lon = utils.VOLCANOES[volcano][:2]
+
+    seismo_dir = os.path.join(data_dir, 'SeismoAcoustic_Data', f'{volcano}_synthetic')
+    os.makedirs(seismo_dir, exist_ok = True)
+
+    rng = _rng('rec', volcano)
+    times = pandas.DatetimeIndex(_times(rng, SIZE))
+    pandas.DataFrame({
+        'UTCDateTime': times.strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+        'Latitude': v_lat + rng.normal(0, 0.05, SIZE),
+        'Longitude': v_lon + rng.normal(0, 0.05, SIZE),
+        'Depth_km': rng.uniform(-2, 30, SIZE),
+        'Magnitude': rng.normal(0.5, 0.8, SIZE),
+        'FI': rng.normal(-1, 0.5, SIZE),
+    }).to_csv(os.path.join(seismo_dir, f'{volcano.lower()}_relocated_catalog.csv'), index = False)
+
+    rng = _rng('tc', volcano)
+    times = pandas.DatetimeIndex(_times(rng, SIZE))
+    pandas.DataFrame({
+        'UTCDateTime': times.strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+        'FI': rng.normal(-1, 0.5, SIZE),
+    }).to_csv(os.path.join(seismo_dir, f'{volcano.lower()}_temporally_complete_event_list.csv'),
+              index = False)
+
+    # Petrology and GVP datasets are small by nature, so they are capped.
+    diffusion_dir = os.path.join(data_dir, 'Diffusion')
+    os.makedirs(diffusion_dir, exist_ok = True)
+    n = min(SIZE, 2000)
+    rng = _rng('diffusion', volcano)
+    dates = pandas.DatetimeIndex(_times(rng, n))
+    spread = pandas.to_timedelta(rng.uniform(1, 90, n), unit = 'D')
+    pandas.DataFrame({
+        'cpx date': dates.strftime('%Y-%m-%d'),
+        'cpx date neg': (dates - spread).strftime('%Y-%m-%d'),
+        'cpx date pos': (dates + spread).strftime('%Y-%m-%d'),
+        'Plag Date': dates.strftime('%Y-%m-%d'),
+        'Plag Date Neg': (dates - spread / 2).strftime('%Y-%m-%d'),
+        'plag date pos': (dates + spread / 2).strftime('%Y-%m-%d'),
+    }).to_csv(os.path.join(diffusion_dir, f'{volcano} Moshrefzadeh.csv'), index = False)
+
+    n = min(SIZE, 10000)
+    rng = _rng('gvp', volcano)
+    starts = pandas.DatetimeIndex(_times(rng, n))
+    with open(os.path.join(data_dir, 'GVP_Emission_Results.csv'), 'w') as f:
+        f.write('Synthetic GVP emission results\n')
+        pandas.DataFrame({
+            'Volcano Name': volcano,
+            'Start Date': starts.strftime('%Y-%m-%d'),
+            'End Date': (starts + pandas.Timedelta(days = 1)).strftime('%Y-%m-%d'),
+            'Total SO2 Mass (kt)': rng.gamma(1, 10, n),
+        }).to_csv(f, index = False)
+
+
+def summary():
+    """Describe the fixture setup, for the benchmark output"""
+    return {
+        'seed': SEED,
+        'window': [WINDOW[0].isoformat(), WINDOW[1].isoformat()],
+        'handlers': [handler.__name__ for _, handler, _ in HANDLERS],
+    }
@@ -0,0 +1,82 @@
+"""
+Time a preevents plot as the number of filters on it grows.
+
+Requests one plot type through /getPlot with 0, 1, ... --max-filters copies
+of --filter in its addArgs, and reports the median time of each, so the cost
+of each additional filter can be seen:
+
+    python benchmarks/preevents_filters.py --live --tag 'Remote Sensing|HotLINK Radiative Power' \
+        --filter '12|datavalue>0' --max-filters 4
+
+The filters are applied by the database, so the numbers only mean something
+with --live (against a copy of the preevents database). Against the fixtures,
+which ignore filters, they measure the rest of the request.
+"""
+
+import argparse
+import sys
+
+import run_generators
+
+
+def parse_args(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__.split('\n\n')[0])
+    parser.add_argument('--tag', default = 'Remote Sensing|HotLINK Radiative Power',
+                        help = 'The plot type. Default: %(default)s')
+    parser.add_argument('--filter', action = 'append', default = None,
+                        help = 'A "variable_id|condition" filter. Repeat to cycle through several. '
+                               'Default: 1|datavalue>0')
+    parser.add_argument('--max-filters', type = int, default = 3, help = 'Default: %(default)s')
+    parser.add_argument('--sizes', default = '100000',
+                        help = 'Comma separated fixture sizes (rows). Ignored with --live. Default: %(default)s')
+    parser.add_argument('--repeat', type = int, default = 5, help = 'Timed runs per plot. Default: %(default)s')
+    parser.add_argument('--warmup', type = int, default = 1, help = 'Untimed runs per plot. Default: %(default)s')
+    parser.add_argument('--volcano', default = 'Pavlof')
+    parser.add_argument('--date-from', default = '2000-01-01', help = 'Default: %(default)s')
+    parser.add_argument('--date-to', default = '2025-12-31', help = 'Default: %(default)s')
+    parser.add_argument('--live', action = 'store_true',
+                        help = 'Use the configured databases instead of the fixtures')
+    return parser.parse_args(argv)
+
+
+def main(argv = None):
+    args = parse_args(argv)
+    filters = args.filter or ['1|datavalue>0']
+    sizes = [None] if args.live else [int(x) for x in args.sizes.split(',') if x]
+
+    app = run_generators.load_app(args.live)
+    client = app.test_client()
+
+    failed = False
+    for size in sizes:
+        if size is not None:
+            run_generators.fixtures.set_size(size)
+            run_generators.clear_caches()
+
+        baseline = None
+        for count in range(args.max_filters + 1):
+            add_args = '&'.join(f"filters={filters[i % len(filters)]}" for i in range(count))
+            query = {
+                'plotType': args.tag,
+                'volcano': args.volcano,
+                'dateFrom': args.date_from,
+                'dateTo': args.date_to,
+                'addArgs': add_args,
+            }
+            result = run_generators.time_plot(client, query, args.repeat, args.warmup, False)
+
+            label = 'live' if size is None else size
+            if result['status'] != 200:
+                print(f"{label:>10} {count:>3} filters {'FAILED':>13} {result['status']}: {result['error'][:60]}")
+                failed = True
+                continue
+
+            baseline = baseline or result['median']
+            print(f"{label:>10} {count:>3} filters {result['median'] * 1000:10.1f} ms "
+                  f"{result['median'] / baseline:6.2f}x {result['bytes']:>12} B")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
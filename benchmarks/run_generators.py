@@ -0,0 +1,280 @@
+"""
+End-to-end benchmark of every registered generator.
+
+Boots the app the same way run_web.py does (create_app, which loads all the
+generator and descriptor plugins), with the database cursors pointed at the
+synthetic fixtures in fixtures.py and DATA_DIR pointed at generated CSV
+files, then times each GEN_FUNCS entry through /getPlot with the result cache
+disabled.
+
+    python benchmarks/run_generators.py --sizes 1000,100000 --output results.json
+    python benchmarks/run_generators.py --baseline results.json --threshold 1.2
+
+With --baseline, any plot type whose median time grew by more than the
+threshold ratio (and by more than --min-delta seconds, to ignore noise on fast
+plots) is reported as a regression, and the script exits with status 1.
+
+With --live, the cursors are left alone, so the configured databases (for
+example a disposable local PostgreSQL/PostGIS loaded with a copy of the data)
+are used instead of the fixtures.
+"""
+
+import argparse
+import datetime
+import importlib
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fixtures  # noqa: E402
+
+# Generators that call external web services, which have no local stand-in.
+SKIP_FUNCS = {'plot_geodesy_dataset'}
+
+
+def parse_args(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', default = '1000,100000',
+                        help = 'Comma separated synthetic catalog sizes (rows). Default: %(default)s')
+    parser.add_argument('--repeat', type = int, default = 5, help = 'Timed runs per plot. Default: %(default)s')
+    parser.add_argument('--warmup', type = int, default = 1, help = 'Untimed runs per plot. Default: %(default)s')
+    parser.add_argument('--volcano', default = 'Pavlof')
+    # The client always sends a date range, so the default covers all the synthetic data.
+    parser.add_argument('--date-from', default = '2000-01-01',
+                        help = 'dateFrom argument (YYYY-MM-DD, or "" for none). Default: %(default)s')
+    parser.add_argument('--date-to', default = '2025-12-31',
+                        help = 'dateTo argument (YYYY-MM-DD, or "" for none). Default: %(default)s')
+    parser.add_argument('--add-args', default = '', help = 'addArgs argument passed to every plot')
+    parser.add_argument('--max-points', default = '', help = 'maxPoints argument passed to every plot')
+    parser.add_argument('--format', choices = ('json', 'columnar'), default = 'json')
+    parser.add_argument('--tags', default = None, help = 'Only run plot types matching this regex')
+    parser.add_argument('--cold', action = 'store_true',
+                        help = 'Clear in-process caches (anything with cache_clear()) before every run')
+    parser.add_argument('--live', action = 'store_true',
+                        help = 'Use the configured databases instead of the fixtures')
+    parser.add_argument('--data-dir', default = None,
+                        help = 'Where to write the synthetic data files. Default: a temporary directory')
+    parser.add_argument('--output', default = None, help = 'Write the results to this JSON file')
+    parser.add_argument('--baseline', default = None, help = 'Compare against this earlier results file')
+    parser.add_argument('--threshold', type = float, default = 1.2,
+                        help = 'Slowdown ratio counted as a regression. Default: %(default)s')
+    parser.add_argument('--min-delta', type = float, default = 0.005,
+                        help = 'Ignore slowdowns smaller than this many seconds. Default: %(default)s')
+    return parser.parse_args(argv)
+
+
+def load_app(live):
+    """Import the app with fixtures installed, and run create_app()"""
+    try:
+        importlib.import_module('MultiplotWeb.config')
+    except ImportError:
+        if live:
+            raise
+        import MultiplotWeb
+        config = fixtures.standin_config()
+        sys.modules['MultiplotWeb.config'] = config
+        MultiplotWeb.config = config
+
+    from MultiplotWeb import utils, create_app
+    if not live:
+        fixtures.install(utils)
+
+    return create_app()
+
+
+def clear_caches():
+    """Clear the result and file caches, and every memoized function in the app"""
+    from MultiplotWeb import cache, filecache
+    cache.RESULTS.clear()
+    filecache.FILES.clear()
+
+    for name, module in list(sys.modules.items()):
+        if not name.startswith('MultiplotWeb') or module is None:
+            continue
+        for value in list(vars(module).values()):
+            if isinstance(value, type):
+                continue
+            cache_clear = getattr(value, 'cache_clear', None)
+            if callable(cache_clear):
+                cache_clear()
+
+
+def server_timing(header):
+    """Parse a Server-Timing header into {phase: seconds}"""
+    phases = {}
+    for item in (header or '').split(','):
+        match = re.match(r'\s*([^;]+);dur=([\d.]+)', item)
+        if match:
+            phases[match.group(1)] = float(match.group(2)) / 1000
+    return phases
+
+
+def time_plot(client, query, repeat, warmup, cold):
+    from MultiplotWeb import cache
+
+    durations = []
+    phases = {}
+    response = None
+    for run in range(warmup + repeat):
+        cache.RESULTS.clear()
+        if cold:
+            clear_caches()
+
+        t1 = time.perf_counter()
+        response = client.get('/getPlot', query_string = query)
+        body = response.get_data()
+        elapsed = time.perf_counter() - t1
+
+        if response.status_code != 200:
+            return {'status': response.status_code, 'error': body.decode(errors = 'replace')[:500]}
+
+        if run < warmup:
+            continue
+
+        durations.append(elapsed)
+        for phase, duration in server_timing(response.headers.get('Server-Timing')).items():
+            phases.setdefault(phase, []).append(duration)
+
+    durations.sort()
+    return {
+        'status': 200,
+        'bytes': len(body),
+        'decimated': response.headers.get('X-Decimated'),
+        'runs': durations,
+        'min': durations[0],
+        'median': statistics.median(durations),
+        'p95': durations[min(int(len(durations) * 0.95), len(durations) - 1)],
+        'phases': {phase: statistics.median(values) for phase, values in phases.items()},
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd = ROOT, capture_output = True,
+                              text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold, min_delta):
+    """Return the (tag, size, baseline median, median) of each regression"""
+    previous = {
+        (item['tag'], item['size']): item
+        for item in baseline['results']
+        if item.get('status') == 200
+    }
+
+    regressions = []
+    for item in results:
+        before = previous.get((item['tag'], item['size']))
+        if before is None:
+            continue
+        if item.get('status') != 200:
+            regressions.append((item['tag'], item['size'], before['median'], None))
+            continue
+        if (item['median'] > before['median'] * threshold
+                and item['median'] - before['median'] > min_delta):
+            regressions.append((item['tag'], item['size'], before['median'], item['median']))
+
+    return regressions
+
+
+def main(argv = None):
+    args = parse_args(argv)
+    sizes = [int(x) for x in args.sizes.split(',') if x]
+
+    app = load_app(args.live)
+    from MultiplotWeb import config, generator
+
+    tags = sorted(
+        tag for tag, func in generator.GEN_FUNCS.items()
+        if (args.live or func.__name__ not in SKIP_FUNCS)
+        and (args.tags is None or re.search(args.tags, tag))
+    )
+
+    query = {
+        'volcano': args.volcano,
+        'dateFrom': args.date_from,
+        'dateTo': args.date_to,
+        'addArgs': args.add_args,
+    }
+    if args.max_points:
+        query['maxPoints'] = args.max_points
+    if args.format == 'columnar':
+        query['format'] = 'columnar'
+
+    data_root = args.data_dir or tempfile.mkdtemp(prefix = 'multiplot-bench-')
+    client = app.test_client()
+    results = []
+
+    for size in sizes:
+        fixtures.set_size(size)
+        # Nothing cached from the previous size may leak into this one.
+        clear_caches()
+        if not args.live:
+            data_dir = os.path.join(data_root, str(size))
+            fixtures.write_data_files(data_dir, args.volcano)
+            config.DATA_DIR = data_dir
+
+        for tag in tags:
+            result = time_plot(client, dict(query, plotType = tag), args.repeat, args.warmup, args.cold)
+            result.update({'tag': tag, 'size': size})
+            results.append(result)
+
+            if result['status'] == 200:
+                print(f"{size:>10} {tag:<60} {result['median'] * 1000:10.1f} ms {result['bytes']:>12} B")
+            else:
+                print(f"{size:>10} {tag:<60} {'FAILED':>13} {result['status']}: {result['error'][:60]}")
+
+    output = {
+        'meta': {
+            'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'live': args.live,
+            'cold': args.cold,
+            'volcano': args.volcano,
+            'query': query,
+            'sizes': sizes,
+            'repeat': args.repeat,
+            'warmup': args.warmup,
+            'fixtures': None if args.live else fixtures.summary(),
+        },
+        'results': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent = 2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        regressions = compare(results, baseline, args.threshold, args.min_delta)
+        for tag, size, before, after in regressions:
+            if after is None:
+                print(f"REGRESSION {tag} ({size} rows): failed, was {before * 1000:.1f} ms")
+            else:
+                print(f"REGRESSION {tag} ({size} rows): {before * 1000:.1f} ms -> {after * 1000:.1f} ms "
+                      f"({after / before:.2f}x)")
+
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,43 @@
+"""
+Convert the SeismoAcoustic catalogs under DATA_DIR to column stores.
+
+Writes a memory-mappable copy (see MultiplotWeb/catalog_store.py) next to
+each *_relocated_catalog.csv and *_temporally_complete_event_list.csv file
+that has no current one. The Seismology (REC) and (TC) plots read the copy
+instead of parsing the CSV. Run it whenever the catalogs are updated; until
+then the plots keep reading the updated CSV files directly:
+
+    python convert_catalogs.py
+"""
+
+import argparse
+import glob
+import os
+
+from MultiplotWeb import config, catalog_store
+
+CATALOG_PATTERNS = (
+    '*_relocated_catalog.csv',
+    '*_temporally_complete_event_list.csv',
+)
+
+
+def find_catalogs(data_dir):
+    seismo_dir = os.path.join(data_dir, "SeismoAcoustic_Data")
+    for pattern in CATALOG_PATTERNS:
+        yield from sorted(glob.glob(os.path.join(seismo_dir, '*', pattern)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = __doc__.split('\n\n')[0])
+    parser.add_argument('--data-dir', default = config.DATA_DIR,
+                        help = 'The data directory. Default: DATA_DIR from the config')
+    parser.add_argument('--force', action = 'store_true',
+                        help = 'Convert every catalog, even those with a current copy')
+    args = parser.parse_args()
+
+    for csv_path in find_catalogs(args.data_dir):
+        if catalog_store.convert(csv_path, force = args.force):
+            print(f"Converted {csv_path}")
+        else:
+            print(f"Up to date: {csv_path}")